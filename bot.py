@@ -1,709 +1,4196 @@
-import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from telegram.request import HTTPXRequest
+import time
+# زمان‌های راه‌اندازی برای --profile-startup: [(مرحله، perf_counter)]
+STARTUP_MARKS = [('شروع import', time.perf_counter())]
+
+import asyncio
+import contextlib
+import copy
 import datetime
-import pytz
+import functools
+import heapq
+import hashlib
+import hmac
+import itertools
 import json
+import logging
+import marshal
+import mmap
 import os
+import re
+import shutil
+import signal
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+STARTUP_MARKS.append(('import کتابخانه استاندارد', time.perf_counter()))
+
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram.ext import Application, ApplicationHandlerStop, BaseRateLimiter, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
+STARTUP_MARKS.append(('import telegram و dotenv', time.perf_counter()))
+
+# بارگذاری تنظیمات
+load_dotenv()
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+TIMEZONE = ZoneInfo(os.getenv('TIMEZONE', 'Asia/Tehran'))
+
+# تنظیم logging
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# فایل‌های ذخیره داده‌ها
+DATA_FILE = os.getenv('DATA_FILE', 'user_data.json')
+DB_FILE = os.getenv('DB_FILE', 'user_data.sqlite3')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', '5'))
+# بعد از شروع ربات این تعداد از کاربرای اخیراً فعال در پس‌زمینه توی کش خونده میشن (0 = خاموش)
+CACHE_WARMUP = int(os.getenv('CACHE_WARMUP', '0'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+IO_QUEUE_SIZE = int(os.getenv('IO_QUEUE_SIZE', '256'))
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', str(8 * 1024 * 1024)))
+# خاموش شدن: حداکثر صبر برای پردازش آپدیت‌های دریافت‌شده، و فایل وضعیت داغ برای پروسه بعدی ('' = خاموش)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '20'))
+HANDOFF_FILE = os.getenv('HANDOFF_FILE', 'user_data.handoff')
+# export/import/repair-streaks: تعداد رکورد هر SELECT یا تراکنش
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# برنامه‌های Boot Camp: هر فایل JSON این پوشه یک برنامه؛ تغییرات هر چند ثانیه خونده میشن
+PROGRAMS_DIR = os.getenv('PROGRAMS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs'))
+DEFAULT_PROGRAM = os.getenv('DEFAULT_PROGRAM', 'telc-b2')
+PROGRAMS_POLL_INTERVAL = float(os.getenv('PROGRAMS_POLL_INTERVAL', '30'))
+
+# حالت اجرا: polling یا webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', os.getenv('RENDER_EXTERNAL_URL', ''))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# تلگرام برای secret_token فقط A-Za-z0-9_- و حداکثر 256 کاراکتر قبول می‌کنه؛ مقدار
+# تولیدشده Render تضمینی نداره، پس hash hex اون هم به تلگرام داده میشه هم چک میشه
+WEBHOOK_SECRET_TOKEN = hashlib.sha256(WEBHOOK_SECRET.encode()).hexdigest() if WEBHOOK_SECRET else ''
+HTTP_HOST = os.getenv('HTTP_HOST', '0.0.0.0')
+HTTP_PORT = int(os.getenv('PORT', '8080'))
+# در حالت polling اگه تنظیم بشه، /metrics روی این پورت باز میشه
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# با --profile-startup (یا PROFILE_STARTUP=1) زمان مراحل راه‌اندازی تا اولین آپدیت لاگ میشه
+PROFILE_STARTUP = '--profile-startup' in sys.argv or os.getenv('PROFILE_STARTUP') == '1'
+
+# چند پروسه: در حالت webhook با WORKERS > 1، این پروسه فقط آپدیت‌ها رو
+# بین workerها پخش می‌کنه. SHARD_* و WORKER_SOCKET رو خود dispatcher تنظیم می‌کنه.
+# محدودیت: رتبه‌بندی هر worker فقط کاربرای shard خودشه (show_leaderboard).
+WORKERS = int(os.getenv('WORKERS', '1'))
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', '0'))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+WORKER_SOCKET = os.getenv('WORKER_SOCKET', '')
+
+# یادآورها - زیر سقف ~30 پیام در ثانیه تلگرام
+REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', '1') == '1'
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+# گزارش هفتگی: تعداد کاربر هر دسته (بعد از crash حداکثر همین‌قدر دوباره فرستاده میشه)
+WEEKLY_REPORT_BATCH = int(os.getenv('WEEKLY_REPORT_BATCH', '200'))
+
+# اتصال به Bot API: poolهای جدا برای getUpdates و ارسال پیام
+SEND_POOL_SIZE = int(os.getenv('SEND_POOL_SIZE', '32'))
+SEND_TIMEOUT = float(os.getenv('SEND_TIMEOUT', '15'))
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '10'))
+POOL_TIMEOUT = float(os.getenv('POOL_TIMEOUT', '10'))
+GET_UPDATES_TIMEOUT = float(os.getenv('GET_UPDATES_TIMEOUT', '30'))
+
+# محدودیت ارسال تلگرام: ~30 پیام در ثانیه کل، ~1 پیام در ثانیه برای هر چت
+RATE_LIMITER_ENABLED = os.getenv('RATE_LIMITER_ENABLED', '1') == '1'
+GLOBAL_RATE = float(os.getenv('GLOBAL_RATE', '30'))
+PER_CHAT_RATE = float(os.getenv('PER_CHAT_RATE', '1'))
+PER_CHAT_BURST = int(os.getenv('PER_CHAT_BURST', '5'))
+MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
+
+# قوانین Boot Camp
+DAILY_PENALTY = 50000
+ROLLOVER_BATCH_SIZE = int(os.getenv('ROLLOVER_BATCH_SIZE', '1000'))
+# آپدیت‌های تکراری (ارسال دوباره تلگرام بعد از timeout): چند ثانیه و چند شناسه یادمون بمونه
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', '600'))
+DEDUP_SIZE = int(os.getenv('DEDUP_SIZE', '100000'))
+
+# ============ متریک‌ها ============
+
+class Metrics:
+    """شمارنده‌ها، هیستوگرام‌ها و gaugeها با خروجی متنی Prometheus"""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._help = {}
+        # name -> {labels: value}
+        self._counters = {}
+        # name -> {labels: [شمارش هر bucket, جمع, تعداد]}
+        self._histograms = {}
+        # name -> تابعی که موقع scrape مقدار رو برمی‌گردونه
+        self._gauges = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = self._key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = self._key(labels)
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, func, help_text=''):
+        self._gauges[name] = func
+        if help_text:
+            self.describe(name, help_text)
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for k, v in pairs:
+            v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{k}="{v}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = []
+        
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        for name, series in sorted(self._counters.items()):
+            header(name, 'counter')
+            for key, value in series.items():
+                lines.append(f"{name}{self._labels(key)} {value}")
+        for name, series in sorted(self._histograms.items()):
+            header(name, 'histogram')
+            for key, (buckets, total, count) in series.items():
+                for bound, bucket_count in zip(self.BUCKETS, buckets):
+                    lines.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{name}_bucket{self._labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._labels(key)} {total}")
+                lines.append(f"{name}_count{self._labels(key)} {count}")
+        for name, func in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            header(name, 'gauge')
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('bot_handler_seconds', "زمان اجرای هر handler (منو یا پیشوند callback)")
+metrics.describe('bot_handler_errors_total', "تعداد خطاهای handlerها")
+metrics.describe('bot_store_seconds', "زمان عملیات ذخیره‌سازی روی thread دیسک")
+metrics.describe('bot_telegram_request_seconds', "زمان درخواست‌های Bot API")
+metrics.describe('bot_telegram_requests_total', "درخواست‌های Bot API بر اساس endpoint و status")
+metrics.describe('bot_telegram_retries_total', "تلاش‌های دوباره بعد از RetryAfter (429)")
+
+def instrument_handler(func):
+    """اندازه‌گیری زمان و خطای یک handler تلگرام"""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        query = update.callback_query
+        if query is not None and query.data:
+            name = 'callback:' + query.data.split('_', 1)[0]
+        else:
+            name = func.__name__
+        try:
+            with metrics.time('bot_handler_seconds', handler=name):
+                return await func(update, context)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=name)
+            raise
+    return wrapper
+
+# ============ رکورد کاربر ============
+
+# کلید بیت‌های چک‌لیست روی دیسک؛ عنوان هر مورد از برنامه کاربر میاد (Program.checklist)
+CHECKLIST_ITEMS = ('block1', 'block2', 'sleep')
+CHECKLIST_BITS = MappingProxyType({item: 1 << i for i, item in enumerate(CHECKLIST_ITEMS)})
+# تاریخچه روزانه (UserRecord.activity): هر روز چهار بیت از یک عدد صحیح، روز
+# start_day در بیت‌های 0 تا 3. سه بیت پایین چک‌لیست روز بسته‌شده است و بیت
+# چهارم یعنی روز ثبت شده («هیچی تیک نزد» با «تاریخچه نداره» فرق داره).
+DAY_RECORDED = 1 << len(CHECKLIST_ITEMS)
+DAY_BITS = len(CHECKLIST_ITEMS) + 1
+DAY_FULL = (1 << DAY_BITS) - 1
+
+def day_lanes(days):
+    """بیت پایین هر روز برای days روز: 0x111...1"""
+    return ((1 << DAY_BITS * days) - 1) // DAY_FULL
+SKILLS = ('reading', 'listening', 'writing', 'speaking')
+SKILL_TITLES = MappingProxyType({
+    'reading': '📚 Reading',
+    'listening': '👂 Listening',
+    'writing': '✍️ Writing',
+    'speaking': '🗣 Speaking',
+})
+# سطح شروع مهارت‌ها به دهم (6 -> 60)
+STARTING_SKILLS = (60, 70, 50, 40)
+
+# تعداد روزهای متفاوت کمه، پس تبدیل‌ها cache میشن
+@functools.lru_cache(maxsize=4096)
+def day_number(date_str):
+    """'YYYY-MM-DD' -> شماره روز (date.toordinal)؛ تاریخ خالی -> 0"""
+    return datetime.date.fromisoformat(date_str).toordinal() if date_str else 0
+
+@functools.lru_cache(maxsize=4096)
+def day_str(number):
+    return datetime.date.fromordinal(number).isoformat() if number else None
+
+
+# بخش‌های آزمون telc B2: (کلید، عنوان، حداکثر امتیاز)
+MOCK_SECTIONS = (
+    ('lesen', '📖 Leseverstehen', 75),
+    ('sprachbausteine', '🧩 Sprachbausteine', 30),
+    ('hoeren', '👂 Hörverstehen', 75),
+    ('schreiben', '✍️ Schriftlicher Ausdruck', 45),
+    ('sprechen', '🗣 Mündliche Prüfung', 75),
+)
+MOCK_TOTAL = sum(max_points for _, _, max_points in MOCK_SECTIONS)
+# قبولی: 60% بخش کتبی و 60% شفاهی
+MOCK_WRITTEN_PASS = 135
+MOCK_ORAL_PASS = 45
+MOCK_ROLLING_WINDOW = 3
+
+# latest/best/rolling: tuple به ترتیب MOCK_SECTIONS
+MockSummary = namedtuple('MockSummary', 'count latest best rolling best_total')
+
+def mock_rolling(history):
+    window = history[-MOCK_ROLLING_WINDOW:]
+    return tuple(sum(column) / len(window) for column in zip(*(scores for _, scores in window)))
+
+def summarize_mock_tests(history):
+    """خلاصه کل تاریخچه (فقط موقع بارگذاری رکورد)"""
+    if not history:
+        return None
+    columns = list(zip(*(scores for _, scores in history)))
+    return MockSummary(
+        count=len(history),
+        latest=history[-1][1],
+        best=tuple(max(column) for column in columns),
+        rolling=mock_rolling(history),
+        best_total=max(sum(scores) for _, scores in history),
+    )
+
+def extend_mock_summary(summary, history):
+    """خلاصه بعد از اضافه شدن آخرین آزمون history - بدون مرور کل تاریخچه"""
+    scores = history[-1][1]
+    if summary is None:
+        return MockSummary(1, scores, scores, mock_rolling(history), sum(scores))
+    return MockSummary(
+        count=summary.count + 1,
+        latest=scores,
+        best=tuple(map(max, summary.best, scores)),
+        rolling=mock_rolling(history),
+        best_total=max(summary.best_total, sum(scores)),
+    )
+
+def mock_passed(scores):
+    # بخش آخر MOCK_SECTIONS شفاهیه، بقیه کتبی
+    written = sum(scores[:-1])
+    return written >= MOCK_WRITTEN_PASS and scores[-1] >= MOCK_ORAL_PASS
+
+def mock_test_from_dict(entry):
+    """(روز، امتیازها) از فرمت dict؛ ورودی خراب (بدون date/scores یا با نوع غلط) -> None"""
+    try:
+        day = day_number(entry['date'])
+        scores = entry['scores']
+        return (day, tuple(int(scores.get(key, 0)) for key, _, _ in MOCK_SECTIONS)) if day else None
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+# گزارش هفتگی: هفته جمعه تا پنجشنبه است و با بستن پنجشنبه بسته میشه.
+# شماره روز (toordinal) یک = دوشنبه، پس weekday برابر (day + 6) % 7 است.
+REPORT_WEEK_END = 3
+# وضعیت کاربر اول هفته؛ skills به دهم مثل UserRecord.skills
+WeekBase = namedtuple('WeekBase', 'streak total_days penalty skills')
+# خلاصه هفته بسته‌شده (day = پنجشنبه آخر هفته)؛ تا بسته شدن هفته بعد می‌مونه
+WeekReport = namedtuple('WeekReport', 'day days_completed streak_start streak_end penalty skills_delta')
+
+def week_base_from_dict(data):
+    skills = data.get('skills') or {}
+    return WeekBase(data['streak'], data['total_days'], data['penalty'],
+                    tuple(round(skills.get(skill, 0) * 10) for skill in SKILLS))
+
+def week_report_from_dict(data):
+    skills = data.get('skills') or {}
+    return WeekReport(day_number(data['date']), data['days'], data['streak_start'], data['streak'],
+                      data['penalty'], tuple(round(skills.get(skill, 0) * 10) for skill in SKILLS))
+
+
+# یک اشتباه در دفتر + وضعیت مرور SM-2 (ease به صدم: 250 یعنی 2.5).
+# immutable است؛ بعد از مرور با _replace جایگزین میشه.
+ErrorEntry = namedtuple('ErrorEntry', 'id text skill topic created_day due_day interval ease reps')
+
+def error_entry_from_dict(data, position):
+    """ورودی errors از فرمت dict؛ ورودی‌های قدیمی فقط یک رشته بودن"""
+    if isinstance(data, str):
+        return ErrorEntry(position, data, '', '', 0, 0, 0, 250, 0)
+    return ErrorEntry(
+        id=position,
+        text=data.get('text', ''),
+        skill=data.get('skill', ''),
+        topic=data.get('topic', ''),
+        created_day=day_number(data.get('created')),
+        due_day=day_number(data.get('due')),
+        interval=data.get('interval', 0),
+        ease=data.get('ease', 250),
+        reps=data.get('reps', 0),
+    )
+
+def error_entry_to_dict(entry):
+    return {
+        'id': entry.id, 'text': entry.text, 'skill': entry.skill, 'topic': entry.topic,
+        'created': day_str(entry.created_day), 'due': day_str(entry.due_day),
+        'interval': entry.interval, 'ease': entry.ease, 'reps': entry.reps,
+    }
+
+def review_error(entry, quality, today):
+    """SM-2: quality از 0 (اصلاً یادم نبود) تا 5 (خیلی راحت)"""
+    if quality < 3:
+        reps, interval = 0, 1
+    else:
+        reps = entry.reps + 1
+        interval = 1 if reps == 1 else 6 if reps == 2 else round(entry.interval * entry.ease / 100)
+    ease = max(130, entry.ease + 10 - (5 - quality) * (8 + (5 - quality) * 2))
+    return entry._replace(due_day=today + interval, interval=interval, ease=ease, reps=reps)
+
+_WORD = re.compile(r'\w\w+')
+
+def search_tokens(text):
+    return set(_WORD.findall(text.lower()))
+
+
+class ErrorIndex:
+    """ایندکس جستجو و صف مرور دفتر اشتباهات یک کاربر
+
+    از روی record.errors ساخته میشه و ذخیره نمیشه. postings: کلمه ->
+    شناسه اشتباه‌ها؛ due: heap از (روز مرور، شناسه). بعد از هر مرور یک
+    جفت جدید push میشه و جفت قدیمی وقتی به سر heap رسید دور ریخته میشه.
+    """
+
+    __slots__ = ('postings', 'due')
+
+    def __init__(self, entries):
+        self.postings = {}
+        self.due = [(entry.due_day, entry.id) for entry in entries]
+        heapq.heapify(self.due)
+        for entry in entries:
+            self._index(entry)
+
+    def _index(self, entry):
+        for token in search_tokens(f"{entry.text} {entry.topic}"):
+            self.postings.setdefault(token, set()).add(entry.id)
+
+    def add(self, entry):
+        self._index(entry)
+        heapq.heappush(self.due, (entry.due_day, entry.id))
+
+    def reschedule(self, entry):
+        heapq.heappush(self.due, (entry.due_day, entry.id))
+
+    def search(self, query):
+        """شناسه اشتباه‌هایی که همه کلمات query رو دارن، جدیدترین اول"""
+        postings = [self.postings.get(token, set()) for token in search_tokens(query)]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        return sorted(set.intersection(*postings), reverse=True)
+
+    def next_due(self, entries):
+        """اولین اشتباهی که نوبت مرورش رسیده (یا اولین مرور بعدی)؛ O(log n)"""
+        while self.due:
+            due_day, entry_id = self.due[0]
+            if entries[entry_id - 1].due_day == due_day:
+                return entries[entry_id - 1]
+            heapq.heappop(self.due)
+        return None
+
+
+class UserRecord:
+    """اطلاعات یک کاربر در حافظه - خیلی جمع‌وجورتر از dict تودرتوی JSON
+
+    چک‌لیست یک عدد بیتی است (CHECKLIST_BITS)، تاریخ‌ها شماره روز
+    (صفر یعنی خالی) و مهارت‌ها عدد صحیح به دهم (6.1 -> 61). لیست‌ها
+    tuple هستن تا رکوردهای خالی حافظه اضافه نگیرن؛ برای اضافه کردن
+    مثلاً record.errors += (item,). روی دیسک همون فرمت dict قبلی
+    ذخیره میشه (to_dict / from_dict) و کلیدهای ناشناخته هم حفظ میشن.
+
+    week_base وضعیت اول هفته گزارش و week_report خلاصه آخرین هفته
+    بسته‌شده است (close_week). activity تاریخچه چک‌لیست همه روزهای
+    بسته‌شده از start_day است (DAY_BITS بیت برای هر روز)؛ کل 12 هفته
+    کمتر از 50 بایت میشه و روی دیسک به شکل hex ذخیره میشه. program
+    id برنامه Boot Camp کاربره (خالی یعنی DEFAULT_PROGRAM).
+
+    mock_tests تاریخچه append-only آزمون‌هاست: (شماره روز، امتیازها به
+    ترتیب MOCK_SECTIONS). mock_summary خلاصه‌اش است که فقط با
+    add_mock_test به‌روز میشه و ذخیره نمیشه. errors هم tuple از
+    ErrorEntry است (شناسه = جایگاه + 1) و ErrorIndex اون فقط وقتی
+    دفتر باز میشه ساخته میشه.
+    """
+
+    __slots__ = (
+        'name', 'current_week', 'streak', 'total_days', 'penalty', 'checklist', 'skills',
+        'mock_tests', 'errors', 'completed_weeks',
+        'last_checklist_day', 'start_day', 'last_closed_day', 'last_streak_day', 'extra',
+        'mock_summary', 'error_index', 'week_base', 'week_report', 'activity', 'program',
+    )
+
+    # کلیدهای فرمت dict که فیلد خودشون رو دارن
+    KEYS = frozenset((
+        'name', 'current_week', 'streak', 'total_days', 'penalty', 'checklist', 'skills',
+        'mock_tests', 'errors', 'completed_weeks',
+        'last_checklist_date', 'start_date', 'last_closed_date', 'last_streak_update',
+        'week_base', 'week_report', 'activity', 'program',
+    ))
+
+    def __init__(self, name='', current_week=1, streak=0, total_days=0, penalty=0, checklist=0,
+                 skills=STARTING_SKILLS, mock_tests=(), errors=(), completed_weeks=(),
+                 last_checklist_day=0, start_day=0, last_closed_day=0, last_streak_day=0,
+                 week_base=None, week_report=None, activity=0, program='', extra=None):
+        self.name = name
+        self.current_week = current_week
+        self.streak = streak
+        self.total_days = total_days
+        self.penalty = penalty
+        self.checklist = checklist
+        self.skills = list(skills)
+        self.mock_tests = tuple(mock_tests)
+        self.mock_summary = summarize_mock_tests(self.mock_tests)
+        self.errors = tuple(errors)
+        self.error_index = None
+        self.completed_weeks = tuple(completed_weeks)
+        self.last_checklist_day = last_checklist_day
+        self.start_day = start_day
+        self.last_closed_day = last_closed_day
+        self.last_streak_day = last_streak_day
+        self.week_base = week_base
+        self.week_report = week_report
+        self.activity = activity
+        self.program = program
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data):
+        # بدون __init__ و kwargs: برای 100 هزار رکورد موقع بارگذاری محسوسه
+        record = cls.__new__(cls)
+        get = data.get
+        record.name = get('name') or ''
+        record.current_week = get('current_week', 1)
+        record.streak = get('streak', 0)
+        record.total_days = get('total_days', 0)
+        record.penalty = get('penalty', 0)
+        checklist = get('checklist')
+        bits = 0
+        if checklist:
+            for item, bit in CHECKLIST_BITS.items():
+                if checklist.get(item):
+                    bits |= bit
+        record.checklist = bits
+        skills = get('skills') or {}
+        record.skills = [round(skills.get(skill, 0) * 10) for skill in SKILLS]
+        mock_tests = []
+        for entry in get('mock_tests') or ():
+            mock_test = mock_test_from_dict(entry)
+            if mock_test is None:
+                # یک آزمون خراب نباید بارگذاری یا import کل رکورد رو خراب کنه
+                logger.warning(f"⚠️ Mock Test نامعتبر کاربر {record.name!r} نادیده گرفته شد: {entry!r}")
+            else:
+                mock_tests.append(mock_test)
+        record.mock_tests = tuple(mock_tests)
+        record.mock_summary = summarize_mock_tests(record.mock_tests)
+        record.errors = tuple(
+            error_entry_from_dict(entry, position) for position, entry in enumerate(get('errors') or (), 1)
+        )
+        record.error_index = None
+        record.completed_weeks = tuple(get('completed_weeks') or ())
+        record.last_checklist_day = day_number(get('last_checklist_date'))
+        record.start_day = day_number(get('start_date'))
+        record.last_closed_day = day_number(get('last_closed_date'))
+        record.last_streak_day = day_number(get('last_streak_update'))
+        week_base = get('week_base')
+        record.week_base = week_base_from_dict(week_base) if week_base else None
+        week_report = get('week_report')
+        record.week_report = week_report_from_dict(week_report) if week_report else None
+        record.activity = int(get('activity') or '0', 16)
+        record.program = get('program') or ''
+        unknown = data.keys() - cls.KEYS
+        record.extra = {key: data[key] for key in unknown} if unknown else None
+        return record
+
+    def to_dict(self):
+        data = {
+            'name': self.name,
+            'current_week': self.current_week,
+            'streak': self.streak,
+            'total_days': self.total_days,
+            'checklist': self.checklist_state(),
+            'penalty': self.penalty,
+            'mock_tests': [
+                {'date': day_str(day), 'scores': {key: score for (key, _, _), score in zip(MOCK_SECTIONS, scores)}}
+                for day, scores in self.mock_tests
+            ],
+            'errors': [error_entry_to_dict(entry) for entry in self.errors],
+            'skills': {skill: level / 10 for skill, level in zip(SKILLS, self.skills)},
+            'last_checklist_date': day_str(self.last_checklist_day),
+            'start_date': day_str(self.start_day),
+            'last_closed_date': day_str(self.last_closed_day),
+            'completed_weeks': list(self.completed_weeks),
+        }
+        if self.last_streak_day:
+            data['last_streak_update'] = day_str(self.last_streak_day)
+        if self.week_base:
+            base = self.week_base
+            data['week_base'] = {
+                'streak': base.streak, 'total_days': base.total_days, 'penalty': base.penalty,
+                'skills': {skill: level / 10 for skill, level in zip(SKILLS, base.skills)},
+            }
+        if self.week_report:
+            report = self.week_report
+            data['week_report'] = {
+                'date': day_str(report.day), 'days': report.days_completed,
+                'streak_start': report.streak_start, 'streak': report.streak_end, 'penalty': report.penalty,
+                'skills': {skill: delta / 10 for skill, delta in zip(SKILLS, report.skills_delta)},
+            }
+        if self.activity:
+            data['activity'] = format(self.activity, 'x')
+        if self.program:
+            data['program'] = self.program
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        clone = copy.copy(self)
+        clone.skills = list(self.skills)
+        clone.extra = copy.deepcopy(self.extra)
+        clone.error_index = None
+        return clone
+
+    def add_mock_test(self, day, scores):
+        self.mock_tests += ((day, tuple(scores)),)
+        self.mock_summary = extend_mock_summary(self.mock_summary, self.mock_tests)
+
+    def errors_index(self):
+        if self.error_index is None:
+            self.error_index = ErrorIndex(self.errors)
+        return self.error_index
+
+    def add_error(self, text, skill, topic, today):
+        """اشتباه جدید؛ اولین مرور فرداست"""
+        entry = ErrorEntry(len(self.errors) + 1, text, skill, topic, today, today + 1, 0, 250, 0)
+        self.errors += (entry,)
+        if self.error_index is not None:
+            self.error_index.add(entry)
+        return entry
+
+    def replace_error(self, entry):
+        position = entry.id - 1
+        self.errors = self.errors[:position] + (entry,) + self.errors[position + 1:]
+        if self.error_index is not None:
+            self.error_index.reschedule(entry)
+
+    def checked(self, item):
+        return bool(self.checklist & CHECKLIST_BITS[item])
+
+    def toggle(self, item):
+        self.checklist ^= CHECKLIST_BITS[item]
+
+    def set_checked(self, item, value):
+        """تیک با وضعیت مقصد؛ خروجی True یعنی چیزی عوض شد"""
+        before = self.checklist
+        if value:
+            self.checklist |= CHECKLIST_BITS[item]
+        else:
+            self.checklist &= ~CHECKLIST_BITS[item]
+        return self.checklist != before
+
+    def checked_count(self):
+        return self.checklist.bit_count()
+
+    def checklist_state(self):
+        return {item: bool(self.checklist & bit) for item, bit in CHECKLIST_BITS.items()}
+
+    def skill_level(self, skill):
+        return self.skills[SKILLS.index(skill)] / 10
+
+    def record_day(self, day, checklist):
+        """ثبت چک‌لیست یک روز بسته‌شده در activity"""
+        offset = day - self.start_day
+        if self.start_day and offset >= 0:
+            self.activity |= (checklist | DAY_RECORDED) << DAY_BITS * offset
+
+    def day_activity(self, day):
+        """بیت‌های یک روز از activity؛ صفر یعنی ثبت نشده"""
+        offset = day - self.start_day
+        if not self.start_day or offset < 0:
+            return 0
+        return (self.activity >> DAY_BITS * offset) & DAY_FULL
+
+    def days_completed(self, first, last):
+        """تعداد روزهای کامل از first تا last (هر دو شامل) با یک popcount"""
+        first = max(first - self.start_day, 0)
+        last -= self.start_day
+        if not self.start_day or last < first:
+            return 0
+        window = self.activity >> DAY_BITS * first
+        # بیت پایین هر روز فقط وقتی می‌مونه که همه بیت‌هاش یک باشه
+        full = window & day_lanes(last - first + 1)
+        for shift in range(1, DAY_BITS):
+            full &= window >> shift
+        return full.bit_count()
+
+    def activity_streak(self, day):
+        """Streak از روی تاریخچه: روزهای کامل پشت‌سرهم تا day (برای بازسازی Streak)"""
+        streak = 0
+        while self.day_activity(day - streak) == DAY_FULL:
+            streak += 1
+        return streak
+
+    def __repr__(self):
+        return f"UserRecord({self.to_dict()!r})"
+
+
+def record_hook(obj):
+    """object_hook برای json: هر رکورد کاربر همون لحظه parse شدن UserRecord میشه
+
+    این‌طوری dict تودرتوی همه کاربرا هیچ‌وقت یک‌جا توی حافظه ساخته نمیشه.
+    """
+    if 'streak' in obj and 'checklist' in obj:
+        return UserRecord.from_dict(obj)
+    return obj
+
+
+# ============ لایه ذخیره‌سازی ============
+
+class JsonUserStore:
+    """ذخیره کاربران در فایل JSON + ژورنال append-only برای تغییرات
+
+    هر ذخیره فقط چند خط به ژورنال اضافه می‌کنه. وقتی ژورنال بزرگ شد،
+    کل داده‌ها با temp-file + fsync + rename به صورت اتمیک توی snapshot
+    نوشته میشه و ژورنال خالی میشه. اگه وسط نوشتن crash کنیم، snapshot
+    قبلی سالم می‌مونه و ژورنال دوباره اجرا میشه.
+    """
+
+    def __init__(self, path, compact_bytes=JOURNAL_COMPACT_BYTES, readonly=False):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.meta_path = path + '.meta'
+        self.compact_bytes = compact_bytes
+        self.readonly = readonly
+        self._users = self._load_snapshot()
+        replayed = self._replay_journal()
+        if replayed:
+            logger.info(f"📜 {replayed} تغییر از ژورنال بازیابی شد")
+        # readonly (export کنار ربات در حال اجرا): ژورنال فقط خونده میشه
+        self._journal = None if readonly else open(self.journal_path, 'a', encoding='utf-8')
+        self._bulk_loaded = False
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f, object_hook=record_hook)
+            # رکوردهای ناقص (مثلاً بدون streak) رو hook نشناخته
+            return {
+                user_id: record if isinstance(record, UserRecord) else UserRecord.from_dict(record)
+                for user_id, record in loaded.items()
+            }
+        except ValueError as e:
+            # فایل خراب رو پاک نمی‌کنیم؛ بهتره ربات بالا نیاد تا اینکه همه کاربرا حذف بشن
+            raise RuntimeError(f"فایل {self.path} خراب است: {e}") from e
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        count = 0
+        valid_bytes = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # خط آخر نیمه‌کاره (crash وسط append) - از ژورنال حذف میشه
+                    logger.warning(f"⚠️ انتهای ناقص ژورنال بعد از {count} تغییر نادیده گرفته شد")
+                    break
+                self._users[entry['u']] = UserRecord.from_dict(entry['r'])
+                valid_bytes += len(line)
+                count += 1
+        if valid_bytes != os.path.getsize(self.journal_path) and not self.readonly:
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return count
+
+    def get(self, user_id):
+        return self._users.get(str(user_id))
+
+    def put(self, user_id, record):
+        self.put_many([(user_id, record)])
+
+    def put_many(self, items):
+        lines = []
+        for user_id, record in items:
+            self._users[str(user_id)] = record
+            lines.append(json.dumps({'u': str(user_id), 'r': record.to_dict()}, ensure_ascii=False))
+        if not lines:
+            return
+        self._journal.write('\n'.join(lines) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        if self._journal.tell() >= self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """نوشتن اتمیک snapshot و خالی کردن ژورنال"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # رکورد به رکورد، تا کل فایل یک‌جا توی حافظه ساخته نشه
+            f.write('{')
+            for i, (user_id, record) in enumerate(self._users.items()):
+                if i:
+                    f.write(', ')
+                f.write(json.dumps(user_id) + ': ' + json.dumps(record.to_dict(), ensure_ascii=False))
+            f.write('}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._journal.truncate(0)
+        self._journal.seek(0)
+
+    def iter_records(self, batch_size=500):
+        yield from list(self._users.items())
+
+    def iter_recent(self, limit, offset=0):
+        """(user_id, رکورد) کاربرای اخیراً فعال، جدیدترین تیک چک‌لیست اول"""
+        active = ((user_id, record) for user_id, record in self._users.items() if record.last_checklist_day)
+        return heapq.nlargest(offset + limit, active, key=lambda item: item[1].last_checklist_day)[offset:]
+
+    def iter_json(self, batch_size=500):
+        """(user_id, JSON رکورد) برای export"""
+        for user_id, record in list(self._users.items()):
+            yield user_id, json.dumps(record.to_dict(), ensure_ascii=False)
+
+    def load_many(self, items):
+        """import حجیم: بدون ژورنال؛ موقع close یک snapshot کامل نوشته میشه
+
+        با put_many هر چند مگابایت یک compact کامل انجام می‌شد و import
+        فایل بزرگ درجه دو می‌شد.
+        """
+        for user_id, record in items:
+            self._users[str(user_id)] = record
+        self._bulk_loaded = True
+
+    def iter_recipients(self):
+        """(user_id, current_week, program) کاربرانی که ثبت نام رو تموم کردن"""
+        return [
+            (user_id, record.current_week, record.program)
+            for user_id, record in self._users.items() if record.name
+        ]
+
+    def iter_stats(self):
+        """(user_id, name, streak, total_days, penalty, current_week) کاربران ثبت‌نام‌شده"""
+        return [
+            (user_id, record.name, record.streak, record.total_days, record.penalty, record.current_week)
+            for user_id, record in self._users.items() if record.name
+        ]
+
+    def map_batch(self, func, after_key=None, limit=None):
+        """اجرای func روی همه رکوردها و ذخیره تغییرکرده‌ها (همه در حافظه‌ان، پس یک دسته)"""
+        changed = [(user_id, record) for user_id, record in self._users.items() if func(record)]
+        self.put_many(changed)
+        return None, len(self._users), changed
+
+    def week_reports_batch(self, day, after_key=None, limit=500):
+        """مثل SqliteUserStore.week_reports_batch؛ nsmallest به جای مرتب کردن همه کاربرا"""
+        records = heapq.nsmallest(
+            limit,
+            ((user_id, record) for user_id, record in self._users.items()
+             if record.week_report and record.week_report.day == day and user_id > (after_key or '')),
+            key=lambda item: item[0]
+        )
+        return (records[-1][0] if len(records) == limit else None), records
+
+    def count(self):
+        return len(self._users)
+
+    def size_bytes(self):
+        return sum(os.path.getsize(p) for p in (self.path, self.journal_path) if os.path.exists(p))
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def get_meta(self, key, default=None):
+        return self._read_meta().get(key, default)
+
+    def set_meta(self, key, value):
+        """meta در فایل جدا کنار snapshot، با temp-file + rename"""
+        meta = self._read_meta()
+        meta[key] = value
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def close(self):
+        if self._journal is None:
+            return
+        if self._journal.tell() > 0 or self._bulk_loaded:
+            self.compact()
+        self._journal.close()
+
+
+class SqliteUserStore:
+    """ذخیره کاربران در SQLite (حالت WAL) - هر کاربر یک سطر"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            streak INTEGER NOT NULL DEFAULT 0,
+            current_week INTEGER NOT NULL DEFAULT 1,
+            last_checklist_date TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_streak ON users(streak);
+        CREATE INDEX IF NOT EXISTS idx_users_week ON users(current_week);
+        CREATE INDEX IF NOT EXISTS idx_users_checklist_date ON users(last_checklist_date);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            # export کنار ربات در حال اجرا: WAL اجازه میده بدون قفل نوشتن بخونیم
+            uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _row(user_id, record):
+        return (
+            str(user_id),
+            json.dumps(record.to_dict(), ensure_ascii=False),
+            record.streak,
+            record.current_week,
+            day_str(record.last_checklist_day),
+        )
+
+    def get(self, user_id):
+        row = self.conn.execute(
+            'SELECT data FROM users WHERE user_id = ?', (str(user_id),)
+        ).fetchone()
+        return UserRecord.from_dict(json.loads(row[0])) if row else None
+
+    def put(self, user_id, record):
+        self.put_many([(user_id, record)])
+
+    def put_many(self, items):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO users '
+                '(user_id, data, streak, current_week, last_checklist_date) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self._row(user_id, record) for user_id, record in items)
+            )
+
+    def iter_records(self, batch_size=500):
+        cursor = self.conn.execute('SELECT user_id, data FROM users ORDER BY user_id')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for user_id, data in rows:
+                yield user_id, UserRecord.from_dict(json.loads(data))
+
+    def iter_recent(self, limit, offset=0):
+        """(user_id, رکورد) کاربرای اخیراً فعال، جدیدترین تیک چک‌لیست اول"""
+        rows = self.conn.execute(
+            'SELECT user_id, data FROM users WHERE last_checklist_date IS NOT NULL '
+            'ORDER BY last_checklist_date DESC LIMIT ? OFFSET ?', (limit, offset)
+        ).fetchall()
+        return [(user_id, UserRecord.from_dict(json.loads(data))) for user_id, data in rows]
+
+    def iter_json(self, batch_size=500):
+        """(user_id, JSON رکورد) بدون parse، دسته به دسته به ترتیب user_id
+
+        به جای یک cursor باز تا آخر، هر دسته یک SELECT کوتاهه؛ یک تراکنش
+        خواندن چنددقیقه‌ای جلوی checkpoint فایل WAL رو می‌گیره و WAL ربات
+        در حال اجرا مدام بزرگ میشه.
+        """
+        last_key = ''
+        while True:
+            rows = self.conn.execute(
+                'SELECT user_id, data FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                (last_key, batch_size)
+            ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][0]
+
+    def load_many(self, items):
+        """import حجیم: یک دسته در یک تراکنش (همون put_many)"""
+        self.put_many(items)
+
+    def iter_recipients(self):
+        """(user_id, current_week, program) کاربرانی که ثبت نام رو تموم کردن"""
+        return self.conn.execute(
+            "SELECT user_id, current_week, COALESCE(json_extract(data, '$.program'), '') "
+            "FROM users WHERE json_extract(data, '$.name') <> ''"
+        ).fetchall()
+
+    def iter_stats(self):
+        """(user_id, name, streak, total_days, penalty, current_week) کاربران ثبت‌نام‌شده"""
+        return self.conn.execute(
+            "SELECT user_id, json_extract(data, '$.name'), streak, json_extract(data, '$.total_days'), json_extract(data, '$.penalty'), "
+            "current_week FROM users WHERE json_extract(data, '$.name') <> ''"
+        ).fetchall()
+
+    def map_batch(self, func, after_key=None, limit=1000):
+        """اجرای func روی دسته بعدی رکوردها (به ترتیب user_id) و ذخیره تغییرکرده‌ها
+
+        خروجی: (آخرین کلید یا None اگه تموم شد، تعداد خونده‌شده، [(user_id, رکورد)] تغییرکرده‌ها)
+        """
+        rows = self.conn.execute(
+            'SELECT user_id, data FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (after_key or '', limit)
+        ).fetchall()
+        changed = []
+        for user_id, data in rows:
+            record = UserRecord.from_dict(json.loads(data))
+            if func(record):
+                changed.append((user_id, record))
+        self.put_many(changed)
+        last_key = rows[-1][0] if len(rows) == limit else None
+        return last_key, len(rows), changed
+
+    def week_reports_batch(self, day, after_key=None, limit=500):
+        """دسته بعدی کاربرای دارای week_report هفته day، به ترتیب user_id
+
+        خروجی: (آخرین کلید یا None اگه تموم شد، [(user_id, رکورد)]). فیلتر
+        داخل SQLite انجام میشه و فقط رکوردهای لازم parse میشن.
+        """
+        rows = self.conn.execute(
+            "SELECT user_id, data FROM users WHERE user_id > ? "
+            "AND json_extract(data, '$.week_report.date') = ? ORDER BY user_id LIMIT ?",
+            (after_key or '', day_str(day), limit)
+        ).fetchall()
+        records = [(user_id, UserRecord.from_dict(json.loads(data))) for user_id, data in rows]
+        return (rows[-1][0] if len(rows) == limit else None), records
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def size_bytes(self):
+        paths = (self.path, self.path + '-wal')
+        return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value)
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_json_to_sqlite(json_path, store):
+    """انتقال یک‌باره user_data.json به SQLite"""
+    if not os.path.exists(json_path) or store.count() > 0:
+        return 0
+    json_store = JsonUserStore(json_path)
+    count = json_store.count()
+    store.put_many(json_store.iter_records())
+    json_store.close()
+    os.replace(json_path, json_path + '.migrated')
+    if os.path.exists(json_store.journal_path):
+        os.remove(json_store.journal_path)
+    logger.info(f"📦 {count} کاربر از {json_path} به SQLite منتقل شد")
+    return count
+
+
+def open_store(db_file=DB_FILE, data_file=DATA_FILE, readonly=False):
+    """ساخت backend ذخیره‌سازی بر اساس STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'json':
+        return JsonUserStore(data_file, readonly=readonly)
+    if STORAGE_BACKEND == 'sqlite':
+        store = SqliteUserStore(db_file, readonly=readonly)
+        if not readonly:
+            migrate_json_to_sqlite(data_file, store)
+        return store
+    raise ValueError(f"STORAGE_BACKEND نامعتبر: {STORAGE_BACKEND}")
+
+
+# ============ I/O غیرهمزمان ============
+
+class AsyncStore:
+    """اجرای عملیات backend روی یک thread جداگانه تا event loop بلاک نشه
+
+    store می‌تونه خود backend باشه یا تابعی که می‌سازدش (مثل open_store)؛
+    در حالت دوم باز کردن (برای backend json یعنی parse کل فایل) اولین
+    کار thread ذخیره‌سازیه و همزمان با بقیه راه‌اندازی انجام میشه.
+    """
+
+    def __init__(self, store, max_pending=IO_QUEUE_SIZE):
+        self.store = None
+        # یک thread ثابت: ترتیب نوشتن‌ها حفظ میشه و اتصال SQLite فقط از یک thread استفاده میشه
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='store-io')
+        self._opened = self._executor.submit(self._open, store)
+        # صف محدود: اگه دیسک کند باشه، درخواست‌های جدید منتظر می‌مونن
+        self._slots = asyncio.Semaphore(max_pending)
+
+    def _open(self, store):
+        self.store = store() if callable(store) else store
+        STARTUP_MARKS.append(('باز شدن دیتابیس', time.perf_counter()))
+
+    async def wait_open(self):
+        """صبر تا باز شدن backend؛ خطای باز کردن (مثلاً فایل خراب) همین‌جا بالا میاد"""
+        await asyncio.wrap_future(self._opened)
+
+    async def run(self, method, *args):
+        if self.store is None:
+            await self.wait_open()
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            with metrics.time('bot_store_seconds', op=method):
+                return await loop.run_in_executor(self._executor, getattr(self.store, method), *args)
+
+    async def get(self, user_id):
+        return await self.run('get', user_id)
+
+    async def put_many(self, items):
+        return await self.run('put_many', list(items))
+
+    async def count(self):
+        return await self.run('count')
+
+    async def iter_recipients(self):
+        return await self.run('iter_recipients')
+
+    async def iter_stats(self):
+        return await self.run('iter_stats')
+
+    async def iter_recent(self, limit, offset=0):
+        return await self.run('iter_recent', limit, offset)
+
+    async def week_reports_batch(self, day, after_key=None, limit=500):
+        return await self.run('week_reports_batch', day, after_key, limit)
+
+    async def get_meta(self, key, default=None):
+        return await self.run('get_meta', key, default)
+
+    async def set_meta(self, key, value):
+        return await self.run('set_meta', key, value)
+
+    async def map_records(self, func, batch_size=ROLLOVER_BATCH_SIZE, on_change=None):
+        """اجرای func روی همه رکوردهای دیسک، هر دسته یک کار جدا روی thread ذخیره‌سازی
+
+        on_change(user_id, record) برای هر رکورد تغییرکرده روی event loop صدا زده میشه.
+        """
+        after_key = None
+        scanned = changed = 0
+        while True:
+            after_key, batch_scanned, batch_changed = await self.run(
+                'map_batch', func, after_key, batch_size
+            )
+            scanned += batch_scanned
+            changed += len(batch_changed)
+            if on_change:
+                for user_id, record in batch_changed:
+                    on_change(user_id, record)
+            if after_key is None:
+                return scanned, changed
+
+    async def close(self):
+        await self.run('close')
+        self._executor.shutdown(wait=True)
+
+
+# ============ کش کاربران ============
+
+class UserCache:
+    """کش LRU کاربران در حافظه با نوشتن تأخیری (write-behind)"""
+
+    def __init__(self, store, max_size=USER_CACHE_SIZE):
+        self.store = store
+        self.max_size = max_size
+        self._records = OrderedDict()
+        # خوندن‌های در جریان از دیسک، تا یک کاربر دوبار خونده نشه
+        self._loading = {}
+        self._dirty = set()
+        # رکوردهای تغییرکرده‌ای که از کش بیرون رفتن ولی هنوز ذخیره نشدن
+        self._evicted_dirty = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_records = 0
+
+    async def get(self, user_id):
+        key = str(user_id)
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = self._evicted_dirty.pop(key, None)
+        if record is not None:
+            self._dirty.add(key)
+            self._insert(key, record)
+            return record
+        
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(self.store.get(key))
+            try:
+                record = await loading
+            finally:
+                del self._loading[key]
+        else:
+            record = await asyncio.shield(loading)
+        
+        # ممکنه تا وقتی منتظر دیسک بودیم، نسخه جدیدتری توی کش نوشته شده باشه
+        current = self._records.get(key)
+        if current is not None:
+            return current
+        if record is None:
+            return None
+        self._insert(key, record)
+        return record
+
+    def put(self, user_id, record):
+        key = str(user_id)
+        self._evicted_dirty.pop(key, None)
+        self._dirty.add(key)
+        self._insert(key, record)
+
+    def preload(self, items):
+        """گذاشتن رکوردهای خونده‌شده از دیسک در کش (warm-up)؛ خروجی: تعداد
+
+        فقط کاربرایی که الان توی کش یا در حال خوندن نیستن اضافه میشن، به
+        ته صف LRU، و وقتی کش پر شد چیزی بیرون انداخته نمیشه.
+        """
+        added = 0
+        for key, record in items:
+            if len(self._records) >= self.max_size:
+                break
+            if key in self._records or key in self._loading or key in self._evicted_dirty:
+                continue
+            self._records[key] = record
+            self._records.move_to_end(key, last=False)
+            added += 1
+        return added
+
+    def _insert(self, key, record):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_size:
+            old_key, old_record = self._records.popitem(last=False)
+            self.evictions += 1
+            if old_key in self._dirty:
+                self._dirty.discard(old_key)
+                self._evicted_dirty[old_key] = old_record
+
+    def items(self):
+        return list(self._records.items())
+
+    def __contains__(self, user_id):
+        key = str(user_id)
+        return key in self._records or key in self._evicted_dirty
+
+    def dirty_count(self):
+        return len(self._dirty) + len(self._evicted_dirty)
+
+    async def flush(self):
+        """ذخیره دسته‌ای همه رکوردهای تغییرکرده"""
+        batch = dict(self._evicted_dirty)
+        for key in self._dirty:
+            batch[key] = self._records[key]
+        if not batch:
+            return 0
+        self._dirty.clear()
+        self._evicted_dirty.clear()
+        # کپی تا handlerها وسط نوشتن روی thread دیگه رکورد رو تغییر ندن
+        snapshot = {key: record.copy() for key, record in batch.items()}
+        try:
+            await self.store.put_many(snapshot.items())
+        except Exception:
+            # برگردوندن به صف تغییرات برای تلاش بعدی
+            for key, record in batch.items():
+                if key in self._records:
+                    self._dirty.add(key)
+                else:
+                    self._evicted_dirty.setdefault(key, record)
+            raise
+        self.flushes += 1
+        self.flushed_records += len(batch)
+        return len(batch)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._records),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'dirty': self.dirty_count(),
+            'flushes': self.flushes,
+            'flushed_records': self.flushed_records,
+        }
+
+
+# ============ قفل هر کاربر ============
+
+class UserLocks:
+    """قفل asyncio جداگانه برای هر کاربر تا read-modify-write ها روی هم نیفتن"""
+
+    def __init__(self):
+        # user_id -> [lock, تعداد منتظرها]
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, user_id):
+        key = str(user_id)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+# ============ آپدیت‌های تکراری ============
+
+class UpdateDedup:
+    """شناسه‌های دیده‌شده با تاریخ انقضا، حداکثر max_size تا
+
+    TTL برای همه یکیه، پس ترتیب درج همون ترتیب انقضاست و پاک کردن
+    منقضی‌ها فقط از اول OrderedDict انجام میشه (O(1) سرشکن).
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, max_size=DEDUP_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        # key -> زمان انقضا
+        self._seen = OrderedDict()
+
+    def seen(self, *keys):
+        """True اگه یکی از keys قبلاً دیده شده؛ وگرنه همه ثبت میشن"""
+        now = self.clock()
+        while self._seen and next(iter(self._seen.values())) <= now:
+            self._seen.popitem(last=False)
+        if any(key in self._seen for key in keys):
+            return True
+        for key in keys:
+            self._seen[key] = now + self.ttl
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return False
+
+    def dump(self):
+        """[(key, ثانیه باقیمونده تا انقضا)] به ترتیب انقضا، برای پروسه بعدی (handoff)"""
+        now = self.clock()
+        return [(key, expires - now) for key, expires in self._seen.items() if expires > now]
+
+    def load(self, entries):
+        """برگردوندن خروجی dump؛ باید قبل از اولین seen صدا زده بشه تا ترتیب انقضا به هم نخوره"""
+        now = self.clock()
+        for key, remaining in entries:
+            if remaining > 0:
+                self._seen[key] = now + remaining
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+# ============ رتبه‌بندی ============
+
+class FenwickTree:
+    """شمارنده روی خونه‌های 0..size-1: افزودن، جمع پیشوندی و پیدا کردن k-امی، همه O(log n)
+
+    اگه خونه‌ای بیرون از اندازه فعلی اضافه بشه، اندازه دو برابر میشه.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.counts = [0] * size
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def add(self, index, delta):
+        if index >= self.size:
+            self._grow(index + 1)
+        self.counts[index] += delta
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index):
+        """جمع خونه‌های [0, index)"""
+        i = min(index, self.size)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k):
+        """خونه‌ای که k-امین مورد (از صفر، به ترتیب صعودی) توشه"""
+        pos = 0
+        step = 1 << (self.size.bit_length() - 1)
+        while step:
+            if pos + step <= self.size and self.tree[pos + step] <= k:
+                pos += step
+                k -= self.tree[pos]
+            step >>= 1
+        return pos
+
+    def _grow(self, needed):
+        while self.size < needed:
+            self.size *= 2
+        self.counts.extend([0] * (self.size - len(self.counts)))
+        self.tree = [0] + self.counts
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+
+class MetricIndex:
+    """رتبه کاربرها روی یک عدد (مثلاً streak) با FenwickTree روی خونه‌های مقدار
+
+    خونه هر کاربر value // bucket_size است. رتبه = 1 + تعداد کاربرای
+    بهتر (هم‌امتیازها رتبه یکسان دارن)؛ بین هم‌امتیازها در top کسی که
+    زودتر به این مقدار رسیده جلوتره.
+    """
+
+    def __init__(self, bucket_size=1, descending=True):
+        self.bucket_size = bucket_size
+        self.descending = descending
+        self.counts = FenwickTree()
+        # خونه -> {user_id: مقدار} به ترتیب رسیدن
+        self.members = {}
+
+    def _bucket(self, value):
+        return max(0, value) // self.bucket_size
+
+    def add(self, user_id, value):
+        bucket = self._bucket(value)
+        self.counts.add(bucket, 1)
+        self.members.setdefault(bucket, {})[user_id] = value
+
+    def remove(self, user_id, value):
+        bucket = self._bucket(value)
+        self.counts.add(bucket, -1)
+        members = self.members[bucket]
+        del members[user_id]
+        if not members:
+            del self.members[bucket]
+
+    def rank(self, value):
+        bucket = self._bucket(value)
+        if self.descending:
+            better = self.counts.total - self.counts.prefix(bucket + 1)
+        else:
+            better = self.counts.prefix(bucket)
+        return better + 1
+
+    def top(self, k):
+        """k کاربر اول به صورت [(user_id, مقدار)]"""
+        result = []
+        total = self.counts.total
+        while len(result) < min(k, total):
+            position = len(result)
+            bucket = self.counts.find(total - 1 - position if self.descending else position)
+            members = self.members[bucket]
+            result.extend(itertools.islice(members.items(), k - len(result)))
+        return result
+
+
+class Leaderboard:
+    """رتبه‌بندی و آمار هر هفته، با به‌روزرسانی تدریجی روی هر ذخیره کاربر
+
+    فقط کاربرای ثبت‌نام‌شده (با اسم) حساب میشن.
+    """
+
+    # معیار -> (اندازه خونه، بیشتر بهتره؟)
+    METRICS = {
+        'streak': (1, True),
+        'total_days': (1, True),
+        'penalty': (DAILY_PENALTY, False),
+    }
+
+    def __init__(self):
+        self.indexes = {name: MetricIndex(*options) for name, options in self.METRICS.items()}
+        self._positions = {name: i for i, name in enumerate(self.METRICS)}
+        # user_id -> (streak, total_days, penalty, current_week)
+        self._values = {}
+        # user_id -> اسم؛ برای نمایش top بدون خوندن رکورد و پر کردن کش
+        self._names = {}
+        # هفته -> [تعداد، جمع streak، جمع total_days، جمع penalty]
+        self._weeks = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, user_id):
+        return user_id in self._values
+
+    def update(self, user_id, record):
+        if record.name:
+            self.set(user_id, record.name, record.streak, record.total_days, record.penalty, record.current_week)
+        elif user_id in self._values:
+            self._remove(user_id, self._values.pop(user_id))
+            del self._names[user_id]
+
+    def set(self, user_id, name, streak, total_days, penalty, current_week):
+        self._names[user_id] = name
+        values = (streak, total_days, penalty, current_week)
+        old = self._values.get(user_id)
+        if old == values:
+            # تیک چک‌لیست هیچ‌کدوم از این عددها رو عوض نمی‌کنه
+            return
+        if old is not None:
+            self._remove(user_id, old)
+        self._values[user_id] = values
+        for index, value in zip(self.indexes.values(), values):
+            index.add(user_id, value)
+        week = self._weeks.setdefault(current_week, [0, 0, 0, 0])
+        week[0] += 1
+        week[1] += streak
+        week[2] += total_days
+        week[3] += penalty
+
+    def _remove(self, user_id, values):
+        for index, value in zip(self.indexes.values(), values):
+            index.remove(user_id, value)
+        week = self._weeks[values[3]]
+        week[0] -= 1
+        week[1] -= values[0]
+        week[2] -= values[1]
+        week[3] -= values[2]
+        if not week[0]:
+            del self._weeks[values[3]]
+
+    def top(self, metric, k=5):
+        return self.indexes[metric].top(k)
+
+    def name(self, user_id):
+        return self._names.get(user_id, "؟")
+
+    def rank(self, metric, user_id):
+        """رتبه کاربر در یک معیار، یا None اگه توی رتبه‌بندی نیست"""
+        values = self._values.get(user_id)
+        if values is None:
+            return None
+        return self.indexes[metric].rank(values[self._positions[metric]])
+
+    def cohorts(self):
+        """میانگین‌های هر هفته: {هفته: (تعداد، streak، total_days، penalty)}"""
+        return {
+            week: (count, streak / count, total_days / count, penalty / count)
+            for week, (count, streak, total_days, penalty) in sorted(self._weeks.items())
+        }
+
+
+store = None
+users = None
+# وضعیتی که پروسه قبلی موقع خاموش شدن تحویل داده (read_handoff)، یا None
+handoff = None
+user_locks = UserLocks()
+update_dedup = UpdateDedup()
+# شناسه کاربرانی که ثبت نام رو تموم کردن؛ برای چک ثبت نام بدون خوندن رکورد
+registered_users = set()
+leaderboard = Leaderboard()
+# بعد از شروع ربات در پس‌زمینه از دیتابیس ساخته میشه (load_leaderboard)
+leaderboard_loaded = asyncio.Event()
+
+# ============ توابع مدیریت داده ============
+
+async def get_user(user_id):
+    """خواندن اطلاعات یک کاربر (از کش)"""
+    user_data = await users.get(user_id)
+    # اگه کار نیمه‌شب هنوز به این کاربر نرسیده، همین‌جا روزش بسته میشه
+    if user_data is not None and rollover_user(user_data, today_number()):
+        save_user(user_id, user_data)
+    return user_data
+
+def save_user(user_id, user_data):
+    """علامت‌گذاری کاربر برای ذخیره در flush بعدی"""
+    users.put(user_id, user_data)
+    leaderboard.update(int(user_id), user_data)
+
+async def flush_loop():
+    """flush دوره‌ای کش کاربران"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            count = await users.flush()
+            if count:
+                logger.debug(f"💾 {count} کاربر ذخیره شد - {users.stats()}")
+        except Exception:
+            logger.exception("❌ خطا در ذخیره کاربران")
+
+async def init_user(user_id):
+    """مقداردهی اولیه کاربر جدید"""
+    user_data = await get_user(user_id)
+    
+    if user_data is None:
+        today = today_number()
+        # روز ثبت نام حساب نمیشه؛ اولین روزی که بسته میشه فرداست
+        user_data = UserRecord(start_day=today, last_closed_day=today)
+        save_user(user_id, user_data)
+    
+    return user_data
+
+# ============ بستن روز: Streak و جریمه ============
+
+def today_str():
+    return datetime.datetime.now(TIMEZONE).strftime('%Y-%m-%d')
+
+def today_number():
+    return datetime.datetime.now(TIMEZONE).date().toordinal()
+
+def close_day(user_data, day):
+    """حساب‌وکتاب یک روز تمام‌شده (شماره روز): Streak، روزهای موفق، مهارت‌ها و جریمه"""
+    program = programs.get(user_data.program)
+    checklist = user_data.checklist & program.checklist_mask if user_data.last_checklist_day == day else 0
+    # موردهایی که برنامه کاربر نداره توی تاریخچه انجام‌شده ثبت میشن تا روز کامل، کامل بمونه
+    user_data.record_day(day, checklist | ((DAY_RECORDED - 1) & ~program.checklist_mask))
+    
+    if checklist == program.checklist_mask:
+        # رکوردهای قدیمی Streak امروز رو موقع تیک زدن حساب کردن
+        if user_data.last_streak_day != day:
+            user_data.streak += 1
+            user_data.total_days += 1
+            user_data.last_streak_day = day
+            
+            # آپدیت مهارت‌ها: +0.1 تا سقف 10
+            user_data.skills = [min(100, level + 1) if level < 100 else level for level in user_data.skills]
+    else:
+        user_data.streak = 0
+        if not checklist:
+            user_data.penalty += DAILY_PENALTY
+    
+    user_data.last_closed_day = day
+    if (day + 6) % 7 == REPORT_WEEK_END:
+        close_week(user_data, day)
+
+def close_week(user_data, day):
+    """پایان هفته گزارش: خلاصه هفته در week_report و شروع هفته بعد در week_base
+
+    مثل close_day فقط به رکورد بستگی داره، پس نتیجه برای نسخه کش و
+    نسخه دیسک (run_rollover) یکیه.
+    """
+    current = WeekBase(user_data.streak, user_data.total_days, user_data.penalty, tuple(user_data.skills))
+    base = user_data.week_base
+    if base is None and user_data.start_day > day - 7:
+        # ثبت‌نام همین هفته: از مقادیر اولیه
+        base = WeekBase(0, 0, 0, STARTING_SKILLS)
+    if base is not None:
+        # کاربرای قبل از این تغییر اولین هفته رو فقط شروع می‌کنن
+        user_data.week_report = WeekReport(
+            day, current.total_days - base.total_days, base.streak, current.streak,
+            current.penalty - base.penalty, tuple(now - then for now, then in zip(current.skills, base.skills)),
+        )
+    user_data.week_base = current
+
+def rollover_user(user_data, today):
+    """بستن همه روزهای گذشته‌ای که هنوز بسته نشدن + ریست چک‌لیست امروز
+
+    today شماره روز است (today_number). idempotent است: اجرای دوباره
+    با همون today هیچ تغییری نمیده. خروجی True یعنی رکورد تغییر کرد.
+    """
+    if not user_data.name:
+        return False
+    changed = False
+    
+    if not user_data.last_closed_day:
+        # کاربرای قبل از این تغییر: روزهای گذشته رو دوباره حساب نمی‌کنیم
+        user_data.last_closed_day = today - 1
+        changed = True
+    else:
+        for day in range(user_data.last_closed_day + 1, today):
+            close_day(user_data, day)
+            changed = True
+    
+    if user_data.last_checklist_day != today:
+        user_data.checklist = 0
+        user_data.last_checklist_day = today
+        changed = True
+    return changed
+
+async def run_rollover(today=None):
+    """کار نیمه‌شب: بستن روز همه کاربران در یک دور روی دیتابیس (today: 'YYYY-MM-DD')"""
+    today = today or today_str()
+    day = day_number(today)
+    started = time.monotonic()
+    
+    # اول رکوردهای داخل کش (ممکنه جدیدتر از دیسک باشن)
+    cached = 0
+    for user_id, user_data in users.items():
+        if rollover_user(user_data, day):
+            save_user(user_id, user_data)
+            cached += 1
+    
+    # تغییرکرده‌هایی که از کش بیرون رفتن ولی هنوز ذخیره نشدن اول نوشته میشن؛ وگرنه
+    # map_records نسخه قدیمی دیسک رو می‌بنده و flush بعدی روش رو بدون بستن روز می‌نویسه
+    await users.flush()
+    
+    # بعد بقیه کاربرا مستقیم روی دیسک؛ نسخه کش‌شده موقع flush همون نتیجه رو می‌نویسه
+    def on_change(user_id, record):
+        if user_id not in users:
+            leaderboard.update(int(user_id), record)
+    
+    scanned, changed = await store.map_records(lambda record: rollover_user(record, day), on_change=on_change)
+    logger.info(
+        f"🌙 بستن روز {today}: {scanned} کاربر بررسی، {changed + cached} تغییر "
+        f"({time.monotonic() - started:.1f} ثانیه)"
+    )
+    return changed + cached
+
+async def rollover_job(reminder, fire_at):
+    await run_rollover(fire_at.strftime('%Y-%m-%d'))
+
+# ============ برنامه‌های Boot Camp ============
+
+# اسم فارسی روزها به ترتیب date.weekday() (دوشنبه = 0)
+PERSIAN_WEEKDAYS = ('دوشنبه', 'سه‌شنبه', 'چهارشنبه', 'پنج‌شنبه', 'جمعه', 'شنبه', 'یکشنبه')
+
+def persian_day_name(now):
+    """اسم فارسی روز هفته"""
+    return PERSIAN_WEEKDAYS[now.weekday()]
+
+WeekPlan = namedtuple('WeekPlan', 'focus grammar vocabulary daily_tasks')
+# short: متن کوتاه دکمه بعد از تیک زدن
+ChecklistEntry = namedtuple('ChecklistEntry', 'title short')
+
+PROGRAM_ID_PATTERN = re.compile(r'^[a-z0-9][a-z0-9-]*$')
+TIME_OF_DAY_PATTERN = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+def _program_text(value, where):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{where}: متن خالی یا نامعتبر")
+    # متن‌های تکراری (بین هفته‌ها و برنامه‌ها) یک نسخه در حافظه دارن
+    return sys.intern(value)
+
+def _program_object(value, where):
+    if not isinstance(value, dict):
+        raise ValueError(f"{where}: باید یک object باشه")
+    return value
+
+def _program_texts(value, where):
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"{where}: باید لیست غیرخالی از متن باشه")
+    return tuple(_program_text(item, f"{where}[{i}]") for i, item in enumerate(value))
+
+
+class Program:
+    """یک برنامه Boot Camp از فایل JSON، یک بار اعتبارسنجی و کامپایل‌شده
+
+    متن‌ها intern شدن و پیام‌های «برنامه امروز»، «برنامه هفته» و
+    یادآور بلوک‌ها همین‌جا از قبل ساخته میشن؛ handlerها فقط lookup
+    می‌کنن. immutable است: reload یک Program جدید می‌سازه، پس فقط
+    پیام‌های همون برنامه دوباره ساخته میشن.
+
+    چک‌لیست برنامه حداکثر len(CHECKLIST_ITEMS) مورد داره و مورد i
+    همون بیت CHECKLIST_ITEMS[i] رکورد کاربره.
+    """
+
+    __slots__ = ('id', 'version', 'title', 'checklist', 'checklist_mask', 'weeks',
+                 'today_messages', 'week_messages', 'blocks')
+
+    def __init__(self, data, where):
+        _program_object(data, where)
+        self.id = data.get('id')
+        if not isinstance(self.id, str) or not PROGRAM_ID_PATTERN.match(self.id):
+            raise ValueError(f"{where}: id نامعتبر {self.id!r}")
+        self.version = data.get('version')
+        if not isinstance(self.version, int) or isinstance(self.version, bool):
+            raise ValueError(f"{where}: version باید عدد صحیح باشه")
+        self.title = _program_text(data.get('title'), f"{where}: title")
+        
+        checklist = data.get('checklist')
+        if not isinstance(checklist, list) or not 1 <= len(checklist) <= len(CHECKLIST_ITEMS):
+            raise ValueError(f"{where}: checklist باید 1 تا {len(CHECKLIST_ITEMS)} مورد داشته باشه")
+        entries = []
+        for i, entry in enumerate(checklist):
+            _program_object(entry, f"{where}: checklist[{i}]")
+            title = _program_text(entry.get('title'), f"{where}: checklist[{i}].title")
+            entries.append(ChecklistEntry(title, _program_text(entry.get('short', title), f"{where}: checklist[{i}].short")))
+        self.checklist = tuple(entries)
+        self.checklist_mask = (1 << len(entries)) - 1
+        
+        weeks = data.get('weeks')
+        if not isinstance(weeks, list) or not weeks:
+            raise ValueError(f"{where}: weeks باید لیست غیرخالی باشه")
+        self.weeks = tuple(
+            WeekPlan(
+                _program_text(_program_object(week, f"{where}: weeks[{i}]").get('focus'), f"{where}: weeks[{i}].focus"),
+                *(_program_texts(week.get(field), f"{where}: weeks[{i}].{field}")
+                  for field in ('grammar', 'vocabulary', 'daily_tasks'))
+            )
+            for i, week in enumerate(weeks)
+        )
+        
+        days = data.get('days')
+        if not isinstance(days, dict) or set(days) != set(PERSIAN_WEEKDAYS):
+            raise ValueError(f"{where}: days باید دقیقاً این روزها رو داشته باشه: {', '.join(PERSIAN_WEEKDAYS)}")
+        schedules = {}
+        blocks = {}
+        for day_name in PERSIAN_WEEKDAYS:
+            day = _program_object(days[day_name], f"{where}: days.{day_name}")
+            schedules[day_name] = _program_text(day.get('schedule'), f"{where}: days.{day_name}.schedule")
+            schedule_lines = set(schedules[day_name].split('\n'))
+            day_blocks = {}
+            day_block_list = day.get('blocks', [])
+            if not isinstance(day_block_list, list):
+                raise ValueError(f"{where}: days.{day_name}.blocks باید لیست باشه")
+            for i, block in enumerate(day_block_list):
+                if (not isinstance(block, list) or len(block) != 2
+                        or not isinstance(block[0], str) or not TIME_OF_DAY_PATTERN.match(block[0])):
+                    raise ValueError(f"{where}: days.{day_name}.blocks[{i}] باید [\"HH:MM\", عنوان] باشه")
+                title = _program_text(block[1], f"{where}: days.{day_name}.blocks[{i}]")
+                # یادآور و جدول روز نباید از هم جدا بیفتن
+                if f"{block[0]} - {title}" not in schedule_lines:
+                    raise ValueError(
+                        f"{where}: days.{day_name}.blocks[{i}]: خط «{block[0]} - {title}» در schedule نیست"
+                    )
+                day_blocks[sys.intern(block[0])] = f"⏰ وقتشه!\n\n{title}\n\nبعد از انجامش تو چک‌لیست تیکش بزن ✅"
+            blocks[day_name] = MappingProxyType(day_blocks)
+        self.blocks = MappingProxyType(blocks)
+        
+        # همه پیام‌ها یک بار ساخته میشن
+        self.week_messages = tuple(self._render_week_plan(number) for number in range(1, len(self.weeks) + 1))
+        self.today_messages = MappingProxyType({
+            (day_name, number): schedules[day_name] + self._render_week_tasks(number)
+            for day_name in PERSIAN_WEEKDAYS for number in range(1, len(self.weeks) + 1)
+        })
+
+    @property
+    def week_count(self):
+        return len(self.weeks)
+
+    @property
+    def items(self):
+        """کلید موردهای چک‌لیست این برنامه در CHECKLIST_ITEMS"""
+        return CHECKLIST_ITEMS[:len(self.checklist)]
+
+    def week_number(self, week):
+        """شماره هفته در محدوده این برنامه (برنامه ممکنه کوتاه‌تر شده باشه)"""
+        return min(max(week, 1), len(self.weeks))
+
+    def week(self, week):
+        return self.weeks[self.week_number(week) - 1]
+
+    def today_message(self, day_name, week):
+        return self.today_messages[(day_name, self.week_number(week))]
+
+    def week_message(self, week):
+        return self.week_messages[self.week_number(week) - 1]
+
+    def block_message(self, day_name, at):
+        return self.blocks[day_name].get(at)
+
+    def _render_week_tasks(self, number):
+        tasks_text = "\n\n🎯 وظایف ویژه این هفته:\n"
+        for i, task in enumerate(self.week(number).daily_tasks, 1):
+            tasks_text += f"{i}. {task}\n"
+        return tasks_text
+
+    def _render_week_plan(self, number):
+        week_data = self.week(number)
+        
+        return f"""📚 برنامه هفته {number}/{len(self.weeks)}
+
+🎯 فوکوس: {week_data.focus}
+
+📖 گرامر این هفته:
+{chr(10).join(f"  • {item}" for item in week_data.grammar)}
+
+📝 واژگان:
+{chr(10).join(f"  • {item}" for item in week_data.vocabulary)}
+
+✅ وظایف روزانه:
+{chr(10).join(f"  {i+1}. {task}" for i, task in enumerate(week_data.daily_tasks))}
+
+💡 برای دیدن برنامه روزانه: 📅 برنامه امروز"""
+
+    def __repr__(self):
+        return f"Program({self.id!r}, version={self.version})"
+
+
+def load_program(path):
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: JSON نامعتبر ({e})") from None
+    return Program(data, path)
+
+
+class ProgramRegistry:
+    """برنامه‌های PROGRAMS_DIR بر اساس id
+
+    reload فقط فایل‌هایی رو که mtime یا اندازه‌شون عوض شده دوباره
+    می‌خونه و dict برنامه‌ها رو یک‌جا عوض می‌کنه، پس خوندن از event
+    loop یا thread ذخیره‌سازی (close_day) بدون قفل امنه. فایل نامعتبر
+    لاگ میشه و نسخه قبلی همون برنامه سر جاش می‌مونه.
+    """
+
+    def __init__(self, directory=PROGRAMS_DIR, default=DEFAULT_PROGRAM):
+        self.directory = directory
+        self.default = default
+        # id -> Program؛ تا اولین get خالیه
+        self._programs = None
+        # path -> ((mtime_ns, size), id برنامه یا None اگه نامعتبر بود)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def get(self, program_id=''):
+        """برنامه با این id؛ id خالی یا برنامه حذف‌شده -> برنامه پیش‌فرض"""
+        programs = self._programs
+        if programs is None:
+            self.reload()
+            programs = self._programs
+        return programs.get(program_id) or programs[self.default]
+
+    def all(self):
+        if self._programs is None:
+            self.reload()
+        return sorted(self._programs.values(), key=lambda program: program.id)
+
+    def reload(self):
+        """خوندن دوباره فایل‌های عوض‌شده؛ خروجی: id برنامه‌هایی که عوض شدن"""
+        with self._lock:
+            first_load = self._programs is None
+            programs = dict(self._programs or {})
+            owners = {program_id: path for path, (_, program_id) in self._files.items() if program_id}
+            files = {}
+            changed = []
+            for entry in sorted(os.scandir(self.directory), key=lambda entry: entry.name):
+                if not entry.name.endswith('.json') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                stamp_before, program_id = self._files.get(entry.path, (None, None))
+                if stamp == stamp_before:
+                    files[entry.path] = (stamp, program_id)
+                    continue
+                try:
+                    program = load_program(entry.path)
+                    owner = owners.get(program.id, entry.path)
+                    if owner != entry.path:
+                        raise ValueError(f"{entry.path}: id {program.id} قبلاً در {owner} تعریف شده")
+                except (OSError, ValueError) as e:
+                    if first_load:
+                        raise
+                    logger.error(f"❌ برنامه نامعتبر، نسخه قبلی می‌مونه: {e}")
+                    files[entry.path] = (stamp, program_id)
+                    continue
+                if program_id and program_id != program.id:
+                    # id داخل فایل عوض شده
+                    programs.pop(program_id, None)
+                    owners.pop(program_id, None)
+                    changed.append(program_id)
+                before = programs.get(program.id)
+                programs[program.id] = program
+                owners[program.id] = entry.path
+                files[entry.path] = (stamp, program.id)
+                changed.append(program.id)
+                if not first_load:
+                    logger.info(
+                        f"📚 برنامه {program.id}: نسخه {before.version if before else '-'} -> {program.version}"
+                    )
+            for path, (_, program_id) in self._files.items():
+                if path not in files and program_id:
+                    programs.pop(program_id, None)
+                    changed.append(program_id)
+                    logger.info(f"📚 برنامه {program_id} حذف شد")
+            if self.default not in programs:
+                if first_load:
+                    raise ValueError(f"برنامه پیش‌فرض {self.default} در {self.directory} نیست")
+                # برنامه پیش‌فرض هیچ‌وقت حذف نمیشه؛ کاربرای بقیه برنامه‌ها بهش برمی‌گردن
+                logger.error(f"❌ برنامه پیش‌فرض {self.default} پیدا نشد، نسخه قبلی می‌مونه")
+                programs[self.default] = self._programs[self.default]
+                changed.remove(self.default)
+            self._files = files
+            self._programs = programs
+            return changed
+
+
+programs = ProgramRegistry()
+
+def render_today_plan(now, current_week, program):
+    """برنامه امروز + وظایف هفته جاری"""
+    return program.today_message(persian_day_name(now), current_week)
+
+async def watch_programs(scheduler=None):
+    """هر PROGRAMS_POLL_INTERVAL ثانیه فایل‌های برنامه رو چک می‌کنه؛ تغییرات بدون ری‌استارت اعمال میشن"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(PROGRAMS_POLL_INTERVAL)
+        try:
+            changed = await loop.run_in_executor(None, programs.reload)
+        except Exception:
+            logger.exception("❌ خطا در بارگذاری دوباره برنامه‌ها")
+            continue
+        if changed and scheduler is not None:
+            # ساعت بلوک‌ها ممکنه عوض شده باشه
+            scheduler.replace(build_reminders())
+
+# ============ یادآورهای روزانه ============
+
+MORNING_PLAN_TIME = '07:00'
+CHECKLIST_NUDGE_TIME = '22:30'
+
+def build_reminders():
+    """لیست یادآورها: (ساعت، روز یا None برای هر روز، نوع، متن)
+
+    یادآور بلوک‌ها یکی برای هر (ساعت، روز) که توی حداقل یک برنامه هست؛
+    متن هر کاربر موقع ارسال از برنامه خودش برداشته میشه.
+    """
+    reminders = [
+        (MORNING_PLAN_TIME, None, 'plan', None),
+        (CHECKLIST_NUDGE_TIME, None, 'nudge',
+         "🌙 روزت چطور بود؟\n\nقبل از خواب چک‌لیست امروز رو تیک بزن تا Streak حفظ بشه!\n👈 ✅ چک‌لیست"),
+    ]
+    slots = {(at, day) for program in programs.all() for day, blocks in program.blocks.items() for at in blocks}
+    for at, day in sorted(slots):
+        reminders.append((at, day, 'block', None))
+    return reminders
+
+
+class ReminderScheduler:
+    """زمان‌بند یادآورها با min-heap از زمان اجرای بعدی
+
+    هر یادآور یک بار در heap هست (نه یک بار برای هر کاربر)، پس حلقه
+    فقط سر وقت بیدار میشه و لیست کاربرا رو فقط موقع ارسال می‌خونه.
+    clock و sleep قابل تعویض هستن تا بشه با ساعت جعلی تستش کرد.
+    """
+
+    def __init__(self, send, reminders, clock=None, sleep=asyncio.sleep):
+        self.send = send
+        self.clock = clock or (lambda: datetime.datetime.now(TIMEZONE))
+        self.sleep = sleep
+        self.replace(reminders)
+
+    def replace(self, reminders):
+        """عوض کردن لیست یادآورها (مثلاً بعد از تغییر فایل برنامه) بدون ری‌استارت"""
+        now = self.clock()
+        self._heap = []
+        for index, reminder in enumerate(reminders):
+            heapq.heappush(self._heap, (self._next_fire(reminder, now), index, reminder))
+
+    @staticmethod
+    def _next_fire(reminder, now):
+        """اولین زمان بعد از now که این یادآور باید اجرا بشه"""
+        at, day, _, _ = reminder
+        hour, minute = map(int, at.split(':'))
+        date = now.date()
+        for offset in range(8):
+            candidate_date = date + datetime.timedelta(days=offset)
+            candidate = datetime.datetime.combine(candidate_date, datetime.time(hour, minute), tzinfo=TIMEZONE)
+            if candidate <= now:
+                continue
+            if day is None or persian_day_name(candidate) == day:
+                return candidate
+        raise ValueError(f"روز نامعتبر برای یادآور: {day}")
+
+    def next_fire_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def due_times(self):
+        """{(ساعت، روز، نوع): timestamp اجرای بعدی} برای پروسه بعدی (handoff)"""
+        return {reminder[:3]: fire_at.timestamp() for fire_at, _, reminder in self._heap}
+
+    def catch_up(self, due, max_late):
+        """یادآورهایی که طبق due (خروجی due_times پروسه قبلی) وسط ری‌استارت وقتشون گذشت
+
+        اگه کمتر از max_late ثانیه گذشته باشه، با همون زمان قبلی جای اجرای
+        بعدی یادآور رو می‌گیرن تا همین الان اجرا بشن؛ run_pending بعدش زمان
+        عادی بعدی رو میذاره. خروجی: تعداد.
+        """
+        now = self.clock().timestamp()
+        missed = {
+            key: datetime.datetime.fromtimestamp(at, TIMEZONE)
+            for key, at in due.items() if 0 <= now - at <= max_late
+        }
+        if missed:
+            self._heap = [
+                (missed.get(reminder[:3], fire_at), index, reminder) for fire_at, index, reminder in self._heap
+            ]
+            heapq.heapify(self._heap)
+        return len(missed)
+
+    async def run_pending(self):
+        """اجرای همه یادآورهایی که وقتشون رسیده"""
+        now = self.clock()
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, index, reminder = heapq.heappop(self._heap)
+            heapq.heappush(self._heap, (self._next_fire(reminder, fire_at), index, reminder))
+            try:
+                await self.send(reminder, fire_at)
+            except Exception:
+                logger.exception(f"❌ خطا در ارسال یادآور {reminder[2]}")
+            fired += 1
+        return fired
+
+    async def run(self):
+        while True:
+            await self.run_pending()
+            delay = (self.next_fire_time() - self.clock()).total_seconds()
+            await self.sleep(min(max(delay, 0), 60))
+
+
+async def broadcast(bot, messages, rate=BROADCAST_RATE):
+    """ارسال دسته‌ای پیام‌ها؛ سرعت و RetryAfter رو TelcRateLimiter کنترل می‌کنه"""
+    batch_size = max(1, int(rate))
+    sent = 0
+    batch = []
+    
+    async def send_one(chat_id, text):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, rate_limit_args='bulk')
+            return True
+        except Forbidden:
+            # کاربر ربات رو بلاک کرده
+            return False
+        except TelegramError as e:
+            logger.warning(f"⚠️ ارسال به {chat_id} ناموفق: {e}")
+            return False
+    
+    async def send_batch():
+        results = await asyncio.gather(*(send_one(chat_id, text) for chat_id, text in batch))
+        batch.clear()
+        return sum(results)
+    
+    for chat_id, text in messages:
+        batch.append((chat_id, text))
+        if len(batch) >= batch_size:
+            sent += await send_batch()
+    if batch:
+        sent += await send_batch()
+    return sent
+
+
+def make_reminder_sender(bot):
+    """تابع ارسال یادآور به همه کاربران ثبت‌نام‌شده"""
+    
+    async def send(reminder, fire_at):
+        _, _, kind, text = reminder
+        # کاربرای تازه ثبت‌نام‌شده هم باید توی دیتابیس باشن
+        await users.flush()
+        recipients = await store.iter_recipients()
+        if kind == 'plan':
+            plans = {}
+            messages = []
+            for user_id, week, program_id in recipients:
+                if (program_id, week) not in plans:
+                    plans[(program_id, week)] = "☀️ صبح بخیر!\n\n" + render_today_plan(
+                        fire_at, week, programs.get(program_id))
+                messages.append((int(user_id), plans[(program_id, week)]))
+        elif kind == 'block':
+            day_name = persian_day_name(fire_at)
+            at = fire_at.strftime('%H:%M')
+            messages = []
+            for user_id, _, program_id in recipients:
+                # برنامه این کاربر این ساعت بلوکی نداره
+                block_text = programs.get(program_id).block_message(day_name, at)
+                if block_text:
+                    messages.append((int(user_id), block_text))
+        else:
+            messages = [(int(user_id), text) for user_id, _, _ in recipients]
+        sent = await broadcast(bot, messages)
+        logger.info(f"🔔 یادآور {kind}: {sent}/{len(messages)} پیام ارسال شد")
+    
+    return send
+
+# ============ گزارش هفتگی ============
+
+# همون بازنگری هفتگی جمعه در برنامه روزانه
+WEEKLY_REPORT_TIME = '15:00'
+# فقط یک ارسال گزارش در هر لحظه (زمان‌بند و ادامه بعد از راه‌اندازی)
+weekly_report_lock = asyncio.Lock()
+
+def render_week_report(user_data):
+    """متن گزارش از روی week_report و Mock Testهای همون هفته"""
+    report = user_data.week_report
+    first_day = report.day - 6
+    if report.streak_end > report.streak_start:
+        streak_trend = "📈"
+    elif report.streak_end < report.streak_start:
+        streak_trend = "📉"
+    else:
+        streak_trend = "➖"
+    penalty = f"💰 جریمه این هفته: {report.penalty:,} تومان" if report.penalty else "💰 این هفته بدون جریمه! 👏"
+    skills = "\n".join(
+        f"{SKILL_TITLES[skill]}: {delta / 10:+.1f} ({level / 10:.1f}/10)"
+        for skill, delta, level in zip(SKILLS, report.skills_delta, user_data.skills)
+    )
+    
+    mocks = [scores for day, scores in user_data.mock_tests if first_day <= day <= report.day]
+    if mocks:
+        best = max(mocks, key=sum)
+        mock_line = (
+            f"📝 Mock Test: {len(mocks)} آزمون، بهترین {sum(best)}/{MOCK_TOTAL} "
+            f"({'✅ قبول' if mock_passed(best) else '❌ زیر حد قبولی'})"
+        )
+    else:
+        mock_line = "📝 این هفته Mock Test ثبت نشد - امروز ساعت 16:00 وقتشه!"
+    
+    if report.days_completed >= 7:
+        closing = "🏆 هفته کامل! همین‌طور ادامه بده."
+    elif report.days_completed >= 4:
+        closing = "💪 هفته خوبی بود؛ هفته بعد کامل‌ترش کن!"
+    else:
+        closing = "🌱 هفته جدید، شروع دوباره! امروز با 📊 بازنگری هفتگی شروع کن."
+    
+    return f"""📊 گزارش هفتگی ({day_str(first_day)} تا {day_str(report.day)})
+
+✅ روزهای کامل: {report.days_completed} از 7
+🔥 Streak: از {report.streak_start} به {report.streak_end} {streak_trend}
+{penalty}
+
+📈 تغییر مهارت‌ها:
+{skills}
+
+{mock_line}
+
+{closing}"""
+
+async def send_weekly_reports(bot, week_end):
+    """ارسال گزارش هفته‌ای که پنجشنبه week_end بسته شده؛ بعد از قطع شدن ادامه میده
+
+    کاربرای دارای گزارش دسته به دسته (WEEKLY_REPORT_BATCH) به ترتیب
+    user_id خونده میشن، دسته بعدی همزمان با ارسال دسته فعلی، پس
+    حافظه به اندازه دو دسته است نه تعداد کاربرا. ارسال از broadcast
+    و سطل bulk محدودکننده رد میشه. بعد از هر دسته آخرین user_id در
+    meta ذخیره میشه؛ اجرای دوباره از همون‌جا ادامه میده و بعد از crash
+    حداکثر یک دسته دوباره فرستاده میشه.
+    """
+    async with weekly_report_lock:
+        progress = json.loads(await store.get_meta('weekly_report') or '{}')
+        if progress.get('day') != day_str(week_end):
+            progress = {'day': day_str(week_end), 'after': None, 'sent': 0, 'done': False}
+        if progress['done']:
+            return 0
+        started = time.monotonic()
+        # از همین حالا ثبت میشه تا اگه وسط دسته اول خاموش شد resume_weekly_reports پیداش کنه
+        await store.set_meta('weekly_report', json.dumps(progress))
+        # week_report موقع بستن پنجشنبه ساخته شده؛ نسخه‌های کش‌شده اول ذخیره میشن
+        await users.flush()
+        
+        pending = asyncio.ensure_future(store.week_reports_batch(week_end, progress['after'], WEEKLY_REPORT_BATCH))
+        while True:
+            last_key, records = await pending
+            if last_key is not None:
+                pending = asyncio.ensure_future(store.week_reports_batch(week_end, last_key, WEEKLY_REPORT_BATCH))
+            messages = [(int(user_id), render_week_report(record)) for user_id, record in records]
+            progress['sent'] += await broadcast(bot, messages)
+            if records:
+                progress['after'] = records[-1][0]
+            progress['done'] = last_key is None
+            await store.set_meta('weekly_report', json.dumps(progress))
+            if progress['done']:
+                break
+        
+        logger.info(
+            f"📊 گزارش هفتگی {progress['day']}: {progress['sent']} پیام "
+            f"({time.monotonic() - started:.1f} ثانیه)"
+        )
+        return progress['sent']
+
+def make_weekly_report_job(bot):
+    """کار جمعه ساعت WEEKLY_REPORT_TIME برای ReminderScheduler"""
+    
+    async def job(reminder, fire_at):
+        # هفته پنجشنبه دیروز بسته شده
+        await send_weekly_reports(bot, fire_at.date().toordinal() - 1)
+    
+    return job
+
+async def resume_weekly_reports(bot):
+    """اگه ربات وسط ارسال گزارش هفتگی خاموش شده بوده، ادامه‌اش (فقط برای هفته آخر)"""
+    progress = json.loads(await store.get_meta('weekly_report') or '{}')
+    if progress and not progress['done'] and day_number(progress['day']) > today_number() - 7:
+        logger.info(f"📊 ادامه گزارش هفتگی {progress['day']} بعد از {progress['sent']} پیام")
+        await send_weekly_reports(bot, day_number(progress['day']))
+
+# ============ مسیریابی منو ============
+
+# متن دکمه منو -> handler
+MENU_ROUTES = {}
+
+def register_menu_route(label, handler):
+    """اضافه کردن یک دکمه منو (یا ترجمه دیگه‌ای از همون دکمه)"""
+    MENU_ROUTES[label] = handler
+
+def menu_route(*labels):
+    """decorator برای ثبت handler یک یا چند متن دکمه منو"""
+    def decorator(handler):
+        for label in labels:
+            register_menu_route(label, handler)
+        return handler
+    return decorator
+
+async def load_registered_users():
+    """پر کردن registered_users از دیتابیس"""
+    registered_users.update(int(user_id) for user_id, _, _ in await store.iter_recipients())
+    logger.info(f"👥 {len(registered_users)} کاربر ثبت‌نام‌شده")
+
+async def load_leaderboard():
+    """ساخت رتبه‌بندی از دیتابیس؛ بعد از این با هر save_user به‌روز میشه"""
+    started = time.monotonic()
+    try:
+        for user_id, name, streak, total_days, penalty, current_week in await store.iter_stats():
+            # ربات موقع ساختن کار می‌کنه؛ کاربری که save_user کرده مقدار تازه‌تر رو داره
+            if int(user_id) not in leaderboard:
+                leaderboard.set(int(user_id), name, streak, total_days or 0, penalty or 0, current_week)
+    finally:
+        leaderboard_loaded.set()
+    logger.info(f"🏆 رتبه‌بندی {len(leaderboard)} کاربر ({time.monotonic() - started:.1f} ثانیه)")
+
+# ============ Handlers ============
+
+@instrument_handler
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """شروع کار با ربات"""
+    user_id = update.effective_user.id
+    await init_user(user_id)
+    
+    keyboard = [
+        [KeyboardButton("📅 برنامه امروز"), KeyboardButton("✅ چک‌لیست")],
+        [KeyboardButton("📊 آمار من"), KeyboardButton("📚 برنامه هفته")],
+        [KeyboardButton("📝 Mock Test"), KeyboardButton("❌ دفتر اشتباهات")],
+        [KeyboardButton("🎯 تنظیم هفته"), KeyboardButton("💡 راهنما")],
+        [KeyboardButton("🏆 رتبه‌بندی")]
+    ]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    
+    welcome_text = """🎓 به Boot Camp telc B2 خوش اومدی!
+
+این ربات یه همراه واقعی برای موفقیت توئه، نه فقط یه ربات معمولی! 🔥
+
+چیکارا می‌کنه:
+✅ برنامه روزانه دقیق
+✅ چک‌لیست تعاملی با Streak
+✅ سیستم جریمه (پایبندی = پول!)
+✅ مدیریت Mock Test
+✅ دفتر اشتباهات شخصی
+✅ گزارش پیشرفت هفتگی
+
+🎯 اولین قدم:
+اسمت رو بهم بگو تا باهم شروع کنیم!
+(مثلاً: علی)"""
+
+    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """مدیریت پیام‌های متنی"""
+    user_id = update.effective_user.id
+    text = update.message.text
+    
+    # ثبت نام
+    if user_id not in registered_users:
+        async with user_locks.hold(user_id):
+            user_data = await get_user(user_id) or await init_user(user_id)
+            registering = not user_data.name
+            if registering:
+                user_data.name = text
+                save_user(user_id, user_data)
+            registered_users.add(user_id)
+        
+        if registering:
+            await update.message.reply_text(
+                f"🎉 عالی {text}!\n\n"
+                "حالا از منوی پایین استفاده کن.\n"
+                "پیشنهاد میدم با '📅 برنامه امروز' شروع کنی! 👇"
+            )
+            return
+    
+    handler = MENU_ROUTES.get(text)
+    if handler:
+        # زدن دکمه منو وسط ثبت Mock Test یا اشتباه یعنی لغو
+        mock_drafts.pop(user_id, None)
+        error_drafts.pop(user_id, None)
+        with metrics.time('bot_handler_seconds', handler=handler.__name__):
+            await handler(update, context)
+    elif user_id in mock_drafts:
+        with metrics.time('bot_handler_seconds', handler='receive_mock_score'):
+            await receive_mock_score(update, user_id, text)
+    elif error_drafts.get(user_id, {}).get('step') in ('text', 'search'):
+        with metrics.time('bot_handler_seconds', handler='receive_error_text'):
+            await receive_error_text(update, user_id, text)
+
+@menu_route("📅 برنامه امروز")
+async def show_today_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """برنامه امروز + وظایف هفته جاری"""
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id) or await init_user(user_id)
+    
+    now = datetime.datetime.now(TIMEZONE)
+    await update.message.reply_text(render_today_plan(now, user_data.current_week, programs.get(user_data.program)))
+
+def check_callback(checklist, item):
+    """callback دکمه چک‌لیست با وضعیت مقصد (نه toggle) تا تکرارش بی‌اثر باشه"""
+    return f"check_{item}_{0 if checklist[item] else 1}"
+
+def checklist_keyboard(program, checklist, short=False):
+    """دکمه‌های چک‌لیست برنامه کاربر (short: متن کوتاه، بعد از تیک زدن)"""
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{'✅' if checklist[item] else '⬜'} {entry.short if short else entry.title}",
+            callback_data=check_callback(checklist, item)
+        )]
+        for item, entry in zip(program.items, program.checklist)
+    ]
+    keyboard.append([InlineKeyboardButton("🔄 ریست" if short else "🔄 ریست چک‌لیست", callback_data="reset_checklist")])
+    return InlineKeyboardMarkup(keyboard)
+
+@menu_route("✅ چک‌لیست")
+async def show_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش چک‌لیست روزانه"""
+    user_id = update.effective_user.id
+    
+    # ریست چک‌لیست روز جدید داخل get_user انجام میشه
+    user_data = await get_user(user_id) or await init_user(user_id)
+    
+    program = programs.get(user_data.program)
+    checklist = user_data.checklist_state()
+    reply_markup = checklist_keyboard(program, checklist)
+    
+    total = len(program.checklist)
+    completed = sum(checklist[item] for item in program.items)
+    
+    if completed == total:
+        status = "🎉 عالی! روز کامل - Streak ادامه داره!"
+        emoji = "🔥"
+    elif completed == total - 1:
+        status = f"✅ خوبه! {completed} از {total} - یکی دیگه مونده"
+        emoji = "💪"
+    elif completed:
+        status = "⚠️ یکی رو انجام دادی - ادامه بده!" if completed == 1 else f"⚠️ {completed} از {total} - ادامه بده!"
+        emoji = "😊"
+    else:
+        status = "❌ هنوز شروع نکردی - بزن بریم!"
+        emoji = "🚀"
+    
+    text = f"""📋 چک‌لیست امروز {emoji}
+
+{status}
+🔥 Streak فعلی: {user_data.streak} روز
+
+روی هر گزینه کلیک کن:"""
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+@instrument_handler
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """مدیریت دکمه‌های inline"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    
+    if query.data == "start_mock":
+        await begin_mock_entry(query, user_id)
+        return
+    if query.data == "cancel_mock":
+        mock_drafts.pop(user_id, None)
+        await query.edit_message_text("❌ ثبت Mock Test لغو شد.")
+        return
+    if query.data == "mock_results":
+        user_data = await get_user(user_id) or await init_user(user_id)
+        await query.edit_message_text(render_mock_results(user_data))
+        return
+    if query.data == "close":
+        await query.delete_message()
+        return
+    if query.data.startswith("err_"):
+        await handle_error_callback(query, user_id)
+        return
+    if query.data == "noop":
+        return
+    
+    async with user_locks.hold(user_id):
+        user_data = await get_user(user_id) or await init_user(user_id)
+        
+        if query.data.startswith("check_"):
+            item, _, target = query.data[len("check_"):].partition("_")
+            program = programs.get(user_data.program)
+            if item not in program.items:
+                # دکمه قدیمی یا ساختگی، یا موردی که برنامه فعلی کاربر نداره: کاری نمی‌کنیم
+                changed = False
+            elif target:
+                changed = user_data.set_checked(item, target == "1")
+            else:
+                # دکمه‌های پیام‌های قبل از وضعیت مقصد: check_block1
+                user_data.toggle(item)
+                changed = True
+            # Streak و جریمه نیمه‌شب توسط run_rollover حساب میشن
+            if changed:
+                save_user(user_id, user_data)
+            checklist = user_data.checklist_state()
+            streak = user_data.streak
+        
+        elif query.data == "reset_checklist":
+            user_data.checklist = 0
+            save_user(user_id, user_data)
+        
+        elif query.data.startswith("set_week_"):
+            program = programs.get(user_data.program)
+            user_data.current_week = program.week_number(int(query.data[len("set_week_"):]))
+            save_user(user_id, user_data)
+            week = user_data.current_week
+        
+        elif query.data.startswith("prog_"):
+            # برنامه حذف‌شده -> پیش‌فرض
+            program = programs.get(query.data[len("prog_"):])
+            user_data.program = '' if program.id == programs.default else program.id
+            user_data.current_week = program.week_number(user_data.current_week)
+            save_user(user_id, user_data)
+    
+    # ویرایش پیام بیرون از قفل: تیک‌های سریع پشت هم توی صف ارسال ادغام میشن
+    if query.data.startswith("check_"):
+        if not changed:
+            # دوبار زدن همون دکمه: پیام همینه که هست
+            return
+        # آپدیت پیام
+        reply_markup = checklist_keyboard(program, checklist, short=True)
+    
+        total = len(program.checklist)
+        completed_now = sum(checklist[item] for item in program.items)
+    
+        if completed_now == total:
+            status = f"🎉 تمام! امشب Streak میشه {streak + 1} روز 🔥"
+            emoji = "🏆"
+        elif completed_now == total - 1:
+            status = "✅ خوبه! یکی دیگه!"
+            emoji = "💪"
+        elif completed_now:
+            status = "😊 شروع کردی!"
+            emoji = "🚀"
+        else:
+            status = "❌ ریست شد"
+            emoji = "⚠️"
+    
+        text = f"📋 چک‌لیست امروز {emoji}\n\n{status}"
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    
+    elif query.data == "reset_checklist":
+        await query.edit_message_text("✅ چک‌لیست ریست شد! از منو دوباره باز کن.")
+    
+    elif query.data.startswith("set_week_"):
+        await query.edit_message_text(f"✅ هفته {week} تنظیم شد.\n\n" + program.week_message(week))
+    
+    elif query.data.startswith("prog_"):
+        await query.edit_message_text(
+            f"✅ برنامه «{program.title}» انتخاب شد.\n\n📚 برنامه هفته و برنامه امروز از این برنامه میان."
+        )
+
+@menu_route("📊 آمار من")
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش آمار کاربر"""
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id) or await init_user(user_id)
+    
+    streak = user_data.streak
+    total_days = user_data.total_days
+    penalty = user_data.penalty
+    program = programs.get(user_data.program)
+    # برنامه ممکنه بعد از reload کوتاه‌تر شده باشه
+    current_week = program.week_number(user_data.current_week)
+    
+    streak_emoji = "🔥" if streak >= 7 else "⭐" if streak >= 3 else "💫"
+    
+    # محاسبه پیشرفت کلی
+    progress_percent = int((current_week / program.week_count) * 100)
+    
+    # نمایش مهارت‌ها
+    skills_text = ""
+    for skill_name in SKILLS:
+        skill_level = user_data.skill_level(skill_name)
+        stars = "⭐" * int(skill_level)
+        skills_text += f"{SKILL_TITLES[skill_name]}: {stars} ({skill_level:.1f}/10)\n"
+    
+    text = f"""📊 آمار {user_data.name}
+
+{streak_emoji} Streak فعلی: {streak} روز
+📅 کل روزهای موفق: {total_days} روز
+💰 جریمه تا الان: {penalty:,} تومان
+📈 پیشرفت Boot Camp: {progress_percent}% (هفته {current_week}/{program.week_count})
+
+🎯 سطح مهارت‌ها:
+{skills_text}
+🗓 تقویم (هر ردیف یک هفته از شروع):
+{render_calendar(user_data, today_number()) or "هنوز روزی بسته نشده"}
+
+{"🎉 عالیه! این Streak رو حفظ کن!" if streak >= 7 else "💪 سعی کن Streak بسازی!" if streak < 3 else "✅ داری خوب پیش میری!"}"""
+    
+    await update.message.reply_text(text)
+
+# تقویم آمار: آخرین CALENDAR_WEEKS هفته از شروع کاربر، هر ردیف یک هفته
+CALENDAR_WEEKS = 12
+
+def calendar_icon(bits):
+    if not bits & DAY_RECORDED:
+        return "▫️"
+    if bits == DAY_RECORDED:
+        return "🟥"
+    return "🟩" if bits == DAY_FULL else "🟨"
+
+def render_calendar(user_data, today):
+    """تقویم روزهای بسته‌شده از activity؛ امروز از چک‌لیست فعلی"""
+    if not user_data.start_day or today < user_data.start_day:
+        return ""
+    weeks = (today - user_data.start_day) // 7 + 1
+    lines = []
+    for week in range(max(0, weeks - CALENDAR_WEEKS), weeks):
+        first = user_data.start_day + week * 7
+        cells = ""
+        for day in range(first, first + 7):
+            if day < today:
+                cells += calendar_icon(user_data.day_activity(day))
+            elif day == today:
+                mask = programs.get(user_data.program).checklist_mask
+                cells += "🟩" if user_data.checklist & mask == mask else "⏳"
+            else:
+                cells += "⬜"
+        lines.append(f"{week + 1:>2}. {cells} {user_data.days_completed(first, min(first + 6, today - 1))}/7")
+    return "\n".join(lines) + "\n🟩 کامل  🟨 ناقص  🟥 هیچی  ▫️ بدون سابقه  ⏳ امروز"
+
+LEADERBOARD_TITLES = {
+    'streak': ("🔥 Streak", "روز"),
+    'total_days': ("📅 روزهای موفق", "روز"),
+    'penalty': ("💰 کمترین جریمه", "تومان"),
+}
+
+@menu_route("🏆 رتبه‌بندی")
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """رتبه‌بندی کل گروه + رتبه خود کاربر + میانگین هر هفته
+
+    با SHARD_COUNT > 1 هر worker فقط کاربرای shard خودش رو می‌شناسه، پس
+    رتبه‌ها و میانگین‌ها مال همون بخشه و توی جواب هم همین گفته میشه.
+    """
+    user_id = update.effective_user.id
+    await leaderboard_loaded.wait()
+    total = len(leaderboard)
+    if not total:
+        await update.message.reply_text("🏆 هنوز کسی توی رتبه‌بندی نیست!")
+        return
+    
+    if SHARD_COUNT > 1:
+        text = f"🏆 رتبه‌بندی Boot Camp - بخش {SHARD_INDEX + 1} از {SHARD_COUNT} ({total} نفر)\n"
+        text += "ℹ️ رتبه‌ها و میانگین‌ها فقط بین کاربرای همین بخشه.\n"
+    else:
+        text = f"🏆 رتبه‌بندی Boot Camp ({total} نفر)\n"
+    for metric, (title, unit) in LEADERBOARD_TITLES.items():
+        text += f"\n{title}:\n"
+        for position, (member_id, value) in enumerate(leaderboard.top(metric), 1):
+            text += f"{position}. {leaderboard.name(member_id)} - {value:,} {unit}\n"
+    
+    if leaderboard.rank('streak', user_id) is not None:
+        ranks = " | ".join(
+            f"{title} #{leaderboard.rank(metric, user_id)}"
+            for metric, (title, _) in LEADERBOARD_TITLES.items()
+        )
+        text += f"\n📍 رتبه تو: {ranks}\n"
+    
+    text += "\n📊 میانگین هر هفته:\n"
+    for week, (count, streak, total_days, penalty) in leaderboard.cohorts().items():
+        text += f"هفته {week}: {count} نفر - Streak {streak:.1f}، روزهای موفق {total_days:.1f}، جریمه {penalty:,.0f}\n"
+    
+    await update.message.reply_text(text)
+
+@menu_route("📚 برنامه هفته")
+async def show_week_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش برنامه هفته جاری"""
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id) or await init_user(user_id)
+    
+    await update.message.reply_text(programs.get(user_data.program).week_message(user_data.current_week))
+
+@menu_route("📝 Mock Test")
+async def show_mock_test_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """منوی Mock Test"""
+    keyboard = [
+        [InlineKeyboardButton("📝 ثبت نتیجه Mock Test جدید", callback_data="start_mock")],
+        [InlineKeyboardButton("📊 نتایج قبلی", callback_data="mock_results")],
+        [InlineKeyboardButton("❌ بستن", callback_data="close")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = f"""📝 Mock Test Manager
+
+بعد از هر Mock Test امتیاز هر بخش رو ثبت کن:
+{chr(10).join(f"• {title} (از {max_points})" for _, title, max_points in MOCK_SECTIONS)}
+
+قبولی: حداقل {MOCK_WRITTEN_PASS} از بخش کتبی و {MOCK_ORAL_PASS} از شفاهی"""
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# user_id -> امتیازهای واردشده تا الان برای آزمونی که در حال ثبته
+mock_drafts = OrderedDict()
+# سقف وضعیت‌های نیمه‌کاره نگه‌داشته‌شده در حافظه (قدیمی‌ترها دور ریخته میشن)
+MAX_DRAFTS = 10000
+
+def remember(drafts, user_id, value):
+    drafts[user_id] = value
+    drafts.move_to_end(user_id)
+    if len(drafts) > MAX_DRAFTS:
+        drafts.popitem(last=False)
+CANCEL_MOCK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("❌ لغو", callback_data="cancel_mock")]])
+
+def mock_prompt(step):
+    _, title, max_points = MOCK_SECTIONS[step]
+    return f"{title}\nامتیازت از {max_points} چند شد؟ (فقط عدد)"
+
+async def begin_mock_entry(query, user_id):
+    remember(mock_drafts, user_id, [])
+    await query.edit_message_text(
+        f"📝 ثبت Mock Test ({len(MOCK_SECTIONS)} بخش)\n\n" + mock_prompt(0), reply_markup=CANCEL_MOCK_MARKUP
+    )
+
+async def receive_mock_score(update, user_id, text):
+    """یک امتیاز از آزمون در حال ثبت؛ بعد از بخش آخر آزمون ذخیره میشه"""
+    scores = mock_drafts[user_id]
+    _, title, max_points = MOCK_SECTIONS[len(scores)]
+    try:
+        score = int(text.strip())
+    except ValueError:
+        score = -1
+    if not 0 <= score <= max_points:
+        await update.message.reply_text(f"❗ یک عدد بین 0 و {max_points} بفرست", reply_markup=CANCEL_MOCK_MARKUP)
+        return
+    
+    scores.append(score)
+    if len(scores) < len(MOCK_SECTIONS):
+        await update.message.reply_text(mock_prompt(len(scores)), reply_markup=CANCEL_MOCK_MARKUP)
+        return
+    
+    del mock_drafts[user_id]
+    async with user_locks.hold(user_id):
+        user_data = await get_user(user_id) or await init_user(user_id)
+        user_data.add_mock_test(today_number(), scores)
+        save_user(user_id, user_data)
+        summary = user_data.mock_summary
+    
+    total = sum(scores)
+    result = "✅ قبول" if mock_passed(scores) else "❌ هنوز به حد قبولی نرسیده"
+    record_note = " 🏆 بهترین نتیجه تا الان!" if total == summary.best_total and summary.count > 1 else ""
+    await update.message.reply_text(
+        f"💾 Mock Test شماره {summary.count} ثبت شد\n\n"
+        f"مجموع: {total}/{MOCK_TOTAL} - {result}{record_note}\n\n"
+        "برای دیدن روند: 📝 Mock Test ← 📊 نتایج قبلی"
+    )
+
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+MOCK_TREND_LENGTH = 10
+
+def sparkline(values, max_value):
+    return ''.join(SPARK_BARS[min(len(SPARK_BARS) - 1, int(value / max_value * len(SPARK_BARS)))] for value in values)
+
+def render_mock_results(user_data):
+    """نتایج از روی mock_summary؛ از تاریخچه فقط MOCK_TREND_LENGTH آزمون آخر برای نمودار خونده میشه"""
+    summary = user_data.mock_summary
+    if summary is None:
+        return "📊 هنوز Mock Testی ثبت نکردی!\n\nاز 📝 ثبت نتیجه Mock Test جدید شروع کن."
+    
+    recent = user_data.mock_tests[-MOCK_TREND_LENGTH:]
+    last_day = recent[-1][0]
+    latest_total = sum(summary.latest)
+    text = f"""📊 نتایج Mock Test ({summary.count} آزمون)
+
+آخرین ({day_str(last_day)}): {latest_total}/{MOCK_TOTAL} - {"✅ قبول" if mock_passed(summary.latest) else "❌ زیر حد قبولی"}
+🏆 بهترین مجموع: {summary.best_total}/{MOCK_TOTAL}
+📈 روند مجموع: {sparkline([sum(scores) for _, scores in recent], MOCK_TOTAL)}
+
+آخرین | بهترین | میانگین {MOCK_ROLLING_WINDOW} آزمون آخر:
+"""
+    for i, (_, title, max_points) in enumerate(MOCK_SECTIONS):
+        trend = sparkline([scores[i] for _, scores in recent], max_points)
+        text += (
+            f"{title}: {summary.latest[i]} | {summary.best[i]} | {summary.rolling[i]:.1f} "
+            f"(از {max_points}) {trend}\n"
+        )
+    return text
+
+@menu_route("❌ دفتر اشتباهات")
+async def show_errors(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دفتر اشتباهات"""
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id) or await init_user(user_id)
+    text, reply_markup = render_error_page(user_data, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# user_id -> {'step': 'text' | 'search', ...} برای ثبت اشتباه یا جستجوی در جریان
+error_drafts = OrderedDict()
+# user_id -> شناسه‌های نتیجه آخرین جستجو (برای صفحه‌بندی)
+error_searches = OrderedDict()
+ERRORS_PAGE_SIZE = 10
+# کیفیت یادآوری SM-2 برای دکمه‌های مرور
+REVIEW_GRADES = ((1, "❌ یادم نبود"), (3, "😐 سخت بود"), (5, "✅ راحت"))
+
+def error_line(entry):
+    tags = " / ".join(tag for tag in (SKILL_TITLES.get(entry.skill, ''), entry.topic) if tag)
+    return f"#{entry.id} {entry.text}" + (f"\n     🏷 {tags}" if tags else "")
+
+def page_buttons(prefix, page, pages):
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}_{page - 1}"))
+    if pages > 1:
+        row.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}_{page + 1}"))
+    return row
+
+def render_error_page(user_data, page):
+    """یک صفحه از دفتر، جدیدترین اول؛ فقط همون ERRORS_PAGE_SIZE مورد خونده میشه"""
+    errors = user_data.errors
+    keyboard = [
+        [InlineKeyboardButton("➕ ثبت اشتباه", callback_data="err_add"),
+         InlineKeyboardButton("🔁 مرور", callback_data="err_review"),
+         InlineKeyboardButton("🔍 جستجو", callback_data="err_search")],
+    ]
+    if not errors:
+        text = """❌ دفتر اشتباهات
+
+هنوز اشتباهی ثبت نشده!
+
+💡 وقتی توی Mock Test یا تمرین اشتباه کردی،
+اینجا ثبتش کن تا مرور کنی."""
+        return text, InlineKeyboardMarkup(keyboard)
+    
+    pages = (len(errors) + ERRORS_PAGE_SIZE - 1) // ERRORS_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    end = len(errors) - page * ERRORS_PAGE_SIZE
+    entries = errors[max(0, end - ERRORS_PAGE_SIZE):end][::-1]
+    text = f"❌ دفتر اشتباهات ({len(errors)} مورد)\n\n" + "\n".join(error_line(entry) for entry in entries)
+    keyboard.append(page_buttons("err_page", page, pages))
+    return text, InlineKeyboardMarkup(keyboard)
+
+def render_search_page(user_data, ids, page):
+    pages = max(1, (len(ids) + ERRORS_PAGE_SIZE - 1) // ERRORS_PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    shown = ids[page * ERRORS_PAGE_SIZE:(page + 1) * ERRORS_PAGE_SIZE]
+    if not shown:
+        return "🔍 چیزی پیدا نشد.", None
+    text = f"🔍 {len(ids)} نتیجه:\n\n" + "\n".join(error_line(user_data.errors[i - 1]) for i in shown)
+    return text, InlineKeyboardMarkup([page_buttons("err_found", page, pages)])
+
+def render_review(user_data, today):
+    """اولین اشتباهی که نوبت مرورشه، با دکمه‌های SM-2"""
+    entry = user_data.errors_index().next_due(user_data.errors)
+    if entry is None:
+        return "🔁 هنوز اشتباهی برای مرور ثبت نکردی.", None
+    if entry.due_day > today:
+        return f"🎉 فعلاً چیزی برای مرور نمونده!\nمرور بعدی: {day_str(entry.due_day)}", None
+    keyboard = [[
+        InlineKeyboardButton(label, callback_data=f"err_grade_{entry.id}_{quality}")
+        for quality, label in REVIEW_GRADES
+    ]]
+    return f"🔁 مرور\n\n{error_line(entry)}\n\nچقدر راحت یادت اومد؟", InlineKeyboardMarkup(keyboard)
+
+def topic_keyboard(topics):
+    keyboard = [
+        [InlineKeyboardButton(topic, callback_data=f"err_topic_{i}")]
+        for i, topic in enumerate(topics)
+    ]
+    keyboard.append([InlineKeyboardButton("بدون موضوع", callback_data="err_topic_none")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def receive_error_text(update, user_id, text):
+    """متن اشتباه (مرحله اول ثبت) یا عبارت جستجو"""
+    draft = error_drafts[user_id]
+    if draft['step'] == 'search':
+        del error_drafts[user_id]
+        user_data = await get_user(user_id) or await init_user(user_id)
+        ids = user_data.errors_index().search(text)
+        remember(error_searches, user_id, ids)
+        reply, reply_markup = render_search_page(user_data, ids, 0)
+        await update.message.reply_text(reply, reply_markup=reply_markup)
+        return
+    
+    draft['text'] = text.strip()
+    draft['step'] = 'skill'
+    keyboard = [
+        [InlineKeyboardButton(title, callback_data=f"err_skill_{skill}")]
+        for skill, title in SKILL_TITLES.items()
+    ]
+    await update.message.reply_text("🏷 مربوط به کدوم مهارته؟", reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def handle_error_callback(query, user_id):
+    """دکمه‌های err_* دفتر اشتباهات"""
+    data = query.data
+    if data == "err_add":
+        remember(error_drafts, user_id, {'step': 'text'})
+        await query.edit_message_text(
+            "✍️ اشتباهت رو بنویس، ترجیحاً همراه شکل درست:\n"
+            "مثلاً: ich habe gegangen → ich bin gegangen"
+        )
+    elif data == "err_search":
+        remember(error_drafts, user_id, {'step': 'search'})
+        await query.edit_message_text("🔍 دنبال چی می‌گردی؟ (یک یا چند کلمه)")
+    elif data.startswith("err_skill_"):
+        draft = error_drafts.get(user_id)
+        if not draft or draft['step'] != 'skill':
+            return
+        draft['skill'] = data[len("err_skill_"):]
+        draft['step'] = 'topic'
+        user_data = await get_user(user_id) or await init_user(user_id)
+        # موضوع‌ها همراه پیش‌نویس نگه داشته میشن تا reload برنامه وسط ثبت، اندیس‌ها رو جابجا نکنه
+        draft['topics'] = programs.get(user_data.program).week(user_data.current_week).grammar
+        await query.edit_message_text("📚 موضوع گرامری؟", reply_markup=topic_keyboard(draft['topics']))
+    elif data.startswith("err_topic_"):
+        draft = error_drafts.get(user_id)
+        if not draft or draft['step'] != 'topic':
+            return
+        del error_drafts[user_id]
+        topic = ''
+        if data != "err_topic_none":
+            topic = draft['topics'][int(data[len("err_topic_"):])]
+        async with user_locks.hold(user_id):
+            user_data = await get_user(user_id) or await init_user(user_id)
+            entry = user_data.add_error(draft['text'], draft['skill'], topic, today_number())
+            save_user(user_id, user_data)
+        await query.edit_message_text(f"✅ ثبت شد (#{entry.id})\nاولین مرور: فردا")
+    elif data == "err_review" or data.startswith("err_grade_"):
+        today = today_number()
+        async with user_locks.hold(user_id):
+            user_data = await get_user(user_id) or await init_user(user_id)
+            if data.startswith("err_grade_"):
+                entry_id, quality = map(int, data[len("err_grade_"):].split('_'))
+                entry = user_data.errors[entry_id - 1] if entry_id <= len(user_data.errors) else None
+                # دوبار زدن یک دکمه دوبار حساب نمیشه
+                if entry is not None and entry.due_day <= today:
+                    user_data.replace_error(review_error(entry, quality, today))
+                    save_user(user_id, user_data)
+            text, reply_markup = render_review(user_data, today)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    elif data.startswith("err_page_"):
+        user_data = await get_user(user_id) or await init_user(user_id)
+        text, reply_markup = render_error_page(user_data, int(data[len("err_page_"):]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    elif data.startswith("err_found_"):
+        ids = error_searches.get(user_id)
+        if ids is None:
+            await query.edit_message_text("🔍 نتیجه جستجو منقضی شده؛ دوباره جستجو کن.")
+            return
+        user_data = await get_user(user_id) or await init_user(user_id)
+        text, reply_markup = render_search_page(user_data, ids, int(data[len("err_found_"):]))
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+@menu_route("🎯 تنظیم هفته")
+async def set_week_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """منوی تنظیم هفته (و انتخاب برنامه اگه بیشتر از یکی باشه)"""
+    user_id = update.effective_user.id
+    user_data = await get_user(user_id) or await init_user(user_id)
+    program = programs.get(user_data.program)
+    
+    keyboard = []
+    for i in range(1, program.week_count + 1):
+        keyboard.append([InlineKeyboardButton(f"هفته {i}", callback_data=f"set_week_{i}")])
+    available = programs.all()
+    if len(available) > 1:
+        for other in available:
+            mark = "✅" if other is program else "📚"
+            keyboard.append([InlineKeyboardButton(f"{mark} {other.title}", callback_data=f"prog_{other.id}")])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = f"""🎯 انتخاب هفته
+
+الان کدوم هفته از {program.title} هستی؟
+(این فقط برای نمایش برنامه هفتگیه)"""
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+@menu_route("💡 راهنما")
+async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """راهنما"""
+    # بخش چک‌لیست از برنامه خود کاربر ساخته میشه، نه از telc-b2
+    user_data = await get_user(update.effective_user.id)
+    program = programs.get(user_data.program if user_data else '')
+    count = len(program.checklist)
+    items = "\n".join(f"  • {entry.title}" for entry in program.checklist)
+    text = f"""💡 راهنمای استفاده
+
+📅 برنامه امروز
+برنامه دقیق امروز + وظایف هفته جاری
+
+✅ چک‌لیست
+{count} کار ساده روزانه:
+{items}
+
+📊 آمار من
+Streak، جریمه، پیشرفت هفتگی
+
+📚 برنامه هفته
+گرامر، واژگان و وظایف هفته جاری
+
+🏆 رتبه‌بندی (/leaderboard)
+Streak، روزهای موفق و جریمه بقیه + میانگین هر هفته
+
+❌ دفتر اشتباهات
+ثبت اشتباه با مهارت و موضوع، جستجو، و مرور
+فاصله‌دار (هر چی راحت‌تر یادت بیاد، دیرتر دوباره میاد)
+
+🔥 نکات مهم:
+• هر روز {count} تیک = Streak ادامه داره
+• روزی که هیچ تیکی نزنی = جریمه ۵۰ هزار تومان!
+• حساب‌وکتاب هر روز نیمه‌شب انجام میشه
+• Streak بالاتر = انگیزه بیشتر
+
+موفق باشی! 🚀"""
+    
+    await update.message.reply_text(text)
+
+# ============ درخواست‌های Bot API ============
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest با اندازه‌گیری زمان و وضعیت هر درخواست"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        status = 'error'
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+            return status, payload
+        finally:
+            metrics.observe('bot_telegram_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc('bot_telegram_requests_total', endpoint=endpoint, status=status)
+
+class TokenBucket:
+    """محدودکننده نرخ ساده: rate توکن در ثانیه، حداکثر burst توکن ذخیره"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """بعد از 429: تا seconds ثانیه هیچ توکنی داده نمیشه"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class TelcRateLimiter(BaseRateLimiter):
+    """صف ارسال: محدودیت کلی و هر چت، مدیریت RetryAfter و ادغام ویرایش‌های تکراری
+
+    درخواست‌های هر چت به ترتیب رسیدن ارسال میشن. اگه چند
+    editMessageText برای یک پیام پشت هم منتظر باشن، فقط آخریش
+    واقعاً فرستاده میشه (مثلاً وقتی کاربر سریع چند تیک می‌زنه).
+    درخواست‌های broadcast با rate_limit_args='bulk' علاوه بر سقف کلی،
+    به BROADCAST_RATE هم محدود میشن تا جوابِ کاربرها عقب نیفته.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self):
+        # سقف تلگرام برای کل ربات است؛ هر shard فقط سهم خودش رو مصرف می‌کنه
+        self._global = TokenBucket(GLOBAL_RATE / SHARD_COUNT)
+        self._bulk = TokenBucket(BROADCAST_RATE / SHARD_COUNT)
+        self._chat_buckets = OrderedDict()
+        self._chat_locks = UserLocks()
+        # (chat_id, message_id) -> آخرین درخواست ویرایش
+        self._latest_edits = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+            if len(self._chat_buckets) > self.MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # getUpdates، answerCallbackQuery و ... محدودیت پیام ندارن
+            return await self._call(callback, args, kwargs, endpoint, None)
+        
+        edit_key = None
+        if endpoint == 'editMessageText' and data.get('message_id'):
+            edit_key = (chat_id, data['message_id'])
+            ticket = object()
+            self._latest_edits[edit_key] = ticket
+        
+        async with self._chat_locks.hold(chat_id):
+            try:
+                if edit_key and self._latest_edits.get(edit_key) is not ticket:
+                    metrics.inc('bot_telegram_coalesced_total', endpoint=endpoint)
+                    return True
+                bucket = self._chat_bucket(chat_id)
+                await bucket.acquire()
+                if rate_limit_args == 'bulk':
+                    await self._bulk.acquire()
+                await self._global.acquire()
+                return await self._call(callback, args, kwargs, endpoint, bucket)
+            finally:
+                if edit_key and self._latest_edits.get(edit_key) is ticket:
+                    del self._latest_edits[edit_key]
+
+    async def _call(self, callback, args, kwargs, endpoint, bucket):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                metrics.inc('bot_telegram_retries_total', endpoint=endpoint)
+                # بقیه پیام‌های همین چت هم تا اون موقع صبر می‌کنن
+                if bucket is not None:
+                    bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+
+
+metrics.describe('bot_telegram_coalesced_total', "ویرایش‌هایی که با ویرایش جدیدتر همون پیام جایگزین شدن")
+
+# ============ سرور HTTP (webhook + health) ============
+
+HTTP_STATUS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    413: 'Payload Too Large', 503: 'Service Unavailable',
+}
+
+class HttpServer:
+    """سرور HTTP خیلی ساده روی asyncio - فقط برای webhook تلگرام و health check"""
+
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, host=HTTP_HOST, port=HTTP_PORT):
+        self.host = host
+        self.port = port
+        # (method, path) -> coroutine(headers, body) -> (status, content_type, body)
+        self.routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"🌐 سرور HTTP روی {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                length = int(headers.get('content-length', 0))
+                if length > self.MAX_BODY:
+                    await self._respond(writer, 413, 'text/plain', b'too large', close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                
+                handler = self.routes.get((method, path.split('?', 1)[0]))
+                if handler is None:
+                    status, content_type, payload = 404, 'text/plain', b'not found'
+                else:
+                    try:
+                        status, content_type, payload = await handler(headers, body)
+                    except Exception:
+                        logger.exception("❌ خطا در پردازش درخواست HTTP")
+                        status, content_type, payload = 400, 'text/plain', b'bad request'
+                
+                close = headers.get('connection', '').lower() == 'close'
+                await self._respond(writer, status, content_type, payload, close)
+                if close:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, content_type, payload, close=False):
+        head = (
+            f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+def webhook_authorized(headers):
+    """بررسی هدر secret تلگرام (اگه WEBHOOK_SECRET تنظیم شده باشه)"""
+    secret = headers.get('x-telegram-bot-api-secret-token', '')
+    return not WEBHOOK_SECRET_TOKEN or hmac.compare_digest(secret.encode(), WEBHOOK_SECRET_TOKEN.encode())
+
+
+def add_webhook_routes(server, application):
+    """مسیرهای webhook و health check"""
+    
+    async def webhook(headers, body):
+        if not webhook_authorized(headers):
+            return 403, 'text/plain', b'forbidden'
+        update = Update.de_json(json.loads(body), application.bot)
+        await application.update_queue.put(update)
+        return 200, 'text/plain', b'ok'
+    
+    async def health(headers, body):
+        status = {
+            'status': 'ok',
+            'update_queue': application.update_queue.qsize(),
+            'cache': users.stats(),
+        }
+        return 200, 'application/json', json.dumps(status).encode()
+    
+    server.route('POST', WEBHOOK_PATH, webhook)
+    server.route('GET', '/healthz', health)
+    add_metrics_route(server)
+
+
+def add_metrics_route(server):
+    """مسیر /metrics برای Prometheus"""
+    
+    async def metrics_endpoint(headers, body):
+        return 200, 'text/plain; version=0.0.4', metrics.render().encode()
+    
+    server.route('GET', '/metrics', metrics_endpoint)
+
+
+def register_gauges(application):
+    """gaugeهایی که موقع scrape محاسبه میشن"""
+    metrics.gauge('bot_update_queue_size', application.update_queue.qsize, "آپدیت‌های منتظر پردازش")
+    metrics.gauge('bot_store_size_bytes', lambda: store.store.size_bytes() if store.store else 0, "حجم فایل‌های دیتابیس")
+    metrics.gauge('bot_registered_users', lambda: len(registered_users), "کاربران ثبت‌نام‌شده")
+    for stat in ('size', 'hits', 'misses', 'evictions', 'dirty', 'flushes', 'flushed_records'):
+        metrics.gauge(f'bot_user_cache_{stat}', functools.partial(lambda s: users.stats()[s], stat))
+
+
+def stop_on_signals(stop_event):
+    """SIGINT/SIGTERM فقط stop_event رو ست می‌کنن تا خاموش شدن مرتب انجام بشه"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+
+async def drain_and_stop(application, timeout=DRAIN_TIMEOUT):
+    """Application.stop با سقف زمانی برای پردازش آپدیت‌های دریافت‌شده
+
+    stop خودش صف و handlerهای در جریان رو تا آخر پردازش می‌کنه، ولی بدون
+    محدودیت زمان؛ Render بعد از SIGTERM فقط کمی (پیش‌فرض 30 ثانیه) صبر
+    می‌کنه و بعد SIGKILL می‌فرسته، و اگه وسط صف کشته بشیم flush آخر
+    close_store هم اجرا نمیشه. پس اگه تا timeout ثانیه تموم نشد، هر چی تا
+    اینجا پردازش شده ذخیره میشه و بعد stop ادامه میده. قطع دریافت آپدیت
+    جدید (polling یا سرور HTTP) قبل از این، کار صدازننده است.
+    """
+    if not application.running:
+        return
+    started = time.monotonic()
+    try:
+        # task_done هر آپدیت بعد از تموم شدن handlerهاش صدا زده میشه
+        await asyncio.wait_for(application.update_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ پردازش آپدیت‌ها بعد از {timeout:.0f} ثانیه تموم نشد - ذخیره تغییرات تا اینجا")
+        await users.flush()
+    await application.stop()
+    logger.info(f"📥 آپدیت‌های دریافت‌شده پردازش شدن ({time.monotonic() - started:.1f} ثانیه)")
+
+
+async def register_webhook(bot):
+    """ثبت آدرس webhook در تلگرام"""
+    if not WEBHOOK_URL:
+        logger.warning("⚠️ WEBHOOK_URL تنظیم نشده - webhook در تلگرام ثبت نشد")
+        return
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET_TOKEN or None,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+
+async def serve_webhook(application):
+    """اجرای ربات در حالت webhook تا رسیدن SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+    
+    server = HttpServer()
+    add_webhook_routes(server, application)
+    
+    try:
+        # پورت قبل از هر کار دیگه باز میشه؛ آپدیت‌ها تا شروع Application صف می‌کشن
+        await server.start()
+        STARTUP_MARKS.append(('سرور HTTP', time.perf_counter()))
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        STARTUP_MARKS.append(('شروع پردازش آپدیت‌ها', time.perf_counter()))
+        await register_webhook(application.bot)
+        logger.info("✅ ربات آماده است! (webhook)")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await drain_and_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+# ============ چند پروسه (shard) ============
+
+def shard_for(user_id, shard_count):
+    """shard صاحب این کاربر؛ آپدیت‌های بدون کاربر به shard صفر می‌رن"""
+    return int(user_id) % shard_count if user_id else 0
+
+
+def shard_path(path, index):
+    """user_data.sqlite3 -> user_data.shard0.sqlite3"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+
+def update_user_id(data):
+    """شناسه فرستنده از JSON خام آپدیت، بدون ساختن شیء Update"""
+    for key, value in data.items():
+        if key != 'update_id' and isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if sender:
+                return sender.get('id')
+    return None
+
+
+def shard_marker_path():
+    """فایل کنار دیتابیس اصلی که تعداد shardها رو نگه می‌داره"""
+    return (DB_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE) + '.shards'
+
+
+def split_into_shards(shard_count):
+    """پخش دیتابیس تک‌پروسه‌ای بین فایل‌های shard (فقط بار اول)
+
+    تعداد shardها کنار دیتابیس ثبت میشه؛ عوض کردنش بعداً کاربرها رو
+    به shard اشتباه می‌فرسته، پس ربات با خطا بالا نمیاد.
+    """
+    source_path = DB_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE
+    marker_path = shard_marker_path()
+    if os.path.exists(marker_path):
+        with open(marker_path) as f:
+            existing = int(f.read())
+        if existing != shard_count:
+            raise RuntimeError(f"دیتابیس برای {existing} worker تقسیم شده، نه {shard_count} - WORKERS رو برگردونید")
+        return 0
+    
+    moved = 0
+    if os.path.exists(source_path) or os.path.exists(DATA_FILE):
+        source = open_store()
+        targets = [open_store(shard_path(DB_FILE, i), shard_path(DATA_FILE, i)) for i in range(shard_count)]
+        batches = [[] for _ in targets]
+        for user_id, record in source.iter_records():
+            shard = shard_for(user_id, shard_count)
+            batches[shard].append((user_id, record))
+            if len(batches[shard]) >= ROLLOVER_BATCH_SIZE:
+                targets[shard].put_many(batches[shard])
+                batches[shard].clear()
+            moved += 1
+        for target, batch in zip(targets, batches):
+            target.put_many(batch)
+            target.close()
+        source.close()
+        if os.path.exists(source_path):
+            os.replace(source_path, source_path + '.sharded')
+        if STORAGE_BACKEND == 'json' and os.path.exists(source.journal_path):
+            os.remove(source.journal_path)
+        logger.info(f"📦 {moved} کاربر بین {shard_count} shard تقسیم شد")
+    with open(marker_path, 'w') as f:
+        f.write(str(shard_count))
+    return moved
+
 
-# بارگذاری تنظیمات
-load_dotenv()
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-TIMEZONE = pytz.timezone(os.getenv('TIMEZONE', 'Asia/Tehran'))
+# هر فریم: طول payload (4 بایت big-endian) + خود JSON آپدیت
+FRAME_HEADER = struct.Struct('>I')
 
-# تنظیم logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
-logger = logging.getLogger(__name__)
+def encode_frame(payload):
+    return FRAME_HEADER.pack(len(payload)) + payload
 
-# فایل ذخیره داده‌ها
-DATA_FILE = 'user_data.json'
 
-# ============ توابع مدیریت داده ============
+async def read_frame(reader):
+    """خوندن یک فریم؛ None یعنی طرف مقابل اتصال رو بسته"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        return await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
 
-def load_user_data():
-    """بارگذاری اطلاعات کاربران"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
 
-def save_user_data(data):
-    """ذخیره اطلاعات کاربران"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+class ShardDispatcher:
+    """آپدیت‌ها رو بر اساس شناسه کاربر به worker صاحبش می‌فرسته
 
-def init_user(user_id):
-    """مقداردهی اولیه کاربر جدید"""
-    users = load_user_data()
-    user_id_str = str(user_id)
-    
-    if user_id_str not in users:
-        users[user_id_str] = {
-            'name': '',
-            'current_week': 1,
-            'streak': 0,
-            'total_days': 0,
-            'checklist': {'block1': False, 'block2': False, 'sleep': False},
-            'penalty': 0,
-            'mock_tests': [],
-            'errors': [],
-            'skills': {'reading': 6, 'listening': 7, 'writing': 5, 'speaking': 4},
-            'last_checklist_date': None,
-            'start_date': datetime.datetime.now(TIMEZONE).strftime('%Y-%m-%d'),
-            'completed_weeks': []
-        }
-        save_user_data(users)
-    
-    return users[user_id_str]
+    هر worker یک پروسه جدا با Application و دیتابیس خودشه. یک کاربر
+    همیشه به همون worker میره و فریم‌های هر worker از یک اتصال به
+    ترتیب نوشته میشن، پس آپدیت‌های هر کاربر به ترتیب رسیدن به صف
+    Application همون worker می‌رسن و قفل بین پروسه‌ای لازم نیست.
+    """
 
-# ============ برنامه 12 هفته‌ای ============
+    def __init__(self, shard_count, worker_command=None):
+        self.shard_count = shard_count
+        self.worker_command = worker_command or [sys.executable, os.path.abspath(__file__)]
+        self.processes = []
+        self.connections = []
+        self._socket_dir = None
 
-BOOTCAMP_SCHEDULE = {
-    1: {
-        "focus": "مبانی گرامر و ساختارهای ساده",
-        "grammar": ["Present Simple & Continuous", "Past Simple & Continuous", "Question formation"],
-        "vocabulary": ["Daily routines", "Family & relationships", "Time expressions"],
-        "daily_tasks": [
-            "5 جمله با Present Simple بنویس",
-            "10 دقیقه تمرین تلفظ با shadowing",
-            "یک پاراگراف درباره خانواده‌ات بخوان"
-        ]
-    },
-    2: {
-        "focus": "گرامر میانی و توسعه واژگان",
-        "grammar": ["Present Perfect", "Future forms", "Modal verbs"],
-        "vocabulary": ["Work & professions", "Travel", "Food"],
-        "daily_tasks": [
-            "یک خبر کوتاه بخوان و خلاصه کن",
-            "5 جمله با Present Perfect",
-            "تمرین گفتن برنامه‌های هفته آینده"
-        ]
-    },
-    3: {
-        "focus": "ساختارهای پیچیده‌تر",
-        "grammar": ["Passive voice", "Relative clauses", "Conjunctions"],
-        "vocabulary": ["Technology", "Environment", "Health"],
-        "daily_tasks": [
-            "یک مقاله درباره محیط زیست بخوان",
-            "3 جمله Passive بنویس",
-            "تمرین دادن نظر با 'Meiner Meinung nach...'"
-        ]
-    },
-    4: {
-        "focus": "مهارت‌های نوشتاری",
-        "grammar": ["Reported speech", "Conditional sentences", "Infinitive"],
-        "vocabulary": ["Education", "Media", "Culture"],
-        "daily_tasks": [
-            "تمرین نوشتن ایمیل رسمی",
-            "خواندن یک فصل از کتاب",
-            "تمرین If-clauses"
-        ]
-    },
-    5: {
-        "focus": "تقویت Listening",
-        "grammar": ["Word order", "Prepositions", "Adjective endings"],
-        "vocabulary": ["Shopping", "Housing", "Transport"],
-        "daily_tasks": [
-            "10 دقیقه Dictation از ویدیو",
-            "تمرین توضیح مسیر",
-            "نوشتن درباره خانه‌ی ایده‌آل"
-        ]
-    },
-    6: {
-        "focus": "Mock Exam اول",
-        "grammar": ["Review all structures"],
-        "vocabulary": ["All topics review"],
-        "daily_tasks": [
-            "یک آزمون کامل Reading",
-            "تحلیل اشتباهات",
-            "تمرین Speaking با ضبط صدا"
-        ]
-    },
-    7: {
-        "focus": "استراتژی‌های آزمون",
-        "grammar": ["Advanced conjunctions", "Subjunctive II"],
-        "vocabulary": ["Politics", "Economy", "Global issues"],
-        "daily_tasks": [
-            "تمرین خواندن سریع",
-            "نوشتن outline برای موضوعات",
-            "تمرین جواب به سوالات غیرمنتظره"
-        ]
-    },
-    8: {
-        "focus": "تسلط بر Speaking",
-        "grammar": ["Idiomatic expressions", "Phrasal verbs"],
-        "vocabulary": ["Opinions", "Linking words", "Formal language"],
-        "daily_tasks": [
-            "تمرین یک موضوع Speaking ۳ دقیقه",
-            "ضبط صدای خودت",
-            "یادگیری 5 idiom جدید"
-        ]
-    },
-    9: {
-        "focus": "Mock Exam دوم",
-        "grammar": ["Full review"],
-        "vocabulary": ["Exam vocabulary"],
-        "daily_tasks": [
-            "یک بخش کامل آزمون",
-            "تحلیل نقاط ضعف",
-            "تمرین تخصصی"
-        ]
-    },
-    10: {
-        "focus": "رفع نقاط ضعف",
-        "grammar": ["Personal weak points"],
-        "vocabulary": ["Gap-filling"],
-        "daily_tasks": [
-            "2 ساعت روی ضعیف‌ترین مهارت",
-            "مرور flashcards",
-            "گفتگو با native speaker"
-        ]
-    },
-    11: {
-        "focus": "تثبیت و اعتماد به نفس",
-        "grammar": ["Light review"],
-        "vocabulary": ["Active recall"],
-        "daily_tasks": [
-            "مرور نکات کلیدی",
-            "تمرین آرامش در استرس",
-            "شبیه‌سازی روز آزمون"
-        ]
-    },
-    12: {
-        "focus": "آماده‌سازی نهایی",
-        "grammar": ["Quick review"],
-        "vocabulary": ["Final list"],
-        "daily_tasks": [
-            "استراحت ذهنی",
-            "مرور نکات آزمون",
-            "آماده‌سازی روحی"
-        ]
-    }
-}
+    def worker_env(self, index):
+        env = dict(os.environ)
+        env.update({
+            'BOT_MODE': 'worker',
+            'SHARD_INDEX': str(index),
+            'SHARD_COUNT': str(self.shard_count),
+            'WORKER_SOCKET': os.path.join(self._socket_dir, f'shard{index}.sock'),
+            'DB_FILE': shard_path(DB_FILE, index),
+            'DATA_FILE': shard_path(DATA_FILE, index),
+            'HANDOFF_FILE': shard_path(HANDOFF_FILE, index) if HANDOFF_FILE else '',
+            'METRICS_PORT': str(METRICS_PORT + 1 + index) if METRICS_PORT else '0',
+        })
+        return env
 
-# ============ برنامه روزانه ============
+    async def start(self):
+        self._socket_dir = tempfile.mkdtemp(prefix='telc-shards-')
+        for index in range(self.shard_count):
+            process = await asyncio.create_subprocess_exec(*self.worker_command, env=self.worker_env(index))
+            self.processes.append(process)
+        for index, process in enumerate(self.processes):
+            path = os.path.join(self._socket_dir, f'shard{index}.sock')
+            self.connections.append(await self._connect(path, process))
+        logger.info(f"🧩 {self.shard_count} worker آماده است")
 
-def get_daily_schedule(day_name):
-    """برگرداندن برنامه روزانه"""
-    schedules = {
-        'یکشنبه': """📅 برنامه یکشنبه
+    @staticmethod
+    async def _connect(path, process):
+        # worker بعد از بالا اومدن کاملش (rollover و ...) socket رو باز می‌کنه
+        while True:
+            try:
+                return await asyncio.open_unix_connection(path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if process.returncode is not None:
+                    raise RuntimeError(f"worker با کد {process.returncode} خارج شد")
+                await asyncio.sleep(0.1)
 
-🌅 صبح:
-06:30 - بیدار شدن
-07:00 - صبحانه + فلش‌کارت (15 دقیقه)
-08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
-09:30 - کار فروش
+    def alive(self):
+        return [process.returncode is None for process in self.processes]
 
-🏫 بعدازظهر:
-13:30 - کلاس زبان (3 ساعت)
-16:30 - باشگاه + پادکست
+    async def wait_any_exit(self):
+        """تا وقتی یکی از workerها خارج بشه صبر می‌کنه"""
+        waiters = [asyncio.create_task(process.wait()) for process in self.processes]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        logger.error(f"❌ worker غیرمنتظره خارج شد: {self.alive()}")
 
-🌙 شب:
-19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
-21:00 - آزاد با دوستان
-23:00 - 😴 خواب حتماً!""",
+    async def dispatch(self, data, payload):
+        """فرستادن بایت‌های خام آپدیت به worker صاحبش"""
+        shard = shard_for(update_user_id(data), self.shard_count)
+        _, writer = self.connections[shard]
+        writer.write(encode_frame(payload))
+        await writer.drain()
+        metrics.inc('bot_dispatch_updates_total', shard=str(shard))
+        return shard
 
-        'دوشنبه': """📅 برنامه دوشنبه
+    async def stop(self):
+        """بستن اتصال‌ها؛ هر worker صفش رو تموم می‌کنه، گزارش میده و خارج میشه"""
+        for _, writer in self.connections:
+            with contextlib.suppress(ConnectionError, OSError):
+                writer.write_eof()
+        reports = []
+        for reader, writer in self.connections:
+            payload = await read_frame(reader)
+            if payload:
+                reports.append(json.loads(payload))
+            writer.close()
+        for process in self.processes:
+            await process.wait()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+        return reports
 
-🌅 صبح:
-06:30 - بیدار شدن
-07:00 - صبحانه + فلش‌کارت
-08:00 - ✍️ بلوک اول: Schreiben (1 ساعت)
-09:00 - کار فروش
 
-🏫 بعدازظهر:
-16:00 - 📝 بلوک دوم: Mock Test یک بخش (1.5 ساعت)
-17:30 - باشگاه
+metrics.describe('bot_dispatch_updates_total', "آپدیت‌های فرستاده‌شده به هر worker")
 
-🌙 شب:
-20:00 - مرور اشتباهات (30 دقیقه)
-21:00 - آزاد
-23:00 - 😴 خواب""",
 
-        'سه‌شنبه': """📅 برنامه سه‌شنبه
+def add_dispatch_routes(server, dispatcher):
+    """مسیرهای webhook و health check پروسه dispatcher"""
+    
+    async def webhook(headers, body):
+        if not webhook_authorized(headers):
+            return 403, 'text/plain', b'forbidden'
+        try:
+            await dispatcher.dispatch(json.loads(body), body)
+        except ConnectionError:
+            # جواب غیر 200 یعنی تلگرام بعداً دوباره می‌فرسته
+            return 503, 'text/plain', b'worker unavailable'
+        return 200, 'text/plain', b'ok'
+    
+    async def health(headers, body):
+        alive = dispatcher.alive()
+        status = {'status': 'ok' if all(alive) else 'degraded', 'workers': alive}
+        return (200 if all(alive) else 503), 'application/json', json.dumps(status).encode()
+    
+    server.route('POST', WEBHOOK_PATH, webhook)
+    server.route('GET', '/healthz', health)
+    add_metrics_route(server)
 
-🌅 صبح:
-06:30 - بیدار شدن
-07:00 - صبحانه + فلش‌کارت
-08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
 
-🏫 بعدازظهر:
-12:00 - 🗣️ کلاس مکالمه
-13:30 - کلاس زبان (3 ساعت)
-16:30 - باشگاه + پادکست
+async def serve_sharded(shard_count):
+    """حالت چند پروسه: این پروسه webhook رو می‌گیره و فقط پخش می‌کنه"""
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+    
+    dispatcher = ShardDispatcher(shard_count)
+    server = HttpServer()
+    add_dispatch_routes(server, dispatcher)
+    
+    await dispatcher.start()
+    # اگه یکی از workerها بمیره، کل سرویس خاموش میشه تا میزبان دوباره بالاش بیاره
+    watcher = asyncio.create_task(dispatcher.wait_any_exit())
+    watcher.add_done_callback(lambda _: stop_event.set())
+    try:
+        await server.start()
+        async with Bot(BOT_TOKEN) as bot:
+            await register_webhook(bot)
+        logger.info(f"✅ ربات آماده است! (webhook، {shard_count} worker)")
+        await stop_event.wait()
+    finally:
+        watcher.cancel()
+        await server.stop()
+        reports = await dispatcher.stop()
+        logger.info(f"📊 گزارش workerها: {reports}")
 
-🌙 شب:
-19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
-21:00 - آزاد
-23:00 - 😴 خواب""",
 
-        'چهارشنبه': """📅 برنامه چهارشنبه
+async def serve_worker(application):
+    """اجرای یک shard: آپدیت‌ها از dispatcher روی unix socket می‌رسن
 
-🌅 صبح:
-06:30 - بیدار شدن
-07:00 - صبحانه + فلش‌کارت
-08:00 - ✍️ بلوک اول: Schreiben (1 ساعت)
-09:00 - کار فروش
+    وقتی dispatcher اتصال رو می‌بنده، آپدیت‌های توی صف تا آخر پردازش
+    میشن، تعدادشون به dispatcher گزارش میشه و worker خاموش میشه.
+    """
+    stop_event = asyncio.Event()
+    drained = asyncio.Event()
+    stop_on_signals(stop_event)
+    handlers = set()
+    # اتصال‌هایی که هنوز از dispatcher می‌خونن (موقع SIGTERM بسته میشن)
+    readers = {}
+    
+    async def receive(reader, writer):
+        task = asyncio.current_task()
+        handlers.add(task)
+        readers[task] = writer
+        received = 0
+        while (payload := await read_frame(reader)) is not None:
+            update = Update.de_json(json.loads(payload), application.bot)
+            await application.update_queue.put(update)
+            received += 1
+        readers.pop(task, None)
+        stop_event.set()
+        await drained.wait()
+        report = {'shard': SHARD_INDEX, 'updates': received, 'cache': users.stats()}
+        with contextlib.suppress(ConnectionError):
+            writer.write(encode_frame(json.dumps(report).encode()))
+            await writer.drain()
+        writer.close()
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    server = None
+    try:
+        await application.start()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(WORKER_SOCKET)
+        server = await asyncio.start_unix_server(receive, WORKER_SOCKET)
+        STARTUP_MARKS.append(('شروع پردازش آپدیت‌ها', time.perf_counter()))
+        logger.info(f"✅ worker {SHARD_INDEX}/{SHARD_COUNT} آماده است")
+        await stop_event.wait()
+    finally:
+        if server:
+            server.close()
+        for writer in list(readers.values()):
+            writer.close()
+        await drain_and_stop(application)
+        drained.set()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
 
-🏫 بعدازظهر:
-16:00 - 📝 بلوک دوم: Mock Test یک بخش (1.5 ساعت)
-17:30 - باشگاه
+# ============ پشتیبان‌گیری: export / import ============
 
-🌙 شب:
-20:00 - مرور اشتباهات
-21:00 - آزاد
-23:00 - 😴 خواب""",
+# ستون‌های CSV برای تحلیل؛ import فقط NDJSON رو می‌پذیره
+EXPORT_CSV_FIELDS = (
+    'user_id', 'name', 'current_week', 'streak', 'total_days', 'penalty',
+    'start_date', 'last_checklist_date', 'completed_weeks', 'mock_tests', 'errors',
+) + SKILLS
 
-        'پنج‌شنبه': """📅 برنامه پنج‌شنبه
 
-🌅 صبح:
-06:30 - بیدار شدن
-07:00 - صبحانه + فلش‌کارت
-08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
+def data_store_paths():
+    """[(db_file, data_file)]: فایل‌های تک‌پروسه‌ای، یا فایل هر shard اگه تقسیم شده"""
+    marker_path = shard_marker_path()
+    if not os.path.exists(marker_path):
+        return [(DB_FILE, DATA_FILE)]
+    with open(marker_path) as f:
+        shard_count = int(f.read())
+    return [(shard_path(DB_FILE, i), shard_path(DATA_FILE, i)) for i in range(shard_count)]
 
-🏫 بعدازظهر:
-13:30 - کلاس زبان (3 ساعت)
-16:30 - باشگاه + پادکست
 
-🌙 شب:
-19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
-21:00 - آزاد
-23:00 - 😴 خواب""",
+def open_data_file(path, mode):
+    """'-' یعنی stdin/stdout؛ پسوند .gz یعنی فشرده"""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    if path.endswith('.gz'):
+        import gzip
+        # سطح 6: حجم نزدیک به سطح 9 با سرعت خیلی بیشتر
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='', compresslevel=6)
+    return open(path, mode, encoding='utf-8', newline='')
 
-        'جمعه': """📅 برنامه جمعه
 
-🌅 صبح:
-آزاد - خانواده/دوستان
+def chunk_path(path, index):
+    """users.ndjson.gz -> users.00003.ndjson.gz"""
+    directory, name = os.path.split(path)
+    stem, dot, ext = name.partition('.')
+    return os.path.join(directory, f"{stem}.{index:05d}{dot}{ext}")
 
-📊 بعدازظهر:
-15:00 - بازنگری هفتگی (1 ساعت)
-16:00 - 📝 Mock Test کامل (2.5 ساعت)
 
-🌙 شب: آزاد""",
+def csv_row(user_id, record):
+    return (
+        user_id, record.name, record.current_week, record.streak, record.total_days, record.penalty,
+        day_str(record.start_day) or '', day_str(record.last_checklist_day) or '',
+        len(record.completed_weeks), len(record.mock_tests), len(record.errors),
+        *(level / 10 for level in record.skills),
+    )
 
-        'شنبه': """📅 برنامه شنبه
 
-🌅 صبح:
-🎥 ویدیوهای DW یا Easy German (1 ساعت)
+def iter_export(fmt):
+    """سطرهای خروجی همه کاربرا (همه shardها)، دسته به دسته از store فقط‌خواندنی"""
+    for db_file, data_file in data_store_paths():
+        if not os.path.exists(db_file if STORAGE_BACKEND == 'sqlite' else data_file):
+            continue
+        source = open_store(db_file, data_file, readonly=True)
+        try:
+            for user_id, data in source.iter_json(EXPORT_BATCH_SIZE):
+                if fmt == 'ndjson':
+                    # JSON ذخیره‌شده بدون parse دوباره مستقیم نوشته میشه
+                    yield f'{{"u": {json.dumps(user_id)}, "r": {data}}}\n'
+                else:
+                    yield csv_row(user_id, UserRecord.from_dict(json.loads(data)))
+        finally:
+            source.close()
 
-🌙 بعدازظهر/شب:
-آزاد - پادکست + گردش"""
-    }
-    
-    return schedules.get(day_name, "برنامه‌ای تعریف نشده")
 
-# ============ Handlers ============
+def export_users(path, fmt=None, chunk_size=0):
+    """نوشتن همه کاربرا در path به صورت NDJSON یا CSV؛ خروجی: تعداد
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """شروع کار با ربات"""
-    user_id = update.effective_user.id
-    init_user(user_id)
-    
-    keyboard = [
-        [KeyboardButton("📅 برنامه امروز"), KeyboardButton("✅ چک‌لیست")],
-        [KeyboardButton("📊 آمار من"), KeyboardButton("📚 برنامه هفته")],
-        [KeyboardButton("📝 Mock Test"), KeyboardButton("❌ دفتر اشتباهات")],
-        [KeyboardButton("🎯 تنظیم هفته"), KeyboardButton("💡 راهنما")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    welcome_text = """🎓 به Boot Camp telc B2 خوش اومدی!
+    هر خط NDJSON همون فرمت ژورنال است: {"u": user_id, "r": رکورد}.
+    حافظه مصرفی ثابته و به تعداد کاربرا بستگی نداره (جز backend json که
+    خودش همه چیز رو در حافظه داره). با SQLite کنار ربات در حال اجرا هم
+    میشه اجراش کرد. با chunk_size هر chunk_size کاربر یک فایل جدا
+    (users.00000.ndjson.gz، ...) که هر کدوم جدا import میشه.
+    """
+    fmt = fmt or ('csv' if '.csv' in os.path.basename(path) else 'ndjson')
+    rows = iter_export(fmt)
+    row = next(rows, None)
+    count = 0
+    for index in itertools.count():
+        with open_data_file(chunk_path(path, index) if chunk_size else path, 'w') as out:
+            if fmt == 'csv':
+                import csv
+                writer = csv.writer(out)
+                writer.writerow(EXPORT_CSV_FIELDS)
+                write = writer.writerow
+            else:
+                write = out.write
+            written = 0
+            while row is not None and (not chunk_size or written < chunk_size):
+                write(row)
+                written += 1
+                row = next(rows, None)
+        count += written
+        if row is None:
+            return count
 
-این ربات یه همراه واقعی برای موفقیت توئه، نه فقط یه ربات معمولی! 🔥
 
-چیکارا می‌کنه:
-✅ برنامه روزانه دقیق
-✅ چک‌لیست تعاملی با Streak
-✅ سیستم جریمه (پایبندی = پول!)
-✅ مدیریت Mock Test
-✅ دفتر اشتباهات شخصی
-✅ گزارش پیشرفت هفتگی
+def import_users(paths):
+    """خوندن فایل‌های NDJSON export و نوشتن دسته‌ای؛ خروجی: تعداد
 
-🎯 اولین قدم:
-اسمت رو بهم بگو تا باهم شروع کنیم!
-(مثلاً: علی)"""
+    هر EXPORT_BATCH_SIZE رکورد یک تراکنش. رکورد موجود با همون user_id
+    جایگزین میشه، پس اجرای دوباره بعد از قطع شدن بی‌خطره. ربات باید
+    خاموش باشه، وگرنه کش ربات رکوردهای import‌شده رو با نسخه قدیمی
+    خودش بازنویسی می‌کنه.
+    """
+    targets = [open_store(db_file, data_file) for db_file, data_file in data_store_paths()]
+    batches = [[] for _ in targets]
+    count = 0
+    try:
+        for path in paths:
+            with open_data_file(path, 'r') as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        user_id = str(int(entry['u']))
+                        record = UserRecord.from_dict(entry['r'])
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        raise ValueError(f"{path}:{line_number}: سطر نامعتبر ({e})") from e
+                    shard = shard_for(user_id, len(targets))
+                    batches[shard].append((user_id, record))
+                    if len(batches[shard]) >= EXPORT_BATCH_SIZE:
+                        targets[shard].load_many(batches[shard])
+                        batches[shard].clear()
+                    count += 1
+        for target, batch in zip(targets, batches):
+            target.load_many(batch)
+    finally:
+        for target in targets:
+            target.close()
+    return count
 
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """مدیریت پیام‌های متنی"""
-    user_id = update.effective_user.id
-    text = update.message.text
-    users = load_user_data()
-    user_data = users.get(str(user_id), {})
-    
-    # ثبت نام
-    if not user_data.get('name'):
-        users[str(user_id)]['name'] = text
-        save_user_data(users)
-        await update.message.reply_text(
-            f"🎉 عالی {text}!\n\n"
-            "حالا از منوی پایین استفاده کن.\n"
-            "پیشنهاد میدم با '📅 برنامه امروز' شروع کنی! 👇"
-        )
-        return
-    
-    # برنامه امروز
-    if text == "📅 برنامه امروز":
-        now = datetime.datetime.now(TIMEZONE)
-        day_name = now.strftime('%A')
-        day_mapping = {
-            'Saturday': 'شنبه', 'Sunday': 'یکشنبه', 'Monday': 'دوشنبه',
-            'Tuesday': 'سه‌شنبه', 'Wednesday': 'چهارشنبه', 
-            'Thursday': 'پنج‌شنبه', 'Friday': 'جمعه'
-        }
-        persian_day = day_mapping[day_name]
-        schedule = get_daily_schedule(persian_day)
-        
-        # اضافه کردن وظایف هفته جاری
-        week_data = BOOTCAMP_SCHEDULE.get(user_data.get('current_week', 1))
-        tasks_text = "\n\n🎯 وظایف ویژه این هفته:\n"
-        for i, task in enumerate(week_data['daily_tasks'], 1):
-            tasks_text += f"{i}. {task}\n"
-        
-        await update.message.reply_text(schedule + tasks_text)
-    
-    # چک‌لیست
-    elif text == "✅ چک‌لیست":
-        await show_checklist(update, context)
-    
-    # آمار
-    elif text == "📊 آمار من":
-        await show_stats(update, context)
-    
-    # برنامه هفته
-    elif text == "📚 برنامه هفته":
-        await show_week_plan(update, context)
-    
-    # Mock Test
-    elif text == "📝 Mock Test":
-        await show_mock_test_menu(update, context)
-    
-    # دفتر اشتباهات
-    elif text == "❌ دفتر اشتباهات":
-        await show_errors(update, context)
-    
-    # تنظیم هفته
-    elif text == "🎯 تنظیم هفته":
-        await set_week_menu(update, context)
-    
-    # راهنما
-    elif text == "💡 راهنما":
-        await show_help(update, context)
+def streak_from_activity(record):
+    """Streak تا last_closed_day از روی activity، یا None اگه تاریخچه برای حسابش کافی نیست
 
-async def show_checklist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """نمایش چک‌لیست روزانه"""
-    user_id = update.effective_user.id
-    users = load_user_data()
-    user_data = users[str(user_id)]
-    
-    today = datetime.datetime.now(TIMEZONE).strftime('%Y-%m-%d')
-    
-    # ریست چک‌لیست اگه روز جدیده
-    if user_data.get('last_checklist_date') != today:
-        user_data['checklist'] = {'block1': False, 'block2': False, 'sleep': False}
-        user_data['last_checklist_date'] = today
-        users[str(user_id)] = user_data
-        save_user_data(users)
-    
-    checklist = user_data['checklist']
-    
-    block1_icon = "✅" if checklist['block1'] else "⬜"
-    block2_icon = "✅" if checklist['block2'] else "⬜"
-    sleep_icon = "✅" if checklist['sleep'] else "⬜"
+    زنجیره روزهای کامل باید یا به یک روز ثبت‌شده ناقص برسه یا به قبل از
+    start_day؛ اگه به روز ثبت‌نشده برسه (مثلاً قبل از اضافه شدن activity)
+    Streak واقعی ممکنه بلندتر باشه.
+    """
+    if not record.name or not record.start_day or not record.last_closed_day:
+        return None
+    streak = record.activity_streak(record.last_closed_day)
+    end = record.last_closed_day - streak
+    if end >= record.start_day and not record.day_activity(end) & DAY_RECORDED:
+        return None
+    # رکوردهای قدیمی Streak روزی که هنوز بسته نشده رو موقع تیک زدن حساب کرده بودن
+    if record.last_streak_day > record.last_closed_day:
+        streak += 1
+    return streak
+
+
+def repair_streaks(dry_run=False):
+    """Streak همه کاربرا (همه shardها) رو با streak_from_activity درست می‌کنه؛ خروجی: تعداد بررسی‌شده
+
+    مثل import ربات باید خاموش باشه. با dry_run فقط گزارش میده.
+    """
+    scanned = fixed = unknown = 0
     
-    keyboard = [
-        [InlineKeyboardButton(f"{block1_icon} بلوک صبح (1.5 ساعت)", callback_data="check_block1")],
-        [InlineKeyboardButton(f"{block2_icon} بلوک بعدازظهر (1 ساعت)", callback_data="check_block2")],
-        [InlineKeyboardButton(f"{sleep_icon} خواب ساعت 23:00", callback_data="check_sleep")],
-        [InlineKeyboardButton("🔄 ریست چک‌لیست", callback_data="reset_checklist")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    def repair(record):
+        nonlocal fixed, unknown
+        streak = streak_from_activity(record)
+        if streak is None:
+            unknown += bool(record.name)
+            return False
+        if streak == record.streak:
+            return False
+        fixed += 1
+        if dry_run:
+            return False
+        record.streak = streak
+        return True
     
-    completed = sum(checklist.values())
+    for db_file, data_file in data_store_paths():
+        if not os.path.exists(db_file if STORAGE_BACKEND == 'sqlite' else data_file):
+            continue
+        target = open_store(db_file, data_file)
+        try:
+            after_key = None
+            while True:
+                after_key, batch_scanned, _ = target.map_batch(repair, after_key, EXPORT_BATCH_SIZE)
+                scanned += batch_scanned
+                if after_key is None:
+                    break
+        finally:
+            target.close()
+    action = "باید اصلاح بشه" if dry_run else "اصلاح شد"
+    logger.info(f"🔥 Streak {fixed} کاربر {action}؛ {unknown} کاربر تاریخچه کافی نداشتن و دست نخوردن")
+    return scanned
+
+
+def run_data_command(argv):
+    """python bot.py export|import|repair-streaks ..."""
+    # argparse/csv/gzip فقط این‌جا لازمن؛ import سطح بالا راه‌اندازی ربات رو کند می‌کرد
+    import argparse
+    parser = argparse.ArgumentParser(prog='bot.py', description="پشتیبان‌گیری و تعمیر داده کاربران")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="خروجی NDJSON یا CSV (با پسوند .gz فشرده)")
+    export.add_argument('path', nargs='?', default='-', help="فایل خروجی؛ '-' یعنی stdout")
+    export.add_argument('--format', choices=('ndjson', 'csv'), help="پیش‌فرض از روی پسوند فایل")
+    export.add_argument('--chunk', type=int, default=0, metavar='N', help="هر N کاربر یک فایل جدا")
+    load = commands.add_parser('import', help="خوندن فایل(های) NDJSON در دیتابیس")
+    load.add_argument('paths', nargs='+', help="فایل‌ها یا chunkها؛ '-' یعنی stdin")
+    repair = commands.add_parser('repair-streaks', help="حساب دوباره Streak از روی تاریخچه روزها (activity)")
+    repair.add_argument('--dry-run', action='store_true', help="فقط گزارش، بدون ذخیره")
+    args = parser.parse_args(argv)
     
-    if completed == 3:
-        status = "🎉 عالی! روز کامل - Streak ادامه داره!"
-        emoji = "🔥"
-    elif completed == 2:
-        status = "✅ خوبه! ۲ از ۳ - یکی دیگه مونده"
-        emoji = "💪"
-    elif completed == 1:
-        status = "⚠️ یکی رو انجام دادی - ادامه بده!"
-        emoji = "😊"
+    started = time.monotonic()
+    if args.command == 'export':
+        count = export_users(args.path, args.format, args.chunk)
+    elif args.command == 'import':
+        count = import_users(args.paths)
     else:
-        status = "❌ هنوز شروع نکردی - بزن بریم!"
-        emoji = "🚀"
-    
-    text = f"""📋 چک‌لیست امروز {emoji}
+        count = repair_streaks(args.dry_run)
+    elapsed = time.monotonic() - started
+    logger.info(f"📦 {args.command}: {count} کاربر در {elapsed:.1f} ثانیه ({count / max(elapsed, 1e-6):.0f} در ثانیه)")
 
-{status}
-🔥 Streak فعلی: {user_data.get('streak', 0)} روز
 
-روی هر گزینه کلیک کن:"""
-    
-    await update.message.reply_text(text, reply_markup=reply_markup)
+# ============ تحویل وضعیت بین ری‌استارت‌ها ============
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """مدیریت دکمه‌های inline"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    users = load_user_data()
-    user_data = users[str(user_id)]
-    
-    if query.data.startswith("check_"):
-        item = query.data.replace("check_", "")
-        user_data['checklist'][item] = not user_data['checklist'][item]
-        
-        completed = sum(user_data['checklist'].values())
-        today = datetime.datetime.now(TIMEZONE).strftime('%Y-%m-%d')
-        
-        # محاسبه Streak
-        if completed == 3 and user_data.get('last_checklist_date') == today:
-            if user_data.get('last_streak_update') != today:
-                user_data['streak'] += 1
-                user_data['total_days'] += 1
-                user_data['last_streak_update'] = today
-                
-                # آپدیت مهارت‌ها
-                for skill in user_data['skills']:
-                    if user_data['skills'][skill] < 10:
-                        user_data['skills'][skill] = min(10, user_data['skills'][skill] + 0.1)
-        
-        elif completed == 0 and user_data['checklist'] == {'block1': False, 'block2': False, 'sleep': False}:
-            user_data['penalty'] += 50000
-            user_data['streak'] = 0
-        
-        users[str(user_id)] = user_data
-        save_user_data(users)
-        
-        # آپدیت پیام
-        checklist = user_data['checklist']
-        block1_icon = "✅" if checklist['block1'] else "⬜"
-        block2_icon = "✅" if checklist['block2'] else "⬜"
-        sleep_icon = "✅" if checklist['sleep'] else "⬜"
-        
-        keyboard = [
-            [InlineKeyboardButton(f"{block1_icon} بلوک صبح", callback_data="check_block1")],
-            [InlineKeyboardButton(f"{block2_icon} بلوک بعدازظهر", callback_data="check_block2")],
-            [InlineKeyboardButton(f"{sleep_icon} خواب ساعت 23:00", callback_data="check_sleep")],
-            [InlineKeyboardButton("🔄 ریست", callback_data="reset_checklist")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        completed_now = sum(checklist.values())
-        
-        if completed_now == 3:
-            status = f"🎉 تمام! Streak: {user_data['streak']} روز 🔥"
-            emoji = "🏆"
-        elif completed_now == 2:
-            status = "✅ خوبه! یکی دیگه!"
-            emoji = "💪"
-        elif completed_now == 1:
-            status = "😊 شروع کردی!"
-            emoji = "🚀"
+# با هر تغییر فرمت یکی اضافه میشه؛ فایل نسخه دیگه نادیده گرفته میشه
+HANDOFF_VERSION = 1
+# یادآوری که بیشتر از این (ثانیه) وسط ری‌استارت از وقتش گذشته، دیگه فرستاده نمیشه
+HANDOFF_CATCHUP = 15 * 60
+
+# records: [(user_id، UserRecord)] از جدیدترین؛ dedup: خروجی UpdateDedup.dump؛
+# schedules: {اسم زمان‌بند: خروجی due_times}
+Handoff = namedtuple('Handoff', 'records dedup schedules')
+
+
+def store_stamp():
+    """اندازه و mtime فایل‌های دیتابیس؛ هر نوشتنی بعد از handoff (مثلاً import) عوضش می‌کنه"""
+    stamp = [STORAGE_BACKEND]
+    for path in (DB_FILE, DB_FILE + '-wal', DATA_FILE, DATA_FILE + '.journal', DATA_FILE + '.meta'):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            stamp.append(None)
         else:
-            status = "❌ ریست شد"
-            emoji = "⚠️"
-        
-        text = f"📋 چک‌لیست امروز {emoji}\n\n{status}"
-        await query.edit_message_text(text, reply_markup=reply_markup)
-    
-    elif query.data == "reset_checklist":
-        user_data['checklist'] = {'block1': False, 'block2': False, 'sleep': False}
-        users[str(user_id)] = user_data
-        save_user_data(users)
-        await query.edit_message_text("✅ چک‌لیست ریست شد! از منو دوباره باز کن.")
+            stamp.append((info.st_size, info.st_mtime_ns))
+    return tuple(stamp)
 
-async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """نمایش آمار کاربر"""
-    user_id = update.effective_user.id
-    users = load_user_data()
-    user_data = users[str(user_id)]
-    
-    streak = user_data.get('streak', 0)
-    total_days = user_data.get('total_days', 0)
-    penalty = user_data.get('penalty', 0)
-    current_week = user_data.get('current_week', 1)
-    skills = user_data.get('skills', {})
-    
-    streak_emoji = "🔥" if streak >= 7 else "⭐" if streak >= 3 else "💫"
-    
-    # محاسبه پیشرفت کلی
-    progress_percent = int((current_week / 12) * 100)
-    
-    # نمایش مهارت‌ها
-    skills_text = ""
-    for skill_name, skill_level in skills.items():
-        stars = "⭐" * int(skill_level)
-        skill_persian = {
-            'reading': '📚 Reading',
-            'listening': '👂 Listening',
-            'writing': '✍️ Writing',
-            'speaking': '🗣 Speaking'
-        }
-        skills_text += f"{skill_persian[skill_name]}: {stars} ({skill_level:.1f}/10)\n"
-    
-    text = f"""📊 آمار {user_data['name']}
 
-{streak_emoji} Streak فعلی: {streak} روز
-📅 کل روزهای موفق: {total_days} روز
-💰 جریمه تا الان: {penalty:,} تومان
-📈 پیشرفت Boot Camp: {progress_percent}% (هفته {current_week}/12)
+def write_handoff(schedulers):
+    """نوشتن وضعیت داغ برای پروسه بعدی، بعد از آخرین flush و بستن دیتابیس
 
-🎯 سطح مهارت‌ها:
-{skills_text}
+    کش کاربران، آپدیت‌های دیده‌شده و زمان اجرای بعدی زمان‌بندها با marshal
+    (کلیدهای تکراری رکوردها فقط یک بار نوشته میشن) و به صورت اتمیک. دیسک
+    همچنان مرجع اصلیه: رکوردها همون چیزی‌اند که الان ذخیره شد، به شکل
+    to_dict تا نسخه جدید ربات هم بخوندشون. خروجی: تعداد کاربرها.
+    """
+    # از جدیدترین تا preload ترتیب LRU رو حفظ کنه
+    records = [(key, record.to_dict()) for key, record in reversed(users.items())]
+    payload = (
+        HANDOFF_VERSION, time.time(), store_stamp(), records, update_dedup.dump(),
+        {name: scheduler.due_times() for name, scheduler in schedulers.items()},
+    )
+    tmp_path = HANDOFF_FILE + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, HANDOFF_FILE)
+    return len(records)
 
-{"🎉 عالیه! این Streak رو حفظ کن!" if streak >= 7 else "💪 سعی کن Streak بسازی!" if streak < 3 else "✅ داری خوب پیش میری!"}"""
-    
-    await update.message.reply_text(text)
 
-async def show_week_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """نمایش برنامه هفته جاری"""
-    user_id = update.effective_user.id
-    users = load_user_data()
-    user_data = users[str(user_id)]
-    
-    current_week = user_data.get('current_week', 1)
-    week_data = BOOTCAMP_SCHEDULE.get(current_week)
-    
-    text = f"""📚 برنامه هفته {current_week}/12
+def read_handoff():
+    """خوندن فایل handoff با mmap قبل از باز شدن دیتابیس؛ None اگه نیست، خرابه یا کهنه‌ست
 
-🎯 فوکوس: {week_data['focus']}
+    فایل بعد از خوندن پاک میشه: اگه این پروسه بدون خاموش شدن مرتب بمیره،
+    ری‌استارت بعدی سرد شروع می‌کنه نه با وضعیت قدیمی.
+    """
+    if not HANDOFF_FILE or not os.path.exists(HANDOFF_FILE):
+        return None
+    try:
+        with open(HANDOFF_FILE, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            payload = marshal.loads(view)
+        if not isinstance(payload, tuple) or payload[:1] != (HANDOFF_VERSION,):
+            raise ValueError("نسخه ناشناخته")
+        _, written_at, stamp, records, dedup, schedules = payload
+    except (OSError, ValueError, EOFError, TypeError) as e:
+        logger.warning(f"⚠️ فایل {HANDOFF_FILE} نامعتبر است و نادیده گرفته شد: {e}")
+        return None
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(HANDOFF_FILE)
+    if stamp != store_stamp():
+        logger.warning(f"⚠️ دیتابیس بعد از نوشتن {HANDOFF_FILE} تغییر کرده - شروع بدون وضعیت قبلی")
+        return None
+    elapsed = max(0.0, time.time() - written_at)
+    return Handoff(
+        [(key, UserRecord.from_dict(data)) for key, data in records],
+        [(key, remaining - elapsed) for key, remaining in dedup],
+        schedules,
+    )
 
-📖 گرامر این هفته:
-{chr(10).join(f"  • {item}" for item in week_data['grammar'])}
 
-📝 واژگان:
-{chr(10).join(f"  • {item}" for item in week_data['vocabulary'])}
+# ============ Main ============
 
-✅ وظایف روزانه:
-{chr(10).join(f"  {i+1}. {task}" for i, task in enumerate(week_data['daily_tasks']))}
+def process_age():
+    """چند ثانیه از اجرای این پروسه گذشته (از /proc لینوکس)؛ None اگه در دسترس نباشه"""
+    try:
+        with open('/proc/self/stat') as f:
+            # فیلد 22 (starttime)؛ اسم پروسه داخل پرانتز ممکنه فاصله داشته باشه
+            started_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started_ticks / os.sysconf('SC_CLK_TCK')
 
-💡 برای دیدن برنامه روزانه: 📅 برنامه امروز"""
-    
-    await update.message.reply_text(text)
 
-async def show_mock_test_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """منوی Mock Test"""
-    keyboard = [
-        [InlineKeyboardButton("📝 شروع Mock Test جدید", callback_data="start_mock")],
-        [InlineKeyboardButton("📊 نتایج قبلی", callback_data="mock_results")],
-        [InlineKeyboardButton("❌ بستن", callback_data="close")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = """📝 Mock Test Manager
+def startup_report():
+    """مراحل راه‌اندازی به ترتیب زمان، نسبت به شروع پروسه
 
-این بخش به زودی کامل میشه!
-الان می‌تونی:
-- تاریخ Mock Test رو ثبت کنی
-- نتایج رو وارد کنی
-- پیشرفت رو ببینی"""
-    
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    بعضی مراحل (مثل باز شدن دیتابیس روی thread ذخیره‌سازی) همزمان با
+    بقیه انجام میشن، پس زمان‌ها تجمعی‌اند نه طول هر مرحله.
+    """
+    age = process_age()
+    origin = time.perf_counter() - age if age is not None else STARTUP_MARKS[0][1]
+    lines = [f"{(at - origin) * 1000:>8.0f} ms  {phase}" for phase, at in sorted(STARTUP_MARKS, key=lambda mark: mark[1])]
+    return "\n".join(lines)
 
-async def show_errors(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """دفتر اشتباهات"""
-    user_id = update.effective_user.id
-    users = load_user_data()
-    user_data = users[str(user_id)]
-    
-    errors = user_data.get('errors', [])
-    
-    if not errors:
-        text = """❌ دفتر اشتباهات
 
-هنوز اشتباهی ثبت نشده!
+metrics.describe('bot_duplicate_updates_total', "آپدیت‌های تکراری که دور ریخته شدن")
 
-💡 وقتی توی Mock Test یا تمرین اشتباه کردی،
-اینجا ثبتش کن تا مرور کنی."""
-    else:
-        text = "❌ دفتر اشتباهات\n\n"
-        for i, error in enumerate(errors[-10:], 1):
-            text += f"{i}. {error}\n"
-    
-    await update.message.reply_text(text)
+async def drop_duplicate_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """آپدیت تکراری (همون update_id یا همون callback query) به هیچ handlerی نمی‌رسه
 
-async def set_week_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """منوی تنظیم هفته"""
-    keyboard = []
-    for i in range(1, 13):
-        keyboard.append([InlineKeyboardButton(f"هفته {i}", callback_data=f"set_week_{i}")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = """🎯 انتخاب هفته
+    قبل از بقیه گروه‌ها اجرا میشه و بین چک و ثبت await نداره، پس دو نسخه
+    همزمان از یک آپدیت هم فقط یک بار پردازش میشن.
+    """
+    keys = [('update', update.update_id)]
+    if update.callback_query:
+        keys.append(('callback', update.callback_query.id))
+    if update_dedup.seen(*keys):
+        metrics.inc('bot_duplicate_updates_total')
+        raise ApplicationHandlerStop
 
-الان کدوم هفته از Boot Camp هستی؟
-(این فقط برای نمایش برنامه هفتگیه)"""
-    
-    await update.message.reply_text(text, reply_markup=reply_markup)
+async def report_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """--profile-startup: با رسیدن اولین آپدیت زمان راه‌اندازی لاگ میشه"""
+    if context.bot_data.get('first_update_seen'):
+        return
+    context.bot_data['first_update_seen'] = True
+    STARTUP_MARKS.append(('اولین آپدیت', time.perf_counter()))
+    logger.info("⏱ راه‌اندازی تا اولین آپدیت:\n" + startup_report())
 
-async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """راهنما"""
-    text = """💡 راهنمای استفاده
 
-📅 برنامه امروز
-برنامه دقیق امروز + وظایف هفته جاری
+async def warm_cache(count):
+    """خوندن count کاربر اخیراً فعال در کش، دسته به دسته تا thread ذخیره‌سازی آزاد بمونه"""
+    loaded = 0
+    for offset in range(0, count, ROLLOVER_BATCH_SIZE):
+        batch = await store.iter_recent(min(ROLLOVER_BATCH_SIZE, count - offset), offset)
+        loaded += users.preload(batch)
+        if len(batch) < ROLLOVER_BATCH_SIZE:
+            break
+    return loaded
 
-✅ چک‌لیست
-۳ کار ساده روزانه:
-  • بلوک صبح ۱.۵ ساعت
-  • بلوک بعدازظهر ۱ ساعت
-  • خواب ساعت ۲۳:۰۰
 
-📊 آمار من
-Streak، جریمه، پیشرفت هفتگی
+async def warm_up(application):
+    """کارهای سنگین راه‌اندازی، در پس‌زمینه بعد از شروع دریافت آپدیت‌ها
 
-📚 برنامه هفته
-گرامر، واژگان و وظایف هفته جاری
+    هر کدوم کل دیتابیس رو می‌خونن؛ تا تموم بشن ربات بدون اونا هم درست
+    جواب میده: get_user روز جامونده هر کاربر رو موقع خوندن می‌بنده،
+    ثبت‌نام‌شده بودن رو خودش چک می‌کنه و show_leaderboard منتظر می‌مونه.
+    """
+    started = time.monotonic()
+    if handoff is not None:
+        # start_background_tasks منتظر باز شدن دیتابیس نموند؛ فایل خراب هنوز باید ربات رو خاموش کنه
+        try:
+            await store.wait_open()
+        except Exception:
+            logger.critical("❌ باز کردن دیتابیس ناموفق بود - ربات خاموش میشه", exc_info=True)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+    try:
+        await load_registered_users()
+        await load_leaderboard()
+        # اگه ربات نیمه‌شب خاموش بوده، روزهای جامونده همین الان بسته میشن
+        await run_rollover()
+        if CACHE_WARMUP:
+            logger.info(f"🔥 {await warm_cache(CACHE_WARMUP)} کاربر اخیراً فعال توی کش خونده شد")
+    except Exception:
+        logger.exception("❌ خطا در آماده‌سازی پس‌زمینه")
+    tasks = application.bot_data['background_tasks']
+    # روزهای جامونده رو run_rollover بالا بست، پس rollover توی handoff نمیره
+    rollover_scheduler = ReminderScheduler(rollover_job, [('00:00', None, 'rollover', None)])
+    tasks.append(asyncio.create_task(rollover_scheduler.run()))
+    scheduler = None
+    schedulers = application.bot_data['schedulers'] = {}
+    if REMINDERS_ENABLED:
+        scheduler = schedulers['reminders'] = ReminderScheduler(make_reminder_sender(application.bot), build_reminders())
+        # زمان‌بند جدا: ارسال گزارش برای همه کاربرا طول می‌کشه و نباید یادآورها رو عقب بندازه
+        schedulers['weekly_report'] = ReminderScheduler(
+            make_weekly_report_job(application.bot), [(WEEKLY_REPORT_TIME, 'جمعه', 'weekly_report', None)]
+        )
+        tasks.append(asyncio.create_task(resume_weekly_reports(application.bot)))
+    for name, reminder_scheduler in schedulers.items():
+        if handoff is not None:
+            missed = reminder_scheduler.catch_up(handoff.schedules.get(name, {}), HANDOFF_CATCHUP)
+            if missed:
+                logger.info(f"⏰ {missed} یادآور {name} که وسط ری‌استارت وقتش رسید الان اجرا میشه")
+        tasks.append(asyncio.create_task(reminder_scheduler.run()))
+    if PROGRAMS_POLL_INTERVAL:
+        tasks.append(asyncio.create_task(watch_programs(scheduler)))
+    STARTUP_MARKS.append(('پایان آماده‌سازی پس‌زمینه', time.perf_counter()))
+    logger.info(f"✅ آماده‌سازی پس‌زمینه تموم شد ({time.monotonic() - started:.1f} ثانیه)")
 
-🔥 نکات مهم:
-• هر روز ۳ تیک = Streak ادامه داره
-• اگه همه تیک‌ها رو پاک کنی = جریمه ۵۰ هزار تومان!
-• Streak بالاتر = انگیزه بیشتر
 
-موفق باشی! 🚀"""
-    
-    await update.message.reply_text(text)
+async def start_background_tasks(application: Application):
+    """راه‌اندازی کارهای پس‌زمینه (post_init)
 
-# ============ Main ============
+    فقط کارهای سریع؛ هر چی کل دیتابیس رو می‌خونه توی warm_up و بعد از
+    شروع polling/webhook انجام میشه تا اولین آپدیت منتظرش نمونه.
+    """
+    STARTUP_MARKS.append(('initialize (getMe)', time.perf_counter()))
+    if handoff is None:
+        # فایل خراب نباید ربات رو بالا بیاره؛ باز کردن همزمان با initialize شروع شده بود
+        await store.wait_open()
+    # با handoff کاربرای داغ توی کشن و دیتابیس همون فایلیه که پروسه قبلی سالم بست؛
+    # باز شدنش (برای json یعنی parse کل فایل) منتظر اولین جواب نمی‌مونه و warm_up چکش می‌کنه
+    register_gauges(application)
+    if BOT_MODE != 'webhook' and METRICS_PORT:
+        metrics_server = HttpServer(port=METRICS_PORT)
+        add_metrics_route(metrics_server)
+        await metrics_server.start()
+        application.bot_data['metrics_server'] = metrics_server
+    application.bot_data['background_tasks'] = [asyncio.create_task(flush_loop())]
+    application.bot_data['background_tasks'].append(asyncio.create_task(warm_up(application)))
 
-def main():
-    """اجرای ربات"""
-    logger.info("🤖 ربات در حال راه‌اندازی...")
-    
-    # تنظیمات timeout بالاتر
-    request = HTTPXRequest(
-        connection_pool_size=8,
-        connect_timeout=30.0,
-        read_timeout=30.0,
-        write_timeout=30.0,
-        pool_timeout=30.0
-    )
+async def close_store(application: Application):
+    """ذخیره تغییرات باقیمانده و بستن backend ذخیره‌سازی هنگام خاموش شدن"""
+    for task in application.bot_data.pop('background_tasks', []):
+        task.cancel()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server:
+        await metrics_server.stop()
+    await users.flush()
+    logger.info(f"📊 آمار کش کاربران: {users.stats()}")
+    await store.close()
+    if HANDOFF_FILE:
+        try:
+            count = write_handoff(application.bot_data.get('schedulers', {}))
+            logger.info(f"📦 وضعیت {count} کاربر کش‌شده در {HANDOFF_FILE} نوشته شد")
+        except OSError:
+            logger.exception(f"❌ نوشتن {HANDOFF_FILE} ناموفق بود")
+
+def open_persistence():
+    """ساخت کش کاربران؛ خود دیتابیس روی thread ذخیره‌سازی و همزمان با بقیه راه‌اندازی باز میشه
+
+    اگه پروسه قبلی موقع خاموش شدن handoff نوشته، کش و آپدیت‌های دیده‌شده
+    از اون پر میشن. خوندنش قبل از باز شدن دیتابیسه تا مهر فایل‌ها هنوز
+    همون باشه که پروسه قبلی بسته.
+    """
+    global store, users, handoff
+    handoff = read_handoff()
+    store = AsyncStore(open_store)
+    users = UserCache(store)
+    if handoff is not None:
+        loaded = users.preload(handoff.records)
+        update_dedup.load(handoff.dedup)
+        STARTUP_MARKS.append(('خوندن handoff', time.perf_counter()))
+        logger.info(f"📦 {loaded} کاربر و {len(update_dedup)} آپدیت دیده‌شده از {HANDOFF_FILE} برگشت")
+
+def build_application(request=None, use_updater=True):
+    """ساخت Application با همه handlerها
+
+    request رو میشه عوض کرد (مثلاً در loadtest.py با یک Bot API جعلی).
+    """
+    if request is None:
+        # pool اصلی فقط برای ارسال‌ها؛ getUpdates اتصال خودش رو داره
+        request = InstrumentedHTTPXRequest(
+            connection_pool_size=SEND_POOL_SIZE,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=SEND_TIMEOUT,
+            write_timeout=SEND_TIMEOUT,
+            pool_timeout=POOL_TIMEOUT
+        )
     
-    application = (
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
         .request(request)
-        .build()
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(start_background_tasks)
+        .post_shutdown(close_store)
     )
+    if RATE_LIMITER_ENABLED:
+        builder = builder.rate_limiter(TelcRateLimiter())
+    if use_updater:
+        builder = builder.get_updates_request(InstrumentedHTTPXRequest(
+            connection_pool_size=1,
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=GET_UPDATES_TIMEOUT,
+            write_timeout=SEND_TIMEOUT,
+            pool_timeout=POOL_TIMEOUT
+        ))
+    else:
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("leaderboard", instrument_handler(show_leaderboard)))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(CallbackQueryHandler(button_handler))
+    # فایل برنامه خراب باید همین‌جا معلوم بشه، نه با اولین پیام کاربر
+    programs.get()
+    application.add_handler(TypeHandler(Update, drop_duplicate_update), group=-2)
+    if PROFILE_STARTUP:
+        application.add_handler(TypeHandler(Update, report_first_update), group=-1)
+    STARTUP_MARKS.append(('ساخت Application', time.perf_counter()))
+    return application
+
+async def serve_polling(application):
+    """اجرای ربات در حالت polling تا رسیدن SIGINT/SIGTERM
+
+    مثل run_polling، با این فرق که خاموش شدن مثل بقیه حالت‌ها از
+    drain_and_stop رد میشه تا flush و handoff قبل از SIGKILL انجام بشن.
+    """
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
     
-    logger.info("✅ ربات آماده است!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        STARTUP_MARKS.append(('شروع پردازش آپدیت‌ها', time.perf_counter()))
+        logger.info("✅ ربات آماده است!")
+        await stop_event.wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        await drain_and_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def main():
+    """اجرای ربات (یا با export/import/repair-streaks: کار روی داده‌ها)"""
+    if sys.argv[1:2] in (['export'], ['import'], ['repair-streaks']):
+        run_data_command(sys.argv[1:])
+        return
+    STARTUP_MARKS.append(('بارگذاری bot.py', time.perf_counter()))
+    logger.info("🤖 ربات در حال راه‌اندازی...")
+    if BOT_MODE == 'webhook' and WORKERS > 1:
+        split_into_shards(WORKERS)
+        asyncio.run(serve_sharded(WORKERS))
+        return
+    
+    open_persistence()
+    application = build_application(use_updater=BOT_MODE == 'polling')
+    
+    if BOT_MODE == 'webhook':
+        asyncio.run(serve_webhook(application))
+    elif BOT_MODE == 'worker':
+        asyncio.run(serve_worker(application))
+    else:
+        asyncio.run(serve_polling(application))
 
 if __name__ == '__main__':
     main()
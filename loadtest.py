@@ -0,0 +1,1754 @@
+"""تست بار آفلاین ربات
+
+آپدیت‌های مصنوعی تلگرام (پیام منو و دکمه‌های چک‌لیست) برای N کاربر
+ساخته میشه و از مسیر واقعی Application و handlerهای bot.py رد میشه.
+به جای تلگرام یک Bot API جعلی داخل همین پروسه جواب میده، پس هیچ
+درخواست شبکه‌ای زده نمیشه.
+
+با --shards همون ترافیک از ShardDispatcher واقعی رد میشه و بین چند
+پروسه worker پخش میشه؛ با چند عدد (مثلاً --shards 1 2 4) مقیاس‌پذیری
+با تعداد هسته‌ها اندازه گرفته میشه.
+
+با --memory N زمان و حافظه بارگذاری user_data.json با N کاربر، یک بار
+به شکل dict خام و یک بار به شکل UserRecord، مقایسه میشه. با
+--leaderboard N هزینه به‌روزرسانی، top-K و رتبه در Leaderboard با
+مرتب‌سازی کامل در هر درخواست مقایسه میشه. با --export N یک دیتابیس
+SQLite با N کاربر پر (رکوردهای سنگین با Mock Test و دفتر اشتباهات)
+ساخته میشه و زمان و حافظه `bot.py export` (NDJSON، gzip، CSV) و
+`bot.py import` اندازه گرفته میشه؛ همزمان با export نوشتن‌های ربات
+شبیه‌سازی میشه تا معلوم بشه ربات منتظر نمی‌مونه. با --weekly N
+گزارش هفتگی برای N کاربر ساخته و به یک Bot جعلی فرستاده میشه (سرعت
+خط لوله بدون محدودیت تلگرام، حافظه، و ادامه بعد از قطع شدن وسط ارسال).
+با --replay همون ترافیک یک بار عادی و یک بار با آپدیت‌های تکراری (ارسال
+دوباره همون update_id همزمان با اصلی، و دوبار زدن دکمه) اجرا میشه و
+وضعیت نهایی همه کاربرا باید یکی باشه؛ همین مقایسه با دکمه‌های toggle قدیمی
+و بدون حذف تکراری‌ها (legacy) نشون میده قبلاً چند کاربر خراب می‌شدن.
+با --restart N یک ربات با N کاربر (--users تاش داغ) خاموش میشه و زمان
+ری‌استارت تا جواب اولین پیام، یک بار سرد و یک بار با فایل handoff، اندازه
+گرفته میشه (هر اجرا پروسه جدا، از شروع مفسر پایتون). با --programs
+فایل‌های برنامه خراب (JSON درست با شکل غلط) به ProgramRegistry داده میشن:
+نسخه قبلی همون برنامه باید بمونه و بقیه فایل‌های عوض‌شده همون دور اعمال بشن.
+با --locks هزاران callback چک‌لیست (وضعیت مقصد و toggle قدیمی) برای همون
+کاربرها همزمان از process_update رد میشن، کاربرها فقط روی دیسک‌ان (کش خالی)،
+و وضعیت نهایی (چک‌لیست، و بعد از بستن روز Streak و جریمه) باید دقیقاً با
+اجرای پشت‌سرهم همون tapها یکی باشه؛ هر اختلافی exit code غیرصفر میده.
+با --scheduler زمان‌بند یادآورها با ساعت جعلی چند هفته جلو برده میشه
+(یک بار با بیدار شدن‌های نامنظم run_pending و یک بار با run و sleep جعلی):
+هر یادآور باید دقیقاً در روزها و ساعت‌های خودش و فقط یک بار اجرا بشه؛
+catch_up بعد از ری‌استارت و replace بعد از تغییر برنامه هم همین‌طور چک میشن.
+با --rollover N دیتابیس با N کاربر پر میشه و بستن روز (map_records روی
+rollover_user) در یک پروسه تازه دو بار اجرا میشه، بار دوم بعد از بستن و
+باز کردن دوباره دیتابیس: زمان و حافظه بار اول، و اینکه بار دوم هیچ رکوردی
+رو عوض نکنه و وضعیت همه کاربرا همون بمونه (idempotent).
+با --render هزینه هر درخواست «برنامه امروز» و «برنامه هفته» (µs) با جدول
+پیش‌ساخته Program در برابر ساختن متن برای هر درخواست با کد و متن نسخه اول
+bot.py (کپی‌شده در همین فایل) مقایسه میشه؛ متن همه روزها و هفته‌ها باید با
+نسخه اول یکی باشه، جز تغییرهای عمدی RENDER_INTENDED_CHANGES.
+با --store-io همون ترافیک یک بار با thread ذخیره‌سازی (AsyncStore) و یک بار
+با اجرای مستقیم backend روی event loop (مسیر قبلی) اجرا میشه و p50/p99
+handlerها مقایسه میشه؛ flush کش مرتب وسط ترافیک انجام میشه و با
+--disk-delay هر نوشتن دسته‌ای به اندازه یک دیسک کند طول می‌کشه.
+همه فایل‌ها توی یک پوشه موقت ساخته میشن که آخر اجرا پاک میشه (با --keep
+می‌مونه و مسیرش چاپ میشه).
+
+نمونه:
+    python loadtest.py --users 2000 --rounds 5 --backend all
+    python loadtest.py --users 5000 --rounds 5 --shards 1 2 4
+    python loadtest.py --memory 100000
+    python loadtest.py --leaderboard 100000
+    python loadtest.py --export 150000
+    python loadtest.py --weekly 100000 --backend all
+    python loadtest.py --users 2000 --rounds 10 --replay
+    python loadtest.py --restart 100000 --users 5000 --backend all
+    python loadtest.py --programs
+    python loadtest.py --users 2000 --rounds 5 --locks --backend all
+    python loadtest.py --scheduler
+    python loadtest.py --rollover 100000 --backend all
+    python loadtest.py --render
+    python loadtest.py --users 2000 --rounds 5 --store-io --disk-delay 20 --backend all
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKENDS = ('sqlite', 'json')
+
+MENU_TEXTS = ("📅 برنامه امروز", "✅ چک‌لیست", "📊 آمار من", "📚 برنامه هفته", "💡 راهنما", "🏆 رتبه‌بندی")
+# دکمه‌های چک‌لیست با وضعیت مقصد (check_<item>_<0|1>)
+CALLBACKS = tuple(f"check_{item}_{state}" for item in ("block1", "block2", "sleep") for state in (1, 0))
+# حالت --replay -> حالت بدون تکرار همون نوع دکمه که باید باهاش یکی باشه
+REPLAY_MODES = {'plain': 'plain', 'replayed': 'plain', 'legacy-plain': 'legacy-plain', 'legacy': 'legacy-plain'}
+# --restart: تعداد اجرای هر حالت (کمترین و میانه گزارش میشه)
+RESTART_RUNS = 3
+# --scheduler: شروع ساعت جعلی (یک شنبه) و تعداد روزهای اجرا
+SCHEDULER_START = datetime.datetime(2026, 10, 17, 6, 0)
+SCHEDULER_DAYS = 15
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="تست بار آفلاین ربات")
+    parser.add_argument('--users', type=int, default=1000, help="تعداد کاربرهای شبیه‌سازی‌شده")
+    parser.add_argument('--rounds', type=int, default=5, help="تعداد دور تعامل برای هر کاربر")
+    parser.add_argument('--concurrency', type=int, default=64, help="حداکثر آپدیت همزمان")
+    parser.add_argument('--backend', choices=BACKENDS + ('all',), default='sqlite')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="فعال کردن TelcRateLimiter (محدودیت‌های واقعی تلگرام)")
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help="احتمال اینکه Bot API جعلی برای ارسال پیام 429 برگردونه")
+    parser.add_argument('--shards', type=int, nargs='+',
+                        help="اجرای چند پروسه‌ای با این تعداد worker (هر عدد یک اجرای جدا)")
+    parser.add_argument('--memory', type=int, metavar='N',
+                        help="مقایسه حافظه و زمان بارگذاری N کاربر: dict در برابر UserRecord")
+    parser.add_argument('--leaderboard', type=int, metavar='N',
+                        help="بنچمارک رتبه‌بندی با N کاربر")
+    parser.add_argument('--export', type=int, metavar='N',
+                        help="بنچمارک export/import با N کاربر")
+    parser.add_argument('--weekly', type=int, metavar='N',
+                        help="سرعت و حافظه ارسال گزارش هفتگی برای N کاربر")
+    parser.add_argument('--replay', action='store_true',
+                        help="مقایسه وضعیت نهایی با و بدون آپدیت‌های تکراری")
+    parser.add_argument('--restart', type=int, metavar='N',
+                        help="زمان ری‌استارت تا اولین جواب با N کاربر، سرد و با handoff")
+    parser.add_argument('--programs', action='store_true',
+                        help="فایل‌های برنامه خراب نباید reload رو خراب کنن")
+    parser.add_argument('--locks', action='store_true',
+                        help="callbackهای همزمان برای همون کاربرها نباید تغییری رو گم کنن")
+    parser.add_argument('--scheduler', action='store_true',
+                        help="زمان‌بند یادآورها با ساعت جعلی: روزها، catch_up و replace")
+    parser.add_argument('--rollover', type=int, metavar='N',
+                        help="زمان و حافظه بستن روز برای N کاربر، دو بار (idempotent)")
+    parser.add_argument('--render', action='store_true',
+                        help="µs هر درخواست برنامه امروز/هفته: جدول پیش‌ساخته در برابر ساختن دوباره")
+    parser.add_argument('--store-io', action='store_true',
+                        help="p50/p99 handlerها: thread ذخیره‌سازی در برابر اجرای مستقیم روی event loop")
+    parser.add_argument('--disk-delay', type=float, default=0.0, metavar='MS',
+                        help="با --store-io: تأخیر هر نوشتن دسته‌ای روی دیسک (میلی‌ثانیه)")
+    parser.add_argument('--keep', action='store_true',
+                        help="پوشه کاری موقت (دیتابیس‌ها و فایل‌های handoff) بعد از اجرا پاک نشه")
+    parser.add_argument('--rollover-child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--store-mode', choices=('inline', 'thread'), help=argparse.SUPPRESS)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--restart-phase', choices=('serve', 'cold', 'handoff'), help=argparse.SUPPRESS)
+    parser.add_argument('--replay-mode', choices=REPLAY_MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--data-command', help=argparse.SUPPRESS)
+    parser.add_argument('--load-form', choices=('dict', 'record'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def command_line(args, **overrides):
+    """ساخت دوباره آرگومان‌ها برای اجرای همین اسکریپت در پروسه جدا"""
+    options = {
+        'backend': args.backend, 'users': args.users, 'rounds': args.rounds,
+        'concurrency': args.concurrency, 'seed': args.seed, 'throttle': args.throttle,
+        'weekly': args.weekly, 'restart': args.restart, 'rollover': args.rollover,
+        'disk-delay': args.disk_delay,
+    }
+    options.update(overrides)
+    command = [sys.executable, os.path.abspath(__file__)]
+    for name, value in options.items():
+        if value is True:
+            command.append(f'--{name}')
+        elif isinstance(value, list):
+            command += [f'--{name}'] + [str(v) for v in value]
+        elif value is not None:
+            command += [f'--{name}', str(value)]
+    if args.rate_limit:
+        command.append('--rate-limit')
+    if args.replay:
+        command.append('--replay')
+    if args.locks:
+        command.append('--locks')
+    if args.store_io:
+        command.append('--store-io')
+    if args.keep:
+        command.append('--keep')
+    return command
+
+
+def written_bytes():
+    """بایت‌های نوشته‌شده توسط این پروسه (فقط لینوکس)"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    """(RSS فعلی، بیشترین RSS) این پروسه به مگابایت (فقط لینوکس)"""
+    with open('/proc/self/statm') as f:
+        current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return current / 2**20, peak / 2**20
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def make_stub_request(throttle, seed):
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Bot API جعلی: به هر متد یک جواب معتبر و ثابت میده"""
+
+        def __init__(self, throttle=0.0):
+            self.calls = 0
+            self.throttled = 0
+            self.throttle = throttle
+            self._rng = random.Random(seed)
+            self._message_ids = itertools.count(1)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        @property
+        def read_timeout(self):
+            return 1.0
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            self.calls += 1
+            endpoint = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data else {}
+            if endpoint in ('sendMessage', 'editMessageText') and self._rng.random() < self.throttle:
+                self.throttled += 1
+                body = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                        'parameters': {'retry_after': 1}}
+                return 429, json.dumps(body).encode()
+            if endpoint == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'telc', 'username': 'telc_bot'}
+            elif endpoint in ('sendMessage', 'editMessageText'):
+                result = {
+                    'message_id': next(self._message_ids), 'date': 0,
+                    'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+                    'text': params.get('text', ''),
+                }
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return StubRequest(throttle)
+
+
+def build_traffic(args):
+    """آپدیت‌های خام هر مرحله به صورت (نوع، dict)"""
+    update_ids = itertools.count(1)
+
+    def message(user_id, text):
+        update_id = next(update_ids)
+        data = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+                'text': text,
+            },
+        }
+        if text.startswith('/'):
+            data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return 'start' if text == '/start' else 'message', data
+
+    def callback(user_id, data):
+        update_id = next(update_ids)
+        return 'callback', {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id), 'chat_instance': str(user_id), 'data': data,
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+                'message': {
+                    'message_id': 1, 'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'}, 'text': '📋',
+                },
+            },
+        }
+
+    rng = random.Random(args.seed)
+    user_ids = [100000 + i for i in range(args.users)]
+    # مرحله اول: ثبت نام؛ مرحله دوم: ترکیب تصادفی منو و چک‌لیست
+    phases = [
+        [message(user_id, '/start') for user_id in user_ids],
+        [message(user_id, f"کاربر {user_id}") for user_id in user_ids],
+    ]
+    traffic = []
+    for _ in range(args.rounds):
+        for user_id in user_ids:
+            if rng.random() < 0.5:
+                traffic.append(message(user_id, rng.choice(MENU_TEXTS)))
+            else:
+                traffic.append(callback(user_id, rng.choice(CALLBACKS)))
+    rng.shuffle(traffic)
+    phases.append(traffic)
+    return phases
+
+
+async def run(args):
+    from telegram import Update
+    import bot
+
+    phases = build_traffic(args)
+    stub = make_stub_request(args.throttle, args.seed)
+    bot.open_persistence()
+    application = bot.build_application(request=stub, use_updater=False)
+    latencies = {}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def process(kind, data):
+        update = Update.de_json(data, application.bot)
+        async with slots:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    await application.initialize()
+    await application.post_init(application)
+    bytes_before = written_bytes()
+    started = time.perf_counter()
+    total = 0
+    for phase in phases:
+        await asyncio.gather(*(process(kind, data) for kind, data in phase))
+        total += len(phase)
+    elapsed = time.perf_counter() - started
+    await bot.users.flush()
+    bytes_after = written_bytes()
+    cache_stats = bot.users.stats()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    print(f"\n=== backend: {bot.STORAGE_BACKEND} | کاربر: {args.users} | آپدیت: {total} ===")
+    print(f"throughput: {total / elapsed:,.0f} update/s  ({elapsed:.2f} s)")
+    print(f"Bot API calls: {stub.calls}  (429: {stub.throttled})")
+    if bytes_before is not None:
+        print(f"disk writes: {(bytes_after - bytes_before) / total:,.0f} byte/update")
+    print(f"{'نوع':<10} {'تعداد':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    all_latencies = []
+    for kind, values in sorted(latencies.items()):
+        all_latencies.extend(values)
+        print(f"{kind:<10} {len(values):>8} {percentile(values, 50) * 1000:>9.2f} "
+              f"{percentile(values, 90) * 1000:>9.2f} {percentile(values, 99) * 1000:>9.2f} "
+              f"{max(values) * 1000:>9.2f}")
+    print(f"{'all':<10} {len(all_latencies):>8} {percentile(all_latencies, 50) * 1000:>9.2f} "
+          f"{percentile(all_latencies, 90) * 1000:>9.2f} {percentile(all_latencies, 99) * 1000:>9.2f} "
+          f"{max(all_latencies) * 1000:>9.2f}")
+    print(f"cache: {cache_stats}")
+
+
+async def run_sharded(args, shard_count):
+    """ترافیک از ShardDispatcher به shard_count پروسه worker"""
+    import bot
+
+    # JSON هر آپدیت از قبل ساخته میشه؛ dispatcher فقط parse و route می‌کنه
+    phases = [[(data, json.dumps(data).encode()) for _, data in phase] for phase in build_traffic(args)]
+    total = sum(len(phase) for phase in phases)
+    dispatcher = bot.ShardDispatcher(shard_count, command_line(args, worker=True))
+    await dispatcher.start()
+    started = time.perf_counter()
+    for phase in phases:
+        for data, payload in phase:
+            await dispatcher.dispatch(data, payload)
+    reports = await dispatcher.stop()
+    elapsed = time.perf_counter() - started
+
+    print(f"\n=== backend: {bot.STORAGE_BACKEND} | worker: {shard_count} | کاربر: {args.users} | آپدیت: {total} ===")
+    print(f"throughput: {total / elapsed:,.0f} update/s  ({elapsed:.2f} s, هسته‌ها: {os.cpu_count()})")
+    for report in sorted(reports, key=lambda r: r['shard']):
+        print(f"shard {report['shard']}: {report['updates']} آپدیت، cache: {report['cache']}")
+
+
+async def run_worker(args):
+    """یک worker که ShardDispatcher اجرا کرده، با Bot API جعلی"""
+    import bot
+
+    bot.open_persistence()
+    application = bot.build_application(request=make_stub_request(args.throttle, args.seed), use_updater=False)
+    await bot.serve_worker(application)
+
+
+def write_users_file(path, count, seed):
+    """user_data.json با فرمت قدیمی (dict) برای count کاربر"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for i in range(count):
+            record = {
+                'name': f"کاربر {i}", 'current_week': rng.randint(1, 12),
+                'streak': rng.randint(0, 30), 'total_days': rng.randint(0, 60),
+                'checklist': {item: rng.random() < 0.5 for item in ('block1', 'block2', 'sleep')},
+                'penalty': rng.randint(0, 10) * 50000, 'mock_tests': [], 'errors': [],
+                'skills': {skill: rng.randint(40, 100) / 10 for skill in ('reading', 'listening', 'writing', 'speaking')},
+                'last_checklist_date': '2026-10-17', 'start_date': '2026-09-01',
+                'last_closed_date': '2026-10-16', 'completed_weeks': list(range(1, rng.randint(1, 6))),
+            }
+            f.write(('' if i == 0 else ', ') + json.dumps(str(100000 + i)) + ': ' + json.dumps(record, ensure_ascii=False))
+        f.write('}')
+
+
+def measure_load(form):
+    """بارگذاری user_data.json در همین پروسه و چاپ نتیجه به صورت JSON"""
+    import bot
+
+    current_before, _ = rss_mb()
+    started = time.perf_counter()
+    if form == 'dict':
+        with open(bot.DATA_FILE, encoding='utf-8') as f:
+            loaded = json.load(f)
+    else:
+        loaded = bot.JsonUserStore(bot.DATA_FILE)
+    elapsed = time.perf_counter() - started
+    current_after, peak = rss_mb()
+    print(json.dumps({
+        'form': form, 'seconds': elapsed, 'count': len(loaded) if form == 'dict' else loaded.count(),
+        'resident_mb': current_after - current_before, 'peak_mb': peak,
+    }))
+
+
+def compare_memory(args):
+    """مقایسه dict و UserRecord، هر کدوم توی پروسه جدا تا peak RSS قاطی نشه"""
+    write_users_file('user_data.json', args.memory, args.seed)
+    size_mb = os.path.getsize('user_data.json') / 2**20
+    print(f"\n=== بارگذاری {args.memory:,} کاربر از user_data.json ({size_mb:.1f} MB) ===")
+    print(f"{'شکل':<8} {'ثانیه':>8} {'RSS اضافه MB':>14} {'peak RSS MB':>12}")
+    for form in ('dict', 'record'):
+        output = subprocess.run(command_line(args, **{'load-form': form}), check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{form:<8} {result['seconds']:>8.2f} {result['resident_mb']:>14.1f} {result['peak_mb']:>12.1f}")
+
+
+def bench_leaderboard(args):
+    """Leaderboard (درخت Fenwick) در برابر مرتب کردن همه کاربرها برای هر درخواست"""
+    import bot
+
+    rng = random.Random(args.seed)
+    records = {
+        user_id: bot.UserRecord(
+            name='user', streak=rng.randint(0, 80), total_days=rng.randint(0, 80),
+            penalty=rng.randint(0, 30) * bot.DAILY_PENALTY, current_week=rng.randint(1, 12),
+        )
+        for user_id in range(args.leaderboard)
+    }
+    leaderboard = bot.Leaderboard()
+    started = time.perf_counter()
+    for user_id, record in records.items():
+        leaderboard.update(user_id, record)
+    build = time.perf_counter() - started
+
+    user_ids = list(records)
+    samples = [rng.choice(user_ids) for _ in range(10000)]
+    started = time.perf_counter()
+    for user_id in samples:
+        record = records[user_id]
+        record.streak = 0 if record.streak > 60 else record.streak + 1
+        leaderboard.update(user_id, record)
+    update = (time.perf_counter() - started) / len(samples)
+    started = time.perf_counter()
+    for _ in range(1000):
+        leaderboard.top('streak', 10)
+    top = (time.perf_counter() - started) / 1000
+    started = time.perf_counter()
+    for user_id in samples:
+        leaderboard.rank('streak', user_id)
+    rank = (time.perf_counter() - started) / len(samples)
+    started = time.perf_counter()
+    for user_id in samples[:10]:
+        ordered = sorted(records.items(), key=lambda item: -item[1].streak)
+        ordered[:10]
+        sum(1 for record in records.values() if record.streak > records[user_id].streak)
+    naive = (time.perf_counter() - started) / 10
+
+    print(f"\n=== رتبه‌بندی {args.leaderboard:,} کاربر ===")
+    print(f"ساخت اولیه: {build:.2f} s")
+    print(f"به‌روزرسانی: {update * 1e6:.1f} µs | top-10: {top * 1e6:.1f} µs | رتبه: {rank * 1e6:.1f} µs")
+    print(f"مرتب‌سازی کامل برای هر درخواست (top-10 + رتبه): {naive * 1e3:.1f} ms")
+
+
+def fill_export_db(count, seed):
+    """دیتابیس SQLite با count کاربر سنگین (Mock Test + دفتر اشتباهات)"""
+    import bot
+
+    rng = random.Random(seed)
+    store = bot.SqliteUserStore(bot.DB_FILE)
+    batch = []
+    for i in range(count):
+        record = bot.UserRecord(
+            name=f"کاربر {i}", current_week=rng.randint(1, 12), streak=rng.randint(0, 30),
+            total_days=rng.randint(0, 60), start_day=739800, last_closed_day=739860,
+        )
+        for day in range(rng.randint(0, 8)):
+            record.add_mock_test(739820 + day * 5, tuple(
+                rng.randint(0, maximum) for _, _, maximum in bot.MOCK_SECTIONS))
+        for n in range(rng.randint(0, 20)):
+            record.add_error(f"ich habe gegangen {n} → ich bin gegangen ({i})", 'writing', 'Perfekt', 739830 + n)
+        batch.append((str(100000 + i), record))
+        if len(batch) >= 1000:
+            store.put_many(batch)
+            batch.clear()
+    store.put_many(batch)
+    store.close()
+
+
+def run_data_command(argv):
+    """پروسه فرزند: bot.py export/import و چاپ زمان و peak RSS به صورت JSON"""
+    import bot
+
+    started = time.perf_counter()
+    bot.run_data_command(argv)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'seconds': elapsed, 'peak_mb': rss_mb()[1]}))
+
+
+def bench_export(args):
+    """export/import روی دیتابیس بزرگ، همراه با نوشتن همزمان مثل ربات در حال اجرا"""
+    import bot
+
+    started = time.perf_counter()
+    fill_export_db(args.export, args.seed)
+    size_mb = os.path.getsize(bot.DB_FILE) / 2**20
+    print(f"\n=== export/import {args.export:,} کاربر (دیتابیس {size_mb:.0f} MB، ساخت {time.perf_counter() - started:.0f} s) ===")
+    print(f"{'عملیات':<36} {'ثانیه':>7} {'کاربر/s':>9} {'فایل MB':>8} {'peak RSS MB':>12} {'نوشتن همزمان max ms':>20}")
+
+    writer = bot.SqliteUserStore(bot.DB_FILE)
+    record = bot.UserRecord(name='live')
+    runs = (
+        ('export', 'users.ndjson'), ('export', 'users.ndjson.gz'),
+        ('export', 'users.csv.gz'), ('export', 'chunks.ndjson.gz', '--chunk', '50000'),
+        ('import', 'users.ndjson.gz'),
+    )
+    for argv in runs:
+        env = dict(os.environ)
+        if argv[0] == 'import':
+            # import توی یک دیتابیس خالی جدا
+            env['DB_FILE'] = os.path.abspath('imported.sqlite3')
+        child = subprocess.Popen(command_line(args, **{'data-command': ' '.join(argv)}),
+                                 env=env, stdout=subprocess.PIPE, text=True)
+        latencies = []
+        while child.poll() is None:
+            # نوشتن‌های ربات (flush کش) در طول export
+            write_started = time.perf_counter()
+            writer.put(str(100000 + len(latencies) % args.export), record)
+            latencies.append(time.perf_counter() - write_started)
+            time.sleep(0.01)
+        result = json.loads(child.stdout.read().strip().splitlines()[-1])
+        path = argv[1] if argv[0] == 'import' or '--chunk' not in argv else None
+        size = (os.path.getsize(path) if path else sum(
+            os.path.getsize(name) for name in os.listdir('.') if name.startswith('chunks.'))) / 2**20
+        label = ' '.join(argv)
+        print(f"{label:<36} {result['seconds']:>7.1f} {args.export / result['seconds']:>9.0f} {size:>8.1f} "
+              f"{result['peak_mb']:>12.0f} {max(latencies, default=0) * 1e3:>20.1f}")
+    writer.close()
+
+
+# --render: متن برنامه نسخه اول bot.py، کپی بدون تغییر تا مقایسه مستقل از Program باشه
+BASELINE_SCHEDULE = {
+    1: {
+        "focus": "مبانی گرامر و ساختارهای ساده",
+        "grammar": ["Present Simple & Continuous", "Past Simple & Continuous", "Question formation"],
+        "vocabulary": ["Daily routines", "Family & relationships", "Time expressions"],
+        "daily_tasks": [
+            "5 جمله با Present Simple بنویس",
+            "10 دقیقه تمرین تلفظ با shadowing",
+            "یک پاراگراف درباره خانواده‌ات بخوان"
+        ]
+    },
+    2: {
+        "focus": "گرامر میانی و توسعه واژگان",
+        "grammar": ["Present Perfect", "Future forms", "Modal verbs"],
+        "vocabulary": ["Work & professions", "Travel", "Food"],
+        "daily_tasks": [
+            "یک خبر کوتاه بخوان و خلاصه کن",
+            "5 جمله با Present Perfect",
+            "تمرین گفتن برنامه‌های هفته آینده"
+        ]
+    },
+    3: {
+        "focus": "ساختارهای پیچیده‌تر",
+        "grammar": ["Passive voice", "Relative clauses", "Conjunctions"],
+        "vocabulary": ["Technology", "Environment", "Health"],
+        "daily_tasks": [
+            "یک مقاله درباره محیط زیست بخوان",
+            "3 جمله Passive بنویس",
+            "تمرین دادن نظر با 'Meiner Meinung nach...'"
+        ]
+    },
+    4: {
+        "focus": "مهارت‌های نوشتاری",
+        "grammar": ["Reported speech", "Conditional sentences", "Infinitive"],
+        "vocabulary": ["Education", "Media", "Culture"],
+        "daily_tasks": [
+            "تمرین نوشتن ایمیل رسمی",
+            "خواندن یک فصل از کتاب",
+            "تمرین If-clauses"
+        ]
+    },
+    5: {
+        "focus": "تقویت Listening",
+        "grammar": ["Word order", "Prepositions", "Adjective endings"],
+        "vocabulary": ["Shopping", "Housing", "Transport"],
+        "daily_tasks": [
+            "10 دقیقه Dictation از ویدیو",
+            "تمرین توضیح مسیر",
+            "نوشتن درباره خانه‌ی ایده‌آل"
+        ]
+    },
+    6: {
+        "focus": "Mock Exam اول",
+        "grammar": ["Review all structures"],
+        "vocabulary": ["All topics review"],
+        "daily_tasks": [
+            "یک آزمون کامل Reading",
+            "تحلیل اشتباهات",
+            "تمرین Speaking با ضبط صدا"
+        ]
+    },
+    7: {
+        "focus": "استراتژی‌های آزمون",
+        "grammar": ["Advanced conjunctions", "Subjunctive II"],
+        "vocabulary": ["Politics", "Economy", "Global issues"],
+        "daily_tasks": [
+            "تمرین خواندن سریع",
+            "نوشتن outline برای موضوعات",
+            "تمرین جواب به سوالات غیرمنتظره"
+        ]
+    },
+    8: {
+        "focus": "تسلط بر Speaking",
+        "grammar": ["Idiomatic expressions", "Phrasal verbs"],
+        "vocabulary": ["Opinions", "Linking words", "Formal language"],
+        "daily_tasks": [
+            "تمرین یک موضوع Speaking ۳ دقیقه",
+            "ضبط صدای خودت",
+            "یادگیری 5 idiom جدید"
+        ]
+    },
+    9: {
+        "focus": "Mock Exam دوم",
+        "grammar": ["Full review"],
+        "vocabulary": ["Exam vocabulary"],
+        "daily_tasks": [
+            "یک بخش کامل آزمون",
+            "تحلیل نقاط ضعف",
+            "تمرین تخصصی"
+        ]
+    },
+    10: {
+        "focus": "رفع نقاط ضعف",
+        "grammar": ["Personal weak points"],
+        "vocabulary": ["Gap-filling"],
+        "daily_tasks": [
+            "2 ساعت روی ضعیف‌ترین مهارت",
+            "مرور flashcards",
+            "گفتگو با native speaker"
+        ]
+    },
+    11: {
+        "focus": "تثبیت و اعتماد به نفس",
+        "grammar": ["Light review"],
+        "vocabulary": ["Active recall"],
+        "daily_tasks": [
+            "مرور نکات کلیدی",
+            "تمرین آرامش در استرس",
+            "شبیه‌سازی روز آزمون"
+        ]
+    },
+    12: {
+        "focus": "آماده‌سازی نهایی",
+        "grammar": ["Quick review"],
+        "vocabulary": ["Final list"],
+        "daily_tasks": [
+            "استراحت ذهنی",
+            "مرور نکات آزمون",
+            "آماده‌سازی روحی"
+        ]
+    }
+}
+
+
+def baseline_daily_schedule(day_name):
+    """get_daily_schedule نسخه اول bot.py (بدون تغییر)"""
+    schedules = {
+        'یکشنبه': """📅 برنامه یکشنبه
+
+🌅 صبح:
+06:30 - بیدار شدن
+07:00 - صبحانه + فلش‌کارت (15 دقیقه)
+08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
+09:30 - کار فروش
+
+🏫 بعدازظهر:
+13:30 - کلاس زبان (3 ساعت)
+16:30 - باشگاه + پادکست
+
+🌙 شب:
+19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
+21:00 - آزاد با دوستان
+23:00 - 😴 خواب حتماً!""",
+
+        'دوشنبه': """📅 برنامه دوشنبه
+
+🌅 صبح:
+06:30 - بیدار شدن
+07:00 - صبحانه + فلش‌کارت
+08:00 - ✍️ بلوک اول: Schreiben (1 ساعت)
+09:00 - کار فروش
+
+🏫 بعدازظهر:
+16:00 - 📝 بلوک دوم: Mock Test یک بخش (1.5 ساعت)
+17:30 - باشگاه
+
+🌙 شب:
+20:00 - مرور اشتباهات (30 دقیقه)
+21:00 - آزاد
+23:00 - 😴 خواب""",
+
+        'سه‌شنبه': """📅 برنامه سه‌شنبه
+
+🌅 صبح:
+06:30 - بیدار شدن
+07:00 - صبحانه + فلش‌کارت
+08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
+
+🏫 بعدازظهر:
+12:00 - 🗣️ کلاس مکالمه
+13:30 - کلاس زبان (3 ساعت)
+16:30 - باشگاه + پادکست
+
+🌙 شب:
+19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
+21:00 - آزاد
+23:00 - 😴 خواب""",
+
+        'چهارشنبه': """📅 برنامه چهارشنبه
+
+🌅 صبح:
+06:30 - بیدار شدن
+07:00 - صبحانه + فلش‌کارت
+08:00 - ✍️ بلوک اول: Schreiben (1 ساعت)
+09:00 - کار فروش
+
+🏫 بعدازظهر:
+16:00 - 📝 بلوک دوم: Mock Test یک بخش (1.5 ساعت)
+17:30 - باشگاه
+
+🌙 شب:
+20:00 - مرور اشتباهات
+21:00 - آزاد
+23:00 - 😴 خواب""",
+
+        'پنج‌شنبه': """📅 برنامه پنج‌شنبه
+
+🌅 صبح:
+06:30 - بیدار شدن
+07:00 - صبحانه + فلش‌کارت
+08:00 - 📚 بلوک اول: Lesen + Grammatik (1.5 ساعت)
+
+🏫 بعدازظهر:
+13:30 - کلاس زبان (3 ساعت)
+16:30 - باشگاه + پادکست
+
+🌙 شب:
+19:00 - 🎧 بلوک دوم: Hören (45 دقیقه)
+21:00 - آزاد
+23:00 - 😴 خواب""",
+
+        'جمعه': """📅 برنامه جمعه
+
+🌅 صبح:
+آزاد - خانواده/دوستان
+
+📊 بعدازظهر:
+15:00 - بازنگری هفتگی (1 ساعت)
+16:00 - 📝 Mock Test کامل (2.5 ساعت)
+
+🌙 شب: آزاد""",
+
+        'شنبه': """📅 برنامه شنبه
+
+🌅 صبح:
+🎥 ویدیوهای DW یا Easy German (1 ساعت)
+
+🌙 بعدازظهر/شب:
+آزاد - پادکست + گردش"""
+    }
+    
+    return schedules.get(day_name, "برنامه‌ای تعریف نشده")
+
+
+# تغییرهای عمدی متن نسبت به نسخه اول: روز -> [(متن قبلی، متن فعلی)]
+RENDER_INTENDED_CHANGES = {
+    # خط جدول با عنوان بلوک یادآور یکی شد (برنامه‌ها از فایل JSON)
+    'جمعه': [("15:00 - بازنگری هفتگی (1 ساعت)", "15:00 - 📊 بازنگری هفتگی (1 ساعت)")],
+}
+
+
+def render_today_baseline(now, current_week):
+    """«برنامه امروز» مثل handle_message نسخه اول: نگاشت روز، get_daily_schedule و حلقه وظایف"""
+    day_name = now.strftime('%A')
+    day_mapping = {
+        'Saturday': 'شنبه', 'Sunday': 'یکشنبه', 'Monday': 'دوشنبه',
+        'Tuesday': 'سه‌شنبه', 'Wednesday': 'چهارشنبه', 
+        'Thursday': 'پنج‌شنبه', 'Friday': 'جمعه'
+    }
+    persian_day = day_mapping[day_name]
+    schedule = baseline_daily_schedule(persian_day)
+    week_data = BASELINE_SCHEDULE.get(current_week)
+    tasks_text = "\n\n🎯 وظایف ویژه این هفته:\n"
+    for i, task in enumerate(week_data['daily_tasks'], 1):
+        tasks_text += f"{i}. {task}\n"
+    return schedule + tasks_text
+
+
+def render_week_baseline(current_week):
+    """«برنامه هفته» مثل show_week_plan نسخه اول"""
+    week_data = BASELINE_SCHEDULE.get(current_week)
+    
+    return f"""📚 برنامه هفته {current_week}/12
+
+🎯 فوکوس: {week_data['focus']}
+
+📖 گرامر این هفته:
+{chr(10).join(f"  • {item}" for item in week_data['grammar'])}
+
+📝 واژگان:
+{chr(10).join(f"  • {item}" for item in week_data['vocabulary'])}
+
+✅ وظایف روزانه:
+{chr(10).join(f"  {i+1}. {task}" for i, task in enumerate(week_data['daily_tasks']))}
+
+💡 برای دیدن برنامه روزانه: 📅 برنامه امروز"""
+
+
+def bench_render(args, calls=200000):
+    """--render: جدول پیش‌ساخته Program در برابر مسیر نسخه اول bot.py (ساختن متن برای هر درخواست)"""
+    import bot
+
+    path = os.path.join(bot.PROGRAMS_DIR, f'{bot.DEFAULT_PROGRAM}.json')
+    started = time.perf_counter()
+    program = bot.load_program(path)
+    build = time.perf_counter() - started
+    weeks = range(1, len(BASELINE_SCHEDULE) + 1)
+    days = [datetime.datetime(2026, 10, 12 + offset, 9, tzinfo=bot.TIMEZONE) for offset in range(7)]
+    today_samples = [(now, week) for now in days for week in weeks]
+    week_samples = list(weeks)
+
+    changed = mismatches = 0
+    for now, week in today_samples:
+        expected = render_today_baseline(now, week)
+        for old, new in RENDER_INTENDED_CHANGES.get(bot.persian_day_name(now), ()):
+            changed += old in expected
+            expected = expected.replace(old, new)
+        mismatches += expected != bot.render_today_plan(now, week, program)
+    mismatches += sum(render_week_baseline(week) != program.week_message(week) for week in week_samples)
+
+    def per_call(func, samples):
+        loops = calls // len(samples)
+        started = time.perf_counter()
+        for _ in range(loops):
+            for sample in samples:
+                func(*sample)
+        return (time.perf_counter() - started) / (loops * len(samples))
+
+    rows = (
+        ("📅 برنامه امروز",
+         per_call(render_today_baseline, today_samples),
+         per_call(bot.render_today_plan, [(now, week, program) for now, week in today_samples])),
+        ("📚 برنامه هفته",
+         per_call(render_week_baseline, [(week,) for week in week_samples]),
+         per_call(program.week_message, [(week,) for week in week_samples])),
+    )
+    print(f"\n=== ساختن پیام برنامه ({program.id}، {program.week_count} هفته، {calls:,} درخواست) ===")
+    print(f"ساخت جدول‌ها موقع بارگذاری برنامه: {build * 1e3:.1f} ms")
+    print(f"{'پیام':<18} {'ساختن هر بار µs':>16} {'جدول µs':>9} {'سریع‌تر':>8}")
+    for name, rendered, lookup in rows:
+        print(f"{name:<18} {rendered * 1e6:>16.2f} {lookup * 1e6:>9.2f} {rendered / lookup:>7.1f}x")
+    changes = "، ".join(f"{day_name}: «{old}» -> «{new}»" for day_name, pairs in RENDER_INTENDED_CHANGES.items()
+                        for old, new in pairs)
+    print(f"تغییر عمدی متن ({changed} پیام): {changes}")
+    if mismatches:
+        sys.exit(f"❌ {mismatches} پیام با نسخه اول (بعد از تغییرهای عمدی) فرق داره")
+    if not changed:
+        sys.exit("❌ تغییرهای عمدی RENDER_INTENDED_CHANGES توی متن نسخه اول پیدا نشد")
+    print(f"✅ متن هر {len(today_samples) + len(week_samples)} پیام با نسخه اول یکیه (جز تغییرهای عمدی بالا)")
+
+
+# --store-io: فاصله flush کش (ثانیه) تا نوشتن‌ها وسط ترافیک باشن، و سرعت رسیدن آپدیت‌ها
+STORE_IO_FLUSH_INTERVAL = 0.05
+STORE_IO_RATE = 1000
+
+
+def inline_store_class(bot):
+    """AsyncStore مسیر قبلی: هر عملیات backend مستقیم روی event loop اجرا میشه"""
+
+    class InlineStore(bot.AsyncStore):
+        async def run(self, method, *args):
+            if self.store is None:
+                await self.wait_open()
+            with bot.metrics.time('bot_store_seconds', op=method):
+                return getattr(self.store, method)(*args)
+
+    return InlineStore
+
+
+def slow_open_store(open_store, delay):
+    """open_store که put_many هر backend رو delay ثانیه کند می‌کنه (مثل fsync روی دیسک کند)"""
+
+    def open_slow(*args, **kwargs):
+        backend = open_store(*args, **kwargs)
+        put_many = backend.put_many
+
+        def slow_put_many(items):
+            time.sleep(delay)
+            return put_many(items)
+
+        backend.put_many = slow_put_many
+        return backend
+
+    return open_slow
+
+
+async def run_store_mode(args):
+    """پروسه فرزند --store-io: آپدیت‌ها با سرعت ثابت STORE_IO_RATE می‌رسن
+
+    latency از زمان رسیدن آپدیت تا تموم شدن handlerشه؛ وقتی event loop
+    بلاک شده، آپدیت‌هایی که همون موقع می‌رسن هم منتظر می‌مونن.
+    """
+    from telegram import Update
+    import bot
+
+    if args.disk_delay:
+        bot.open_store = slow_open_store(bot.open_store, args.disk_delay / 1000)
+    if args.store_mode == 'inline':
+        bot.AsyncStore = inline_store_class(bot)
+    phases = build_traffic(args)
+    bot.open_persistence()
+    application = bot.build_application(request=make_stub_request(0.0, args.seed), use_updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    async def process(data, arrival):
+        await application.process_update(Update.de_json(data, application.bot))
+        latencies.append(loop.time() - arrival)
+
+    started = arrival = loop.time()
+    for phase in phases:
+        tasks = []
+        for _, data in phase:
+            arrival += 1 / STORE_IO_RATE
+            if arrival > loop.time():
+                await asyncio.sleep(arrival - loop.time())
+            tasks.append(asyncio.create_task(process(data, arrival)))
+        # مرحله بعد (مثلاً دکمه‌ها بعد از /start) بعد از تموم شدن این مرحله
+        await asyncio.gather(*tasks)
+        arrival = max(arrival, loop.time())
+    elapsed = loop.time() - started
+    flushes = bot.users.stats()['flushes']
+    await application.shutdown()
+    await application.post_shutdown(application)
+    print(json.dumps({
+        'throughput': len(latencies) / elapsed, 'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99), 'max': max(latencies), 'flushes': flushes,
+    }))
+
+
+def compare_store_io(args):
+    """--store-io: latency handlerها با thread ذخیره‌سازی و بدون اون، هر کدوم در پروسه جدا"""
+    env = dict(os.environ, FLUSH_INTERVAL=str(STORE_IO_FLUSH_INTERVAL))
+    delays = (0, args.disk_delay) if args.disk_delay else (0,)
+    print(f"\n=== thread ذخیره‌سازی در برابر event loop | backend: {args.backend} | کاربر: {args.users} | "
+          f"{STORE_IO_RATE} update/s | flush هر {STORE_IO_FLUSH_INTERVAL * 1000:.0f} ms ===")
+    print(f"{'دیسک کند ms':>11} {'مسیر':<8} {'update/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'flush':>6}")
+    for delay in delays:
+        for mode in ('inline', 'thread'):
+            output = subprocess.run(command_line(args, **{'store-mode': mode, 'disk-delay': delay}), env=env,
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{delay:>11} {mode:<8} {result['throughput']:>9,.0f} {result['p50'] * 1000:>8.2f} "
+                  f"{result['p99'] * 1000:>8.2f} {result['max'] * 1000:>8.2f} {result['flushes']:>6}")
+
+
+# --rollover: روزی که بسته میشه (پنجشنبه، پس گزارش هفتگی هم بسته میشه) و فردای اون
+ROLLOVER_DAY = datetime.date(2026, 10, 15).toordinal()
+
+
+def fill_rollover_store(count, seed):
+    """دیتابیس backend فعلی با count کاربر که روز ROLLOVER_DAY (یا چند روز قبل‌ترشون) بسته نشده"""
+    import bot
+
+    rng = random.Random(seed)
+    backend = bot.open_store(bot.DB_FILE, bot.DATA_FILE)
+    batch = []
+    for i in range(count):
+        # بعضیا ثبت نام رو تموم نکردن، بعضیا چند روز (ربات خاموش بوده) عقبن
+        record = bot.UserRecord(
+            name=f"کاربر {i}" if rng.random() < 0.95 else '', current_week=rng.randint(1, 12),
+            streak=rng.randint(0, 30), total_days=rng.randint(0, 60), penalty=rng.randint(0, 10) * bot.DAILY_PENALTY,
+            start_day=ROLLOVER_DAY - 60, last_closed_day=ROLLOVER_DAY - rng.choice((1, 1, 1, 1, 3)),
+            checklist=rng.getrandbits(3), last_checklist_day=ROLLOVER_DAY,
+        )
+        if rng.random() < 0.3:
+            record.add_mock_test(ROLLOVER_DAY - 2, tuple(rng.randint(0, maximum) for _, _, maximum in bot.MOCK_SECTIONS))
+        batch.append((str(100000 + i), record))
+        if len(batch) >= 1000:
+            backend.put_many(batch)
+            batch.clear()
+    backend.put_many(batch)
+    backend.close()
+
+
+async def run_rollover_child(args):
+    """پروسه فرزند --rollover: دو بار بستن روز، با بستن و باز کردن دیتابیس بینشون"""
+    import bot
+
+    today = ROLLOVER_DAY + 1
+    results = []
+
+    async def state_digest():
+        """hash همه رکوردها به ترتیب دیتابیس + تعداد کاربرای ثبت‌نام‌شده‌ای که روزشون بسته نشده"""
+        digest = hashlib.sha256()
+        open_days = []
+
+        def visit(record):
+            digest.update(json.dumps(record.to_dict(), sort_keys=True).encode())
+            if record.name and (record.last_closed_day != today - 1 or record.last_checklist_day != today):
+                open_days.append(record.last_closed_day)
+            return False
+
+        await bot.store.map_records(visit)
+        return digest.hexdigest(), len(open_days)
+
+    for _ in range(2):
+        bot.open_persistence()
+        await bot.store.wait_open()
+        resident_before = rss_mb()[0]
+        started = time.perf_counter()
+        scanned, changed = await bot.store.map_records(lambda record: bot.rollover_user(record, today))
+        elapsed = time.perf_counter() - started
+        resident_after, peak = rss_mb()
+        digest, not_closed = await state_digest()
+        await bot.store.close()
+        results.append({
+            'seconds': elapsed, 'scanned': scanned, 'changed': changed, 'digest': digest,
+            'not_closed': not_closed, 'resident_mb': resident_after - resident_before, 'peak_mb': peak,
+        })
+    print(json.dumps(results))
+
+
+def bench_rollover(args):
+    """--rollover: بستن روز روی دیتابیس پر، هر backend در پروسه تازه (peak RSS جدا از ساختن)"""
+    import bot
+
+    started = time.perf_counter()
+    fill_rollover_store(args.rollover, args.seed)
+    size_mb = sum(os.path.getsize(name) for name in os.listdir('.') if name.startswith('user_data.')) / 2**20
+    print(f"\n=== بستن روز {args.rollover:,} کاربر ({args.backend}، {size_mb:.0f} MB، "
+          f"ساخت {time.perf_counter() - started:.0f} s، دسته {bot.ROLLOVER_BATCH_SIZE}) ===")
+    output = subprocess.run(command_line(args, **{'rollover-child': True}), check=True,
+                            capture_output=True, text=True).stdout
+    runs = json.loads(output.strip().splitlines()[-1])
+    print(f"{'اجرا':<6} {'ثانیه':>7} {'کاربر/s':>9} {'بررسی':>8} {'تغییر':>8} {'باز مونده':>9} "
+          f"{'RSS اضافه MB':>13} {'peak RSS MB':>12}")
+    for number, run in enumerate(runs, 1):
+        print(f"{number:<6} {run['seconds']:>7.2f} {run['scanned'] / run['seconds']:>9,.0f} {run['scanned']:>8,} "
+              f"{run['changed']:>8,} {run['not_closed']:>9} {run['resident_mb']:>13.1f} {run['peak_mb']:>12.0f}")
+    first, second = runs
+    errors = []
+    if first['not_closed']:
+        errors.append(f"{first['not_closed']} کاربر بعد از بار اول هنوز روز باز دارن")
+    if second['changed']:
+        errors.append(f"بار دوم {second['changed']} رکورد رو عوض کرد")
+    if second['digest'] != first['digest']:
+        errors.append("وضعیت کاربرا بعد از بار دوم فرق کرد")
+    if errors:
+        sys.exit("❌ " + "؛ ".join(errors))
+    print("✅ بار دوم (بعد از باز کردن دوباره دیتابیس) هیچ رکوردی رو عوض نکرد")
+
+
+class Crash(Exception):
+    pass
+
+
+class ReportBot:
+    """Bot جعلی برای گزارش هفتگی؛ بعد از crash_after پیام خطا میده (شبیه خاموش شدن)"""
+
+    def __init__(self, crash_after=None):
+        self.chat_ids = []
+        self.crash_after = crash_after
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.crash_after is not None and len(self.chat_ids) >= self.crash_after:
+            raise Crash()
+        self.chat_ids.append(chat_id)
+
+
+async def run_weekly(args):
+    import bot
+
+    week_end = datetime.date(2026, 10, 15).toordinal()  # پنجشنبه
+    rng = random.Random(args.seed)
+    backend = bot.open_store(bot.DB_FILE, bot.DATA_FILE)
+    started = time.perf_counter()
+    batch = []
+    for i in range(args.weekly):
+        record = bot.UserRecord(
+            name=f"کاربر {i}", current_week=rng.randint(1, 12), streak=rng.randint(0, 30),
+            total_days=rng.randint(7, 60), start_day=week_end - 60, last_closed_day=week_end,
+            week_base=bot.WeekBase(rng.randint(0, 20), rng.randint(0, 7), 0, bot.STARTING_SKILLS),
+        )
+        if rng.random() < 0.3:
+            record.add_mock_test(week_end - 2, tuple(rng.randint(0, maximum) for _, _, maximum in bot.MOCK_SECTIONS))
+        bot.close_week(record, week_end)
+        batch.append((str(100000 + i), record))
+        if len(batch) >= 1000:
+            backend.put_many(batch)
+            batch.clear()
+    backend.put_many(batch)
+    backend.close()
+    print(f"\n=== گزارش هفتگی {args.weekly:,} کاربر ({args.backend}، ساخت {time.perf_counter() - started:.0f} s) ===")
+
+    bot.open_persistence()
+    await bot.store.wait_open()
+    resident_before = rss_mb()[0]
+    started = time.perf_counter()
+    first = ReportBot(crash_after=args.weekly // 2)
+    try:
+        await bot.send_weekly_reports(first, week_end)
+    except Crash:
+        pass
+    interrupted = time.perf_counter() - started
+    second = ReportBot()
+    started = time.perf_counter()
+    await bot.resume_weekly_reports(second)
+    resumed = time.perf_counter() - started
+    resident_after, peak = rss_mb()
+    await bot.store.close()
+
+    received = len(first.chat_ids) + len(second.chat_ids)
+    missing = args.weekly - len(set(first.chat_ids) | set(second.chat_ids))
+    total = interrupted + resumed
+    print(f"خط لوله: {total:.1f} s ({received / total:,.0f} پیام/s) | قطع بعد از {len(first.chat_ids):,} پیام، "
+          f"ادامه {len(second.chat_ids):,} پیام | تکراری: {received - args.weekly + missing} | جاافتاده: {missing}")
+    print(f"RSS اضافه: {resident_after - resident_before:.1f} MB | peak RSS: {peak:.0f} MB | "
+          f"دسته: {bot.WEEKLY_REPORT_BATCH}")
+    print(f"زمان واقعی با BROADCAST_RATE={os.getenv('BROADCAST_RATE', '25')}: "
+          f"{args.weekly / float(os.getenv('BROADCAST_RATE', '25')) / 60:.0f} دقیقه")
+
+
+def replay_stream(phases, mode, seed):
+    """گروه‌های آپدیت برای --replay؛ آپدیت‌های هر گروه همزمان پردازش میشن"""
+    rng = random.Random(seed)
+    groups = []
+    for phase in phases:
+        for kind, data in phase:
+            if mode.startswith('legacy') and kind == 'callback':
+                # دکمه قدیمی: check_block1_1 -> check_block1
+                query = data['callback_query']
+                data = dict(data, callback_query=dict(query, data=query['data'].rsplit('_', 1)[0]))
+            if mode.endswith('plain'):
+                groups.append([(kind, data)])
+                continue
+            # تلگرام بعد از timeout همون آپدیت رو دوباره می‌فرسته، گاهی همزمان با اولی
+            groups.append([(kind, data), (kind, data)] if rng.random() < 0.5 else [(kind, data)])
+            if rng.random() < 0.3:
+                groups.append([(kind, data)])
+            if kind == 'callback' and rng.random() < 0.3:
+                # دوبار زدن دکمه: callback جدید با همون data
+                tap = dict(data, update_id=data['update_id'] + 10**9)
+                tap['callback_query'] = dict(data['callback_query'], id=str(tap['update_id']))
+                groups.append([(kind, tap)])
+    return groups
+
+
+async def run_replay_mode(args, mode):
+    """پروسه فرزند --replay: پردازش جریان آپدیت و چاپ خلاصه وضعیت نهایی به صورت JSON"""
+    from telegram import Update
+    import hashlib
+    import bot
+
+    if mode.startswith('legacy'):
+        # رفتار قبل از حذف تکراری‌ها
+        bot.update_dedup.max_size = 0
+    groups = replay_stream(build_traffic(args), mode, args.seed)
+    bot.open_persistence()
+    application = bot.build_application(request=make_stub_request(0.0, args.seed), use_updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    for group in groups:
+        await asyncio.gather(*(application.process_update(Update.de_json(data, application.bot))
+                               for _, data in group))
+    states = {}
+    for user_id in range(100000, 100000 + args.users):
+        record = await bot.users.get(user_id)
+        states[user_id] = hashlib.sha1(json.dumps(record.to_dict(), sort_keys=True).encode()).hexdigest()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    print(json.dumps({'updates': sum(map(len, groups)), 'states': states}))
+
+
+def compare_replay(args):
+    """--replay: هر حالت توی پروسه و پوشه جدا، بعد مقایسه وضعیت همه کاربرا با اجرای عادی"""
+    results = {}
+    for mode in REPLAY_MODES:
+        output = subprocess.run(command_line(args, **{'replay-mode': mode}), check=True,
+                                capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(f"\n=== replay | backend: {args.backend} | کاربر: {args.users} ===")
+    print(f"{'حالت':<14} {'آپدیت':>8} {'کاربر متفاوت با اجرای بدون تکرار':>34}")
+    differences = {}
+    for mode, result in results.items():
+        expected = results[REPLAY_MODES[mode]]['states']
+        different = differences[mode] = sum(
+            1 for user_id, state in result['states'].items() if state != expected[user_id])
+        print(f"{mode:<14} {result['updates']:>8} {different:>34}")
+    # legacy فقط برای نشون دادن خرابی قبلیه؛ حالت فعلی باید دقیقاً مثل اجرای بدون تکرار باشه
+    if differences['replayed']:
+        sys.exit(f"❌ {differences['replayed']} کاربر با آپدیت‌های تکراری وضعیت متفاوت دارن")
+
+
+async def run_restart_serve(args):
+    """پروسه فرزند --restart: ترافیک کاربرای داغ از update_queue و بعد خاموش شدن مرتب (نوشتن handoff)"""
+    from telegram import Update
+    import bot
+
+    bot.open_persistence()
+    application = bot.build_application(request=make_stub_request(0.0, args.seed), use_updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    updates = 0
+    for phase in build_traffic(args):
+        for _, data in phase:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            updates += 1
+    await application.update_queue.join()
+    started = time.perf_counter()
+    await bot.drain_and_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    print(json.dumps({
+        'updates': updates, 'shutdown': time.perf_counter() - started,
+        'handoff_bytes': os.path.getsize(bot.HANDOFF_FILE),
+    }))
+
+
+async def run_restart_child(args):
+    """پروسه فرزند --restart: از شروع پروسه تا جواب اولین پیام یک کاربر داغ
+
+    پیام درست بعد از Application.start توی update_queue میره (مثل آپدیتی که
+    موقع ری‌استارت منتظر مونده) و زمان‌ها از شروع پروسه (process_age) هستن.
+    """
+    from telegram import Update
+    import bot
+
+    bot.open_persistence()
+    stub = make_stub_request(0.0, args.seed)
+    answered = asyncio.Event()
+    do_request = stub.do_request
+
+    async def watched(url, *rest, **kwargs):
+        result = await do_request(url, *rest, **kwargs)
+        if url.endswith('/sendMessage'):
+            answered.set()
+        return result
+
+    stub.do_request = watched
+    application = bot.build_application(request=stub, use_updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    user_id = 100000 + random.Random(args.seed).randrange(args.users)
+    await application.update_queue.put(Update.de_json({
+        # update_id جدید؛ شناسه‌های اجرای قبلی توی handoff تکراری حساب میشن
+        'update_id': 10**9,
+        'message': {
+            'message_id': 1, 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+            'text': "📅 برنامه امروز",
+        },
+    }, application.bot))
+    await answered.wait()
+    first_response = bot.process_age()
+    await bot.store.wait_open()
+    origin = time.perf_counter() - bot.process_age()
+    opened = next(at for phase, at in bot.STARTUP_MARKS if phase == 'باز شدن دیتابیس') - origin
+    await bot.drain_and_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    print(json.dumps({'first_response': first_response, 'opened': opened, 'peak_mb': rss_mb()[1]}))
+
+
+def bench_restart(args):
+    """--restart: یک بار کار و خاموش شدن، بعد ری‌استارت سرد و با handoff از روی کپی همون فایل‌ها"""
+    import bot
+
+    root = os.getcwd()
+    state = os.path.join(root, 'state')
+    os.mkdir(state)
+    os.chdir(state)
+    write_users_file(bot.DATA_FILE, args.restart, args.seed)
+    env = dict(os.environ, DB_FILE=os.path.join(state, 'user_data.sqlite3'))
+    output = subprocess.run(command_line(args, **{'restart-phase': 'serve'}), env=env, check=True,
+                            capture_output=True, text=True).stdout
+    serve = json.loads(output.strip().splitlines()[-1])
+    print(f"\n=== ری‌استارت | backend: {args.backend} | کاربر: {args.restart:,} (داغ: {args.users:,}) ===")
+    print(f"خاموش شدن بعد از {serve['updates']:,} آپدیت: {serve['shutdown']:.2f} s | "
+          f"handoff: {serve['handoff_bytes'] / 2**20:.1f} MB")
+    print(f"{'حالت':<8} {'اولین جواب s (کمترین/میانه)':>28} {'باز شدن دیتابیس s':>18} {'peak RSS MB':>12}")
+    for mode in ('cold', 'handoff'):
+        results = []
+        for run_index in range(RESTART_RUNS):
+            # هر اجرا از روی همون فایل‌ها؛ handoff بعد از خوندن پاک میشه و دیتابیس تغییر می‌کنه
+            workdir = os.path.join(root, f'{mode}{run_index}')
+            shutil.copytree(state, workdir)
+            if mode == 'cold':
+                os.remove(os.path.join(workdir, bot.HANDOFF_FILE))
+            os.chdir(workdir)
+            env = dict(os.environ, DB_FILE=os.path.join(workdir, 'user_data.sqlite3'))
+            output = subprocess.run(command_line(args, **{'restart-phase': mode}), env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        first = sorted(result['first_response'] for result in results)
+        opened = percentile([result['opened'] for result in results], 50)
+        peak = max(result['peak_mb'] for result in results)
+        print(f"{mode:<8} {f'{first[0]:.2f} / {percentile(first, 50):.2f}':>28} {opened:>18.2f} {peak:>12.0f}")
+
+
+async def run_locks(args):
+    """--locks: همه tapهای همه کاربرها با هم، در برابر همون tapها پشت‌سرهم روی کپی رکوردها
+
+    هر مورد چک‌لیست هر کاربر یا فقط با دکمه وضعیت مقصد زده میشه یا فقط با
+    toggle قدیمی، تا نتیجه به ترتیب tapها بستگی نداشته باشه (toggle ها با هم
+    و set های همون مقدار با هم جابجا میشن)؛ پس هر اختلافی یعنی تغییر گم شده.
+    """
+    from telegram import Update
+    import bot
+
+    rng = random.Random(args.seed)
+    today = bot.today_number()
+    expected = {}
+    backend = bot.open_store(bot.DB_FILE, bot.DATA_FILE)
+    for i in range(args.users):
+        record = bot.UserRecord(
+            name=f"کاربر {i}", streak=rng.randint(0, 30), total_days=rng.randint(0, 60),
+            penalty=rng.randint(0, 10) * bot.DAILY_PENALTY, checklist=rng.randrange(1 << len(bot.CHECKLIST_ITEMS)),
+            last_checklist_day=today, start_day=today - 60, last_closed_day=today - 1,
+        )
+        backend.put(str(100000 + i), record)
+        expected[100000 + i] = record.copy()
+    backend.close()
+
+    updates = []
+    for user_id, record in expected.items():
+        for item in bot.CHECKLIST_ITEMS:
+            taps = rng.randint(1, 2 * args.rounds)
+            if rng.random() < 0.5:
+                target = rng.randrange(2)
+                data = f"check_{item}_{target}"
+                record.set_checked(item, target)
+            else:
+                data = f"check_{item}"
+                for _ in range(taps):
+                    record.toggle(item)
+            for _ in range(taps):
+                update_id = len(updates) + 1
+                updates.append({
+                    'update_id': update_id,
+                    'callback_query': {
+                        'id': str(update_id), 'chat_instance': str(user_id), 'data': data,
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+                        'message': {
+                            'message_id': 1, 'date': int(time.time()),
+                            'chat': {'id': user_id, 'type': 'private'}, 'text': '📋',
+                        },
+                    },
+                })
+    rng.shuffle(updates)
+
+    bot.open_persistence()
+    application = bot.build_application(request=make_stub_request(0.0, args.seed), use_updater=False)
+    await application.initialize()
+    await application.post_init(application)
+    started = time.perf_counter()
+    await asyncio.gather(*(application.process_update(Update.de_json(data, application.bot)) for data in updates))
+    elapsed = time.perf_counter() - started
+
+    async def differing():
+        different = 0
+        for user_id, record in expected.items():
+            if (await bot.users.get(user_id)).to_dict() != record.to_dict():
+                different += 1
+        return different
+
+    after_taps = await differing()
+    # بستن روز: Streak و جریمه از چک‌لیست نهایی حساب میشن
+    await bot.run_rollover(bot.day_str(today + 1))
+    for record in expected.values():
+        bot.rollover_user(record, today + 1)
+    after_rollover = await differing()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    print(f"\n=== callback همزمان | backend: {bot.STORAGE_BACKEND} | کاربر: {args.users} | tap: {len(updates):,} ===")
+    print(f"همه با هم: {elapsed:.2f} s ({len(updates) / elapsed:,.0f} update/s)")
+    print(f"کاربر متفاوت با اجرای پشت‌سرهم: بعد از tapها {after_taps}، بعد از بستن روز {after_rollover}")
+    if after_taps or after_rollover:
+        sys.exit(f"{after_taps + after_rollover} اختلاف")
+
+
+# فایل برنامه خراب: (اسم، مسیر داخل JSON، مقدار جدید)؛ مسیر () یعنی کل فایل و None یعنی متن خام
+MALFORMED_PROGRAMS = (
+    ('checklist: رشته', ('checklist', 0), 'block1'),
+    ('weeks: رشته', ('weeks', 0), 'هفته اول'),
+    ('weeks: لیست خالی', ('weeks',), []),
+    ('days: رشته', ('days', 'شنبه'), 'آزاد'),
+    ('blocks: عدد', ('days', 'یکشنبه', 'blocks'), 5),
+    ('block: ساعت نامعتبر', ('days', 'یکشنبه', 'blocks', 0), ['8', 'x']),
+    ('block: نیست در schedule', ('days', 'یکشنبه', 'blocks', 0, 0), '08:15'),
+    ('ریشه: لیست', (), []),
+    ('JSON نامعتبر', None, '{"id": "b1",'),
+)
+
+
+def check_programs(args):
+    """--programs: هر فایل خراب کنار یک تغییر درست در همون دور reload"""
+    import bot
+
+    with open(os.path.join(bot.PROGRAMS_DIR, f'{bot.DEFAULT_PROGRAM}.json'), encoding='utf-8') as f:
+        source = json.load(f)
+    os.mkdir('programs')
+    stamps = itertools.count(10**18, 10**9)
+
+    def write(name, data):
+        path = os.path.join('programs', f'{name}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False))
+        # mtime متفاوت حتی اگه اندازه و ثانیه فایل عوض نشده باشه
+        stamp = next(stamps)
+        os.utime(path, ns=(stamp, stamp))
+
+    def program(program_id, version):
+        return dict(copy.deepcopy(source), id=program_id, version=version)
+
+    write(bot.DEFAULT_PROGRAM, program(bot.DEFAULT_PROGRAM, 1))
+    write('b1', program('b1', 1))
+    registry = bot.ProgramRegistry('programs', bot.DEFAULT_PROGRAM)
+    registry.get()
+    print(f"\n=== فایل برنامه خراب در reload ({len(MALFORMED_PROGRAMS)} حالت) ===")
+    print(f"{'حالت':<24} {'b1':>4} {bot.DEFAULT_PROGRAM:>8}  نتیجه")
+    failures = 0
+    for version, (name, keys, value) in enumerate(MALFORMED_PROGRAMS, 2):
+        if not keys:
+            broken = value
+        else:
+            broken = program('b1', version)
+            target = broken
+            for key in keys[:-1]:
+                target = target[key]
+            target[keys[-1]] = value
+        write('b1', broken)
+        write(bot.DEFAULT_PROGRAM, program(bot.DEFAULT_PROGRAM, version))
+        try:
+            changed = registry.reload()
+            error = None
+        except Exception as e:
+            changed, error = [], e
+        kept = registry.get('b1').version == 1
+        applied = registry.get().version == version and changed == [bot.DEFAULT_PROGRAM]
+        ok = error is None and kept and applied
+        failures += not ok
+        result = '✅' if ok else f"❌ {type(error).__name__ if error else ''} {error or ''}".strip()
+        print(f"{name:<24} {registry.get('b1').version:>4} {registry.get().version:>8}  {result}")
+    if failures:
+        sys.exit(f"{failures} حالت ناموفق")
+
+
+def expected_fires(reminders, start, end):
+    """[(زمان، (ساعت، روز، نوع))] اجراهای بین start (نه خودش) و end، بدون ReminderScheduler"""
+    import bot
+
+    fires = []
+    day = start.date()
+    while day <= end.date():
+        for at, weekday, kind, _ in reminders:
+            if weekday not in (None, bot.PERSIAN_WEEKDAYS[day.weekday()]):
+                continue
+            hour, minute = map(int, at.split(':'))
+            fire_at = datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=bot.TIMEZONE)
+            if start < fire_at <= end:
+                fires.append((fire_at, (at, weekday, kind)))
+        day += datetime.timedelta(days=1)
+    return sorted(fires)
+
+
+class FakeClock:
+    """ساعت جعلی برای ReminderScheduler؛ sleep فقط ساعت رو جلو می‌بره"""
+
+    class Done(Exception):
+        pass
+
+    def __init__(self, now, until=None):
+        self.now = now
+        self.until = until
+        self.fired = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+        if self.until is not None and self.now > self.until:
+            raise self.Done
+
+    async def send(self, reminder, fire_at):
+        # (زمان اجرای برنامه‌ریزی‌شده، کلید، ساعت واقعی اجرا)
+        self.fired.append((fire_at, reminder[:3], self.now))
+
+    def scheduler(self, reminders):
+        import bot
+
+        return bot.ReminderScheduler(self.send, reminders, clock=self, sleep=self.sleep)
+
+    async def run(self, scheduler, until):
+        """ReminderScheduler.run تا وقتی ساعت از until رد بشه"""
+        self.until = until
+        with contextlib.suppress(self.Done):
+            await scheduler.run()
+
+
+def compare_fires(fired, expected, max_late):
+    """خطای اول در مقایسه اجراها با expected_fires، یا None"""
+    planned = sorted((fire_at, key) for fire_at, key, _ in fired)
+    if planned != expected:
+        missing = [f"{fire_at:%m-%d %H:%M} {key[2]}" for fire_at, key in sorted(set(expected) - set(planned))]
+        extra = [f"{fire_at:%m-%d %H:%M} {key[2]}" for fire_at, key in sorted(set(planned) - set(expected))]
+        duplicated = len(planned) - len(set(planned))
+        return f"{len(missing)} جاافتاده {missing[:2]}، {len(extra)} اضافه {extra[:2]}، {duplicated} تکراری"
+    if [fire_at for fire_at, _, _ in fired] != [fire_at for fire_at, _ in expected]:
+        return "ترتیب اجرا به ترتیب زمان نیست"
+    late = max(((at - fire_at).total_seconds() for fire_at, _, at in fired), default=0)
+    if late > max_late:
+        return f"{late:.0f} ثانیه دیرتر از بیدار شدن بعدی"
+    return None
+
+
+async def check_scheduler(args):
+    """--scheduler: ReminderScheduler با ساعت جعلی در برابر expected_fires"""
+    import bot
+
+    rng = random.Random(args.seed)
+    start = SCHEDULER_START.replace(tzinfo=bot.TIMEZONE)
+    end = start + datetime.timedelta(days=SCHEDULER_DAYS)
+    reminders = bot.build_reminders() + [(bot.WEEKLY_REPORT_TIME, 'جمعه', 'weekly_report', None)]
+    expected = expected_fires(reminders, start, end)
+    results = []
+
+    # run_pending با بیدار شدن‌های نامنظم (event loop شلوغ): هر یادآور در اولین بیدار شدن بعد از وقتش
+    clock = FakeClock(start)
+    scheduler = clock.scheduler(reminders)
+    max_step = 0
+    while clock.now < end:
+        step = datetime.timedelta(seconds=rng.randint(1, 97 * 60))
+        max_step = max(max_step, step.total_seconds())
+        clock.now = min(clock.now + step, end)
+        await scheduler.run_pending()
+    results.append(("run_pending نامنظم", len(clock.fired), compare_fires(clock.fired, expected, max_step)))
+
+    # run با sleep جعلی: هر یادآور دقیقاً سر وقتش
+    clock = FakeClock(start)
+    await clock.run(clock.scheduler(reminders), end)
+    results.append(("run با sleep جعلی", len(clock.fired), compare_fires(clock.fired, expected, 0)))
+
+    # catch_up: پروسه قبلی old_at خاموش شده و پروسه جدید new_at بالا اومده
+    friday = start + datetime.timedelta(days=(4 - start.weekday()) % 7)
+    report_at = friday.replace(hour=15, minute=0)
+    # (اسم، خاموش شدن، بالا اومدن، handoff داره؟، جاافتاده‌ها باید اجرا بشن؟)
+    handoff_cases = (
+        ("catch_up: ری‌استارت 30 ثانیه", report_at - datetime.timedelta(seconds=10),
+         report_at + datetime.timedelta(seconds=20), True, True),
+        ("catch_up: دیرتر از حد", report_at - datetime.timedelta(seconds=10),
+         report_at + datetime.timedelta(seconds=bot.HANDOFF_CATCHUP + 1), True, False),
+        ("catch_up: هنوز وقتش نشده", report_at - datetime.timedelta(hours=1),
+         report_at - datetime.timedelta(minutes=30), True, True),
+        ("بدون handoff", report_at - datetime.timedelta(seconds=10),
+         report_at + datetime.timedelta(seconds=20), False, False),
+    )
+    for name, old_at, new_at, has_handoff, catches_up in handoff_cases:
+        clock = FakeClock(new_at)
+        scheduler = clock.scheduler(reminders)
+        if has_handoff:
+            scheduler.catch_up(FakeClock(old_at).scheduler(reminders).due_times(), bot.HANDOFF_CATCHUP)
+        await scheduler.run_pending()
+        caught = expected_fires(reminders, old_at, new_at) if catches_up else []
+        error = compare_fires(clock.fired, caught, bot.HANDOFF_CATCHUP)
+        count = len(clock.fired)
+        # بعد از جبران، زمان‌بند باید دقیقاً مثل یک پروسه تازه ادامه بده
+        if error is None and scheduler.due_times() != FakeClock(new_at).scheduler(reminders).due_times():
+            error = "زمان اجرای بعدی با زمان‌بند تازه یکی نیست"
+        if error is None:
+            clock.fired = []
+            week_later = new_at + datetime.timedelta(days=7)
+            await clock.run(scheduler, week_later)
+            error = compare_fires(clock.fired, expected_fires(reminders, new_at, week_later), 0)
+        results.append((name, count, error))
+
+    # replace وسط روز: یادآور حذف‌شده دیگه اجرا نمیشه، جدیدها از همون لحظه به بعد
+    replace_at = start.replace(hour=7, minute=0, second=30)
+    changed = [reminder for reminder in reminders if reminder[2] != 'nudge'] + [
+        ('07:00', None, 'extra', None), ('07:30', None, 'extra', None), ('15:00', 'شنبه', 'block', None),
+    ]
+    clock = FakeClock(start)
+    scheduler = clock.scheduler(reminders)
+    await clock.run(scheduler, replace_at)
+    scheduler.replace(changed)
+    await clock.run(scheduler, end)
+    error = compare_fires(
+        clock.fired, expected_fires(reminders, start, replace_at) + expected_fires(changed, replace_at, end), 0,
+    )
+    results.append(("replace ساعت 07:00:30", len(clock.fired), error))
+
+    print(f"\n=== زمان‌بند یادآورها با ساعت جعلی ({len(reminders)} یادآور، {SCHEDULER_DAYS} روز) ===")
+    print(f"{'حالت':<30} {'اجرا':>6}  نتیجه")
+    for name, count, error in results:
+        print(f"{name:<30} {count:>6}  {'✅' if error is None else f'❌ {error}'}")
+    failures = sum(error is not None for _, _, error in results)
+    if failures:
+        sys.exit(f"{failures} حالت ناموفق")
+
+
+def main():
+    args = parse_args()
+    if args.data_command:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        run_data_command(args.data_command.split())
+        return
+    if args.replay_mode:
+        # هر حالت دیتابیس خودش رو داره
+        os.chdir(tempfile.mkdtemp(dir=os.getcwd()))
+        os.environ['DB_FILE'] = os.path.abspath('user_data.sqlite3')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import logging
+        logging.disable(logging.WARNING)
+        asyncio.run(run_replay_mode(args, args.replay_mode))
+        return
+    if args.store_mode:
+        os.chdir(tempfile.mkdtemp(dir=os.getcwd()))
+        os.environ['DB_FILE'] = os.path.abspath('user_data.sqlite3')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import logging
+        logging.disable(logging.INFO)
+        asyncio.run(run_store_mode(args))
+        return
+    if args.restart_phase:
+        # پروسه فرزند --restart: env و پوشه کاری رو bench_restart تنظیم کرده
+        os.chdir(os.path.dirname(os.environ['DB_FILE']))
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import logging
+        logging.disable(logging.WARNING)
+        asyncio.run(run_restart_serve(args) if args.restart_phase == 'serve' else run_restart_child(args))
+        return
+    if args.worker or args.load_form or args.rollover_child:
+        # پروسه فرزند: env و پوشه کاری رو پروسه اصلی (یا dispatcher) تنظیم کرده
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import logging
+        logging.disable(logging.INFO)
+        if args.worker:
+            asyncio.run(run_worker(args))
+        elif args.rollover_child:
+            asyncio.run(run_rollover_child(args))
+        else:
+            measure_load(args.load_form)
+        return
+    if args.backend == 'all':
+        # هر backend توی پروسه جدا، چون bot.py تنظیمات رو موقع import از env می‌خونه
+        for backend in BACKENDS:
+            subprocess.run(command_line(args, backend=backend, shards=args.shards), check=True)
+        return
+    if args.shards and len(args.shards) > 1:
+        for shard_count in args.shards:
+            subprocess.run(command_line(args, shards=[shard_count]), check=True)
+        return
+
+    # پوشه‌های پروسه‌های فرزند (--replay، --store-io، --restart) هم زیر همین پوشه ساخته میشن
+    workdir = tempfile.mkdtemp(prefix='telc-loadtest-')
+    try:
+        run_in_workdir(args, workdir)
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        if args.keep:
+            print(f"پوشه کاری: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_in_workdir(args, workdir):
+    """اجرای حالت انتخاب‌شده داخل پوشه کاری موقت"""
+    os.chdir(workdir)
+    os.environ.update({
+        'BOT_TOKEN': '123456:LOADTEST',
+        'STORAGE_BACKEND': args.backend,
+        'DB_FILE': os.path.join(workdir, 'user_data.sqlite3'),
+        'REMINDERS_ENABLED': '0',
+        'RATE_LIMITER_ENABLED': '1' if args.rate_limit else '0',
+        'CONCURRENT_UPDATES': str(args.concurrency),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    logging.disable(logging.INFO)
+    if args.memory:
+        compare_memory(args)
+    elif args.replay:
+        compare_replay(args)
+    elif args.leaderboard:
+        bench_leaderboard(args)
+    elif args.export:
+        bench_export(args)
+    elif args.weekly:
+        asyncio.run(run_weekly(args))
+    elif args.restart:
+        bench_restart(args)
+    elif args.programs:
+        check_programs(args)
+    elif args.locks:
+        asyncio.run(run_locks(args))
+    elif args.scheduler:
+        asyncio.run(check_scheduler(args))
+    elif args.rollover:
+        bench_rollover(args)
+    elif args.render:
+        bench_render(args)
+    elif args.store_io:
+        compare_store_io(args)
+    elif args.shards:
+        asyncio.run(run_sharded(args, args.shards[0]))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()